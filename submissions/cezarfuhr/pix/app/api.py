@@ -1,27 +1,270 @@
 import logging
-from fastapi import APIRouter, Depends, Request
+from typing import AsyncIterator, Iterator, List, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
-from .models import PayoutBatch, PayoutReport
-from .services import PayoutService
+from .core.config import settings
+from .async_database import get_async_session_factory
+from .database import SessionLocal
+from .ingestion import NDJSON_MEDIA_TYPE, NDJSONBatchParser, NDJSONIngestionError, NDJSONLineTooLong
+from .models import BatchJobStatus, BatchSummary, BatchSummaryPage, PayoutBatch, PayoutDetail, PayoutItem, PayoutReport
+from .services import AsyncPayoutService, PayoutService, ReportBuilder
 from .dependencies import validate_api_key, get_db_session
-from .limiter import limiter
+from .jobs import job_status, submit_batch
+from .limiter import RateLimitExceeded, limiter
+from .metrics import stage_timer, track_batch
+from .replays import (
+    IDEMPOTENCY_KEY_HEADER, REPLAYED_HEADER, BatchReplay, IdempotencyKeyInProgress, IdempotencyKeyReused,
+    idempotency_key, request_hash,
+)
+from .repository import BatchJobRepository, BatchSummaryRepository
+from .streaming import NDJSONStreamingResponse, detail_lines, error_line, summary_line, wants_stream
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+STREAM_QUERY = Query(False, description="Responde em NDJSON: uma linha por item e um registro `summary` no fim")
+NDJSON_RESPONSE = {"content": {NDJSON_MEDIA_TYPE: {}}, "description": "Relatorio em streaming (`stream=true`)"}
+
 @router.post(
     "/payouts/batch",
     response_model=PayoutReport,
+    responses={
+        200: NDJSON_RESPONSE,
+        202: {"model": BatchJobStatus, "description": "Lote aceito para processamento assincrono"},
+        409: {"description": "A primeira execucao desta Idempotency-Key ainda nao terminou"},
+    },
     tags=["Payouts"],
     dependencies=[Depends(validate_api_key)]
 )
-@limiter.limit("5/minute")
-def process_payout_batch(
+async def process_payout_batch(
     request: Request,
     batch: PayoutBatch,
+    mode: Literal["sync", "async"] = Query("sync", description="`async` responde 202 e processa em background"),
+    stream: bool = STREAM_QUERY,
+    idempotency_key_header: Optional[str] = Header(
+        None,
+        alias=IDEMPOTENCY_KEY_HEADER,
+        max_length=255,
+        description="Replays com o mesmo corpo recebem o relatorio da primeira execucao",
+    ),
     db: Session = Depends(get_db_session)
-) -> PayoutReport:
+):
+    """
+    Com DB_ASYNC_ENABLED o lote e liquidado sobre o engine assincrono;
+    caso contrario o caminho sincrono roda no threadpool.
+
+    Com `Idempotency-Key` (ou IDEMPOTENCY_KEY_FROM_BATCH_ID), o relatorio
+    sincrono da primeira execucao e gravado e devolvido nos replays.
+    """
     logger.info(f"Payout batch received: {batch.batch_id}")
-    service = PayoutService(db_session=db)
-    return service.process_batch(batch)
+    replay = None
+    key = idempotency_key(idempotency_key_header, batch.batch_id)
+    # `mode=async` ja e idempotente por batch_id (batch_jobs) e o streaming nao e gravado
+    if key is not None and mode == "sync" and not wants_stream(request, stream):
+        replay = BatchReplay(db, key, batch.batch_id, request_hash(await request.body()))
+        try:
+            content = await replay.acquire()
+        except IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key already used with a different request body",
+            )
+        except IdempotencyKeyInProgress:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed",
+                headers={"Retry-After": str(max(1, round(settings.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS)))},
+            )
+        if content is not None:
+            return Response(content=content, media_type="application/json", headers={REPLAYED_HEADER: "true"})
+
+    try:
+        await run_in_threadpool(limiter.hit, request, len(batch.items))
+        if mode == "async":
+            job = await run_in_threadpool(submit_batch, db, batch)
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=job_status(job).model_dump(mode="json"),
+            )
+
+        if wants_stream(request, stream):
+            return NDJSONStreamingResponse(_stream_batch_report(batch))
+
+        if settings.DB_ASYNC_ENABLED:
+            async with get_async_session_factory()() as async_db:
+                report = await AsyncPayoutService(db_session=async_db).process_batch(batch)
+        else:
+            service = PayoutService(db_session=db)
+            report = await run_in_threadpool(service.process_batch, batch)
+        content = _report_json(report)
+    except BaseException:
+        # Libera a chave para que o cliente possa repetir a requisicao
+        if replay is not None:
+            await replay.release()
+        raise
+
+    if replay is not None:
+        await replay.complete(content)
+    return Response(content=content, media_type="application/json")
+
+def _report_json(report: PayoutReport) -> bytes:
+    """Serializa o relatorio direto pelo pydantic, medindo a etapa de serializacao."""
+    with stage_timer("serialization"):
+        return report.model_dump_json().encode()
+
+def _stream_batch_report(batch: PayoutBatch) -> Iterator[bytes]:
+    """Emite cada chunk assim que e persistido; apenas os contadores ficam em memoria."""
+    # Sessao propria: o gerador roda depois que o endpoint retorna
+    db = SessionLocal()
+    try:
+        builder = ReportBuilder(batch.batch_id, keep_details=False)
+        with track_batch():
+            for details in PayoutService(db_session=db).iter_chunks(batch.items, batch.batch_id):
+                builder.add(details)
+                yield detail_lines(details)
+        yield summary_line(builder.build())
+    finally:
+        db.close()
+
+@router.get(
+    "/payouts/batch/{batch_id}",
+    response_model=BatchJobStatus,
+    tags=["Payouts"],
+    dependencies=[Depends(validate_api_key)]
+)
+def get_payout_batch_job(batch_id: str, db: Session = Depends(get_db_session)) -> BatchJobStatus:
+    job = BatchJobRepository(db).get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch job not found")
+    return job_status(job)
+
+@router.get(
+    "/payouts/batches",
+    response_model=BatchSummaryPage,
+    tags=["Payouts"],
+    dependencies=[Depends(validate_api_key)]
+)
+def list_batch_reports(
+    limit: int = Query(50, ge=1, le=500, description="Lotes por pagina"),
+    after: Optional[str] = Query(None, description="`next_cursor` da pagina anterior"),
+    db: Session = Depends(get_db_session),
+) -> BatchSummaryPage:
+    """Lista os agregados por lote em ordem de `batch_id`, paginando por cursor."""
+    # Um a mais que o limite indica se ha proxima pagina sem um COUNT(*)
+    rows = BatchSummaryRepository(db).list(limit + 1, after)
+    items = [BatchSummary.model_validate(row) for row in rows[:limit]]
+    next_cursor = items[-1].batch_id if len(rows) > limit else None
+    return BatchSummaryPage(items=items, next_cursor=next_cursor)
+
+@router.get(
+    "/payouts/batches/{batch_id}/report",
+    response_model=BatchSummary,
+    tags=["Payouts"],
+    dependencies=[Depends(validate_api_key)]
+)
+def get_batch_report(batch_id: str, db: Session = Depends(get_db_session)) -> BatchSummary:
+    """Contadores e totais por status do lote, lidos do agregado `batch_summary` (sem varrer `payouts`)."""
+    summary = BatchSummaryRepository(db).get(batch_id)
+    if summary is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch report not found")
+    return BatchSummary.model_validate(summary)
+
+@router.post(
+    "/payouts/batch/ndjson",
+    response_model=PayoutReport,
+    responses={200: NDJSON_RESPONSE},
+    tags=["Payouts"],
+    dependencies=[Depends(validate_api_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}}},
+            "description": "Linha 1: `{\"batch_id\": ...}`; demais linhas: um PayoutItem por linha",
+        }
+    },
+)
+async def process_payout_batch_ndjson(request: Request, response: Response, stream: bool = STREAM_QUERY):
+    """
+    Ingestao incremental de lotes grandes: os itens sao validados e
+    liquidados em chunks conforme o corpo chega, sem bufferizar o lote.
+    Se uma linha for invalida, os chunks anteriores ja foram liquidados;
+    reenviar o lote corrigido e seguro, pois eles voltam como duplicatas.
+
+    Em modo streaming a resposta comeca antes do fim do upload, entao uma
+    linha invalida vira um registro `error` no fim do NDJSON, nao um 422.
+    Sem streaming, o relatorio traz ate NDJSON_REPORT_MAX_DETAILS detalhes
+    (a memoria nao cresce com o lote) e uma linha maior que o limite do
+    parser responde 413.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != NDJSON_MEDIA_TYPE:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type must be {NDJSON_MEDIA_TYPE}"
+        )
+
+    await run_in_threadpool(limiter.hit, request)
+    parser = NDJSONBatchParser(chunk_size=settings.NDJSON_CHUNK_SIZE)
+    if wants_stream(request, stream):
+        return NDJSONStreamingResponse(_stream_ndjson_report(request, parser))
+
+    builder = ReportBuilder(batch_id="", max_details=settings.NDJSON_REPORT_MAX_DETAILS)
+    try:
+        async for details in _settle_ndjson(request, parser):
+            builder.add(details)
+    except NDJSONIngestionError as exc:
+        raise HTTPException(
+            status_code=413 if isinstance(exc, NDJSONLineTooLong) else 422,
+            detail={
+                "line": exc.line_number,
+                "error": exc.message,
+                "processed_before_error": builder.item_count,
+            }
+        )
+
+    logger.info(f"NDJSON payout batch processed: {parser.batch_id} ({parser.item_count} items)")
+    builder.batch_id = parser.batch_id
+    if builder.truncated:
+        response.headers["X-Report-Details-Truncated"] = "true"
+    return builder.build()
+
+async def _settle_ndjson(request: Request, parser: NDJSONBatchParser) -> AsyncIterator[List[PayoutDetail]]:
+    """
+    Le o corpo em streaming e liquida cada chunk completo no threadpool.
+    A quota de itens e cobrada chunk a chunk, pois o tamanho do lote so e conhecido no fim.
+    """
+    db = SessionLocal()
+
+    def settle(chunk: List[PayoutItem]) -> List[PayoutDetail]:
+        limiter.hit_items(request, len(chunk))
+        return service.process_items(chunk, parser.batch_id)
+
+    try:
+        service = PayoutService(db_session=db)
+        with track_batch():
+            async for data in request.stream():
+                for chunk in parser.feed(data):
+                    yield await run_in_threadpool(settle, chunk)
+            for chunk in parser.close():
+                yield await run_in_threadpool(settle, chunk)
+    finally:
+        await run_in_threadpool(db.close)
+
+async def _stream_ndjson_report(request: Request, parser: NDJSONBatchParser) -> AsyncIterator[bytes]:
+    builder = ReportBuilder(batch_id="", keep_details=False)
+    try:
+        async for details in _settle_ndjson(request, parser):
+            builder.add(details)
+            yield detail_lines(details)
+    except NDJSONIngestionError as exc:
+        yield error_line(exc.message, line=exc.line_number, processed_before_error=builder.item_count)
+        return
+    except RateLimitExceeded as exc:
+        yield error_line(f"Rate limit exceeded: {exc}", processed_before_error=builder.item_count)
+        return
+
+    builder.batch_id = parser.batch_id
+    yield summary_line(builder.build())
@@ -0,0 +1,51 @@
+"""
+Engine e sessoes assincronas (opcional, `DB_ASYNC_ENABLED=true`).
+
+Requer o extra `async` do projeto (`asyncpg` para Postgres, `aiosqlite` para
+SQLite). O engine so e criado no primeiro uso, entao o driver nao precisa
+estar instalado quando o modo assincrono esta desligado.
+"""
+from typing import TYPE_CHECKING, Optional
+
+from .core.config import settings
+from .database import pool_options
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_async_engine: Optional["AsyncEngine"] = None
+_async_session_factory: Optional["async_sessionmaker"] = None
+
+
+def async_database_url(url: str) -> str:
+    """Troca o driver sincrono da URL pelo equivalente assincrono."""
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+def get_async_session_factory() -> "async_sessionmaker":
+    global _async_engine, _async_session_factory
+    if _async_session_factory is None:
+        # Import tardio: sqlalchemy.ext.asyncio so e carregado quando o modo e usado
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL)
+        options = pool_options(url)
+        options.pop("connect_args", None)
+        _async_engine = create_async_engine(url, **options)
+        _async_session_factory = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_session_factory
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
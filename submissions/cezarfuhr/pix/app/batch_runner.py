@@ -0,0 +1,249 @@
+"""
+Execucao offline de um lote em arquivo JSON (`python -m app.cli run lote.json`).
+
+O arquivo tem o formato de `POST /payouts/batch` e e lido em streaming pelo
+JSONBatchFileReader. Cada item vai para o shard `crc32(external_id) % N`, e
+cada shard e um processo com o seu PayoutService: como todas as ocorrencias
+de um id caem no mesmo shard, as repeticoes sao colapsadas dentro do processo
+e a consulta de duplicatas nunca disputa o mesmo id entre processos.
+
+O processo principal grava um checkpoint (JSON) a cada
+CLI_CHECKPOINT_INTERVAL_SECONDS com, por shard, o ultimo item ja
+persistido, os contadores acumulados e o menor offset do arquivo ainda nao
+confirmado por todos os shards. Uma execucao interrompida e retomada por esse
+offset, e os itens ja persistidos de cada shard sao pulados sem nova consulta
+ao banco. Chunks persistidos depois do ultimo checkpoint sao reprocessados e
+aparecem como `duplicate` no relatorio; nenhum pagamento e repetido.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+from collections import Counter, deque
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .core.config import settings
+from .core.gc_config import configure_gc
+from .database import SessionLocal
+from .ingestion import BatchFileError, JSONBatchFileReader
+from .models import PayoutItem
+from .services import PayoutService, ReportBuilder
+
+logger = logging.getLogger(__name__)
+
+# Chunks enfileirados por shard: limita a memoria quando um shard fica para tras
+SHARD_QUEUE_CHUNKS = 2
+
+
+def shard_of(external_id: str, shards: int) -> int:
+    # crc32 e estavel entre processos e execucoes, ao contrario de hash()
+    return zlib.crc32(external_id.encode()) % shards
+
+
+@dataclass
+class Checkpoint:
+    path: str
+    size: int
+    batch_id: str
+    shards: int
+    # Primeiro item (offset em bytes e sequencia) ainda nao persistido por todos os shards
+    offset: int
+    seq: int
+    # Sequencia do ultimo item persistido por shard (-1: nenhum)
+    committed: List[int]
+    counts: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, checkpoint_path: str) -> Optional["Checkpoint"]:
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path) as handle:
+            return cls(**json.load(handle))
+
+    def save(self, checkpoint_path: str) -> None:
+        # Escrita atomica: um processo morto no meio nao corrompe o checkpoint anterior
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w") as handle:
+            json.dump(asdict(self), handle)
+        os.replace(tmp_path, checkpoint_path)
+
+
+def _shard_main(shard: int, batch_id: str, inbox: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    """Processo de um shard: liquida os chunks recebidos e devolve os contadores de cada um."""
+    configure_gc()
+    db = SessionLocal()
+    try:
+        service = PayoutService(db_session=db)
+        seen: set = set()
+        while (message := inbox.get()) is not None:
+            last_seq, items = message
+            details = service.process_items(items, batch_id, seen)
+            results.put((shard, last_seq, dict(Counter(detail.status for detail in details)), None))
+    except Exception as exc:
+        logger.exception("batch_shard_failed", extra={"shard": shard, "event": "batch_shard_failed"})
+        results.put((shard, None, None, repr(exc)))
+    finally:
+        db.close()
+
+
+class ShardedBatchRun:
+    """Le o arquivo, distribui os itens pelos shards e mantem o checkpoint."""
+
+    def __init__(
+        self,
+        path: str,
+        processes: int,
+        chunk_size: int = settings.PAYOUT_WRITE_CHUNK_SIZE,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval: float = settings.CLI_CHECKPOINT_INTERVAL_SECONDS,
+    ):
+        self.path = os.path.abspath(path)
+        self.shards = processes
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path or f"{path}.checkpoint"
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint: Optional[Checkpoint] = None
+        self.counts: Counter = Counter()
+        self._buffers: List[List[PayoutItem]] = [[] for _ in range(processes)]
+        # (seq, offset) do primeiro item de cada buffer ainda nao despachado
+        self._buffer_starts: List[Optional[Tuple[int, int]]] = [None] * processes
+        # Chunks despachados e ainda nao persistidos: (primeiro seq, offset, ultimo seq)
+        self._pending: List[Deque[Tuple[int, int, int]]] = [deque() for _ in range(processes)]
+        self._last_saved = 0.0
+
+    def run(self) -> dict:
+        size = os.path.getsize(self.path)
+        checkpoint = Checkpoint.load(self.checkpoint_path)
+        if checkpoint is not None and (checkpoint.path, checkpoint.size, checkpoint.shards) != (self.path, size, self.shards):
+            raise BatchFileError(
+                f"checkpoint {self.checkpoint_path} belongs to another file or shard count; remove it to start over"
+            )
+
+        with open(self.path, "rb") as stream:
+            if checkpoint is None:
+                reader = JSONBatchFileReader(stream)
+                batch_id = reader.read_header()
+                self.checkpoint = Checkpoint(
+                    path=self.path, size=size, batch_id=batch_id, shards=self.shards,
+                    offset=reader.position, seq=0, committed=[-1] * self.shards,
+                )
+            else:
+                reader = JSONBatchFileReader(stream, batch_id=checkpoint.batch_id, offset=checkpoint.offset)
+                self.checkpoint = checkpoint
+                self.counts.update(checkpoint.counts)
+                logger.info(
+                    "batch_run_resumed",
+                    extra={"offset": checkpoint.offset, "seq": checkpoint.seq, "event": "batch_run_resumed"},
+                )
+
+            self._start_shards(self.checkpoint.batch_id)
+            try:
+                self._dispatch_all(reader)
+                self._finish()
+            except BaseException:
+                self._stop_shards()
+                self._save_checkpoint(force=True)
+                raise
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        builder = ReportBuilder(self.checkpoint.batch_id, keep_details=False)
+        builder.add_counts(self.counts)
+        return builder.build().model_dump(exclude={"details"})
+
+    def _dispatch_all(self, reader: JSONBatchFileReader) -> None:
+        committed = self.checkpoint.committed
+        seq = self.checkpoint.seq
+        for offset, item in reader:
+            shard = shard_of(item.external_id, self.shards)
+            # Itens ja persistidos pelo shard antes da interrupcao nao voltam ao banco
+            if seq > committed[shard]:
+                if self._buffer_starts[shard] is None:
+                    self._buffer_starts[shard] = (seq, offset)
+                self._buffers[shard].append(item)
+                if len(self._buffers[shard]) >= self.chunk_size:
+                    self._send(shard, seq)
+                    self._collect(block=False)
+                    self._save_checkpoint(next_position=(seq + 1, reader.position))
+            seq += 1
+        for shard, buffer in enumerate(self._buffers):
+            if buffer:
+                self._send(shard, seq - 1)
+
+    def _send(self, shard: int, last_seq: int) -> None:
+        first_seq, offset = self._buffer_starts[shard]
+        message = (last_seq, self._buffers[shard])
+        self._pending[shard].append((first_seq, offset, last_seq))
+        self._buffers[shard], self._buffer_starts[shard] = [], None
+        while True:
+            try:
+                self._inboxes[shard].put(message, timeout=0.5)
+                return
+            except queue.Full:
+                # Enquanto espera o shard, recolhe resultados e detecta processos mortos
+                self._collect(block=False)
+
+    def _collect(self, block: bool) -> None:
+        while True:
+            try:
+                shard, last_seq, counts, error = self._results.get(timeout=0.5) if block else self._results.get_nowait()
+            except queue.Empty:
+                self._check_shards()
+                return
+            if error is not None:
+                raise RuntimeError(f"shard {shard} failed: {error}")
+            # Cada shard responde na ordem em que recebeu os chunks
+            self._pending[shard].popleft()
+            self.checkpoint.committed[shard] = last_seq
+            self.counts.update(counts)
+            block = False
+
+    def _finish(self) -> None:
+        for inbox in self._inboxes:
+            inbox.put(None)
+        while any(self._pending):
+            self._collect(block=True)
+        for process in self._processes:
+            process.join()
+
+    def _save_checkpoint(self, next_position: Optional[Tuple[int, int]] = None, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_saved < self.checkpoint_interval:
+            return
+        starts = [pending[0][:2] for pending in self._pending if pending]
+        starts += [start for start in self._buffer_starts if start is not None]
+        if starts or next_position is not None:
+            self.checkpoint.seq, self.checkpoint.offset = min(starts) if starts else next_position
+        self.checkpoint.counts = dict(self.counts)
+        self.checkpoint.save(self.checkpoint_path)
+        self._last_saved = now
+
+    def _start_shards(self, batch_id: str) -> None:
+        # "spawn": cada shard abre o seu proprio pool de conexoes
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue()
+        self._inboxes = [context.Queue(maxsize=SHARD_QUEUE_CHUNKS) for _ in range(self.shards)]
+        self._processes = [
+            context.Process(
+                target=_shard_main, args=(shard, batch_id, self._inboxes[shard], self._results),
+                name=f"batch-shard-{shard}",
+            )
+            for shard in range(self.shards)
+        ]
+        for process in self._processes:
+            process.start()
+
+    def _check_shards(self) -> None:
+        for shard, process in enumerate(self._processes):
+            if process.exitcode not in (None, 0):
+                raise RuntimeError(f"shard {shard} exited with code {process.exitcode}")
+
+    def _stop_shards(self) -> None:
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
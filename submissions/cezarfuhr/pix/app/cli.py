@@ -0,0 +1,153 @@
+"""
+Linha de comando para processar lotes fora da API.
+
+Uso:
+
+    python -m app.cli ingest lote.ndjson
+    cat lote.ndjson | python -m app.cli ingest -
+    python -m app.cli run lote.json --processes 4
+    python -m app.cli reconcile liquidacao.csv --since 2026-10-17 --until 2026-10-18
+    python -m app.cli migrate
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import BinaryIO, List, Optional
+
+from .batch_runner import ShardedBatchRun
+from .core.config import settings
+from .core.gc_config import configure_gc
+from .database import SessionLocal
+from .ingestion import BatchFileError, NDJSONBatchParser, NDJSONIngestionError
+from .migrations import migrate
+from .reconciliation import ReconciliationError, reconcile
+from .services import PayoutService, ReportBuilder
+
+READ_SIZE = 64 * 1024
+
+
+def ingest_ndjson(stream: BinaryIO, chunk_size: int = settings.NDJSON_CHUNK_SIZE) -> dict:
+    """Liquida um lote NDJSON lido em blocos e devolve os totais do relatorio."""
+    parser = NDJSONBatchParser(chunk_size=chunk_size)
+    db = SessionLocal()
+    try:
+        service = PayoutService(db_session=db)
+        builder: Optional[ReportBuilder] = None
+        while True:
+            data = stream.read(READ_SIZE)
+            chunks = parser.feed(data) if data else parser.close()
+            for chunk in chunks:
+                # Os detalhes ja foram persistidos; manter so os contadores deixa a memoria constante
+                builder = builder or ReportBuilder(parser.batch_id, keep_details=False)
+                builder.add(service.process_items(chunk, parser.batch_id))
+            if not data:
+                break
+    finally:
+        db.close()
+
+    return builder.build().model_dump(exclude={"details"})
+
+
+def _ingest(args: argparse.Namespace) -> int:
+    stream = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        summary = ingest_ndjson(stream, chunk_size=args.chunk_size)
+    except NDJSONIngestionError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
+
+
+def _run(args: argparse.Namespace) -> int:
+    run = ShardedBatchRun(
+        args.file,
+        processes=args.processes,
+        chunk_size=args.chunk_size,
+        checkpoint_path=args.checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+    )
+    try:
+        summary = run.run()
+    except BatchFileError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
+
+
+def _reconcile(args: argparse.Namespace) -> int:
+    try:
+        summary = reconcile(
+            args.file,
+            discrepancies_path=args.output,
+            since=args.since,
+            until=args.until,
+            batch_size=args.fetch_size,
+        )
+    except ReconciliationError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+
+    json.dump(summary, sys.stdout, default=str)
+    sys.stdout.write("\n")
+    return 0
+
+
+def _migrate(args: argparse.Namespace) -> int:
+    changes = migrate()
+    json.dump({"changes": changes}, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Processamento de lotes de payouts")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Liquida um lote NDJSON (cabecalho + um item por linha)")
+    ingest.add_argument("file", help="Arquivo NDJSON, ou - para stdin")
+    ingest.add_argument("--chunk-size", type=int, default=settings.NDJSON_CHUNK_SIZE)
+    ingest.set_defaults(handler=_ingest)
+
+    run = commands.add_parser(
+        "run", help="Liquida um lote JSON grande em processos paralelos, com checkpoint para retomar"
+    )
+    run.add_argument("file", help="Arquivo no formato de POST /payouts/batch")
+    run.add_argument("--processes", type=int, default=settings.CLI_RUN_PROCESSES or os.cpu_count() or 1)
+    run.add_argument("--chunk-size", type=int, default=settings.PAYOUT_WRITE_CHUNK_SIZE)
+    run.add_argument("--checkpoint", help="Arquivo de checkpoint (padrao: <file>.checkpoint)")
+    run.add_argument("--checkpoint-interval", type=float, default=settings.CLI_CHECKPOINT_INTERVAL_SECONDS)
+    run.set_defaults(handler=_run)
+
+    reconcile_cmd = commands.add_parser(
+        "reconcile", help="Concilia um arquivo de liquidacao do provedor (CSV ordenado) com a tabela payouts"
+    )
+    reconcile_cmd.add_argument("file", help="CSV com external_id e amount_cents, ordenado por external_id")
+    reconcile_cmd.add_argument("--output", help="CSV de divergencias (padrao: <file>.discrepancies.csv)")
+    reconcile_cmd.add_argument("--since", type=datetime.fromisoformat, help="Inicio da janela de created_at (inclusivo)")
+    reconcile_cmd.add_argument("--until", type=datetime.fromisoformat, help="Fim da janela de created_at (exclusivo)")
+    reconcile_cmd.add_argument("--fetch-size", type=int, default=settings.RECONCILIATION_FETCH_SIZE)
+    reconcile_cmd.set_defaults(handler=_reconcile)
+
+    migrate_cmd = commands.add_parser("migrate", help="Cria/atualiza o schema do banco (uma vez por deploy)")
+    migrate_cmd.set_defaults(handler=_migrate)
+
+    args = parser.parse_args(argv)
+    configure_gc()
+    if args.command != "migrate" and settings.DB_AUTO_MIGRATE:
+        migrate()
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
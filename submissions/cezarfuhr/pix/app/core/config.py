@@ -1,9 +1,188 @@
-from pydantic_settings import BaseSettings
+from typing import Dict, Literal, Optional
+from pydantic import model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env")
+
     API_KEY: str
 
-    class Config:
-        env_file = ".env"
+    DATABASE_URL: str = "sqlite:///./test.db"
+    # Pool de conexoes do engine sincrono (ignorado no SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
+    # Cria/atualiza o schema no startup da API e dos workers. Em producao o
+    # `app.server` (ou `python -m app.cli migrate`) faz isso uma vez e desliga aqui
+    DB_AUTO_MIGRATE: bool = True
+    # Engine assincrono (asyncpg/aiosqlite) para o endpoint de lotes. A URL, se
+    # vazia, e derivada de DATABASE_URL com o driver assincrono correspondente.
+    DB_ASYNC_ENABLED: bool = False
+    ASYNC_DATABASE_URL: str = ""
+    # Particionamento de `payouts` por mes de created_at (apenas Postgres, aplicado
+    # na criacao da tabela) e quantos meses futuros ficam com particao pronta
+    PAYOUTS_PARTITIONING: Literal["none", "monthly"] = "none"
+    PAYOUTS_PARTITIONS_AHEAD: int = 3
+
+    # Quantidade de external_ids resolvidos por consulta na deteccao de duplicatas
+    DUPLICATE_LOOKUP_CHUNK_SIZE: int = 500
+    # Quantidade de itens liquidados e persistidos por transacao (um commit por chunk)
+    PAYOUT_WRITE_CHUNK_SIZE: int = 500
+    # Uma reserva `pending` mais antiga que isso (processo que caiu no meio da liquidacao)
+    # pode ser retomada; precisa ser bem maior que SETTLEMENT_TIMEOUT_SECONDS e ao menos
+    # QUEUE_LEASE_SECONDS/RETRY_LEASE_SECONDS (validado ao carregar as settings)
+    PAYOUT_RESERVATION_TIMEOUT_SECONDS: int = 300
+
+    # Liquidacao: chamadas simultaneas ao provedor e timeout por chamada
+    SETTLEMENT_MAX_IN_FLIGHT: int = 16
+    SETTLEMENT_TIMEOUT_SECONDS: float = 5.0
+
+    # Modelo do provedor simulado
+    SIMULATED_PROVIDER_SUCCESS_RATE: float = 0.95
+    SIMULATED_PROVIDER_LATENCY_SECONDS: float = 0.0
+
+    # Provedor PIX: "simulated" (SimulatedProvider) ou "http" (HTTPProvider; requer o
+    # extra `provider-http`). Para testes locais: `python -m app.mock_provider`
+    SETTLEMENT_PROVIDER: Literal["simulated", "http"] = "simulated"
+    PROVIDER_NAME: str = "pix-http"
+    PROVIDER_BASE_URL: str = "http://localhost:9000"
+    PROVIDER_API_KEY: str = ""
+    # Timeouts de cada chamada; o total deve ficar abaixo de SETTLEMENT_TIMEOUT_SECONDS
+    PROVIDER_CONNECT_TIMEOUT_SECONDS: float = 1.0
+    PROVIDER_TIMEOUT_SECONDS: float = 3.0
+    # Pool keep-alive e limite de chamadas simultaneas no host do provedor (tambem
+    # com HTTP/2, em que varias chamadas dividem a mesma conexao)
+    PROVIDER_MAX_CONCURRENCY_PER_HOST: int = 32
+    PROVIDER_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    # HTTP/2 quando o pacote h2 esta instalado (httpx[http2]); senao HTTP/1.1
+    PROVIDER_HTTP2: bool = True
+    # Circuit breaker: com ao menos MIN_CALLS das ultimas WINDOW chamadas e taxa de
+    # erro >= ERROR_RATE, as chamadas falham sem rede por OPEN_SECONDS
+    PROVIDER_BREAKER_WINDOW: int = 50
+    PROVIDER_BREAKER_MIN_CALLS: int = 20
+    PROVIDER_BREAKER_ERROR_RATE: float = 0.5
+    PROVIDER_BREAKER_OPEN_SECONDS: float = 10.0
+
+    # Cache de idempotencia em processo: LRU dos ids pagos recentemente, na frente da tabela payouts.
+    # O orcamento de memoria define a capacidade (~128 bytes por id).
+    IDEMPOTENCY_CACHE_ENABLED: bool = False
+    IDEMPOTENCY_CACHE_MEMORY_BYTES: int = 64 * 1024 * 1024
+
+    # Logs JSON formatados e escritos por uma thread dedicada (QueueHandler/QueueListener)
+    LOG_ASYNC: bool = True
+    # "auto" usa orjson se estiver instalado (extra `fast-json`), senao o json da stdlib
+    LOG_JSON_ENCODER: Literal["auto", "json", "orjson"] = "auto"
+    # Fracao dos eventos por item (timeouts, erros do provedor) que e registrada
+    LOG_ITEM_SAMPLE_RATE: float = 1.0
+
+    # Idempotency-Key em POST /payouts/batch: o primeiro relatorio fica gravado
+    # em `batch_responses` e replays do mesmo corpo o recebem sem reprocessar.
+    # Com IDEMPOTENCY_KEY_FROM_BATCH_ID, requisicoes sem o header usam o batch_id
+    IDEMPOTENCY_KEY_FROM_BATCH_ID: bool = False
+    # Prazo da primeira execucao; vencido (processo morto), outra requisicao assume a chave
+    IDEMPOTENCY_LEASE_SECONDS: int = 900
+    # Quanto um replay concorrente espera pela primeira execucao antes de responder 409
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS: float = 30.0
+    IDEMPOTENCY_WAIT_POLL_SECONDS: float = 0.1
+    # Nivel de compressao zlib do relatorio gravado
+    IDEMPOTENCY_COMPRESSION_LEVEL: int = 6
+
+    # Rate limiter por X-API-Key: "memory" (por processo), "database" (tabela
+    # rate_limit_buckets, compartilhada entre processos) ou "redis" (extra `redis`)
+    RATE_LIMIT_BACKEND: Literal["memory", "database", "redis"] = "memory"
+    RATE_LIMIT_REDIS_URL: str = "redis://localhost:6379/0"
+    RATE_LIMIT_REQUESTS_PER_MINUTE: int = 5
+    # Quota ponderada pelo tamanho dos lotes
+    RATE_LIMIT_ITEMS_PER_MINUTE: int = 1_000_000
+    # Quotas por chave, em JSON: {"<api-key>": {"requests_per_minute": 60, "items_per_minute": 5000000}}
+    RATE_LIMIT_OVERRIDES: Dict[str, Dict[str, int]] = {}
+
+    # Histogramas por etapa e contadores expostos em /metrics
+    METRICS_ENABLED: bool = True
+    # Chave do scraper de /metrics (X-API-Key ou Authorization: Bearer); vazio = API_KEY
+    METRICS_API_KEY: str = ""
+
+    # Itens validados e despachados por vez na ingestao NDJSON
+    NDJSON_CHUNK_SIZE: int = 500
+    # Detalhes maximos no relatorio JSON do NDJSON (sem `stream`); acima disso so os
+    # contadores, com o header X-Report-Details-Truncated. `?stream=true` traz todos
+    NDJSON_REPORT_MAX_DETAILS: int = 10_000
+
+    # `python -m app.cli run`: processos (shards; 0 = numero de CPUs) e intervalo minimo
+    # entre gravacoes do checkpoint
+    CLI_RUN_PROCESSES: int = 0
+    CLI_CHECKPOINT_INTERVAL_SECONDS: float = 1.0
+
+    # Processos do servidor HTTP de producao (`python -m app.server`); 0 = numero de CPUs
+    WEB_CONCURRENCY: int = 0
+    # Coletor de lixo: limiar da geracao 0 (opt-in; None mantem o do interpretador,
+    # 700) e congelamento dos objetos do startup, que deixam de ser varridos a cada coleta
+    GC_GEN0_THRESHOLD: Optional[int] = None
+    GC_FREEZE_AFTER_STARTUP: bool = True
+
+    # Threads que processam lotes submetidos em modo assincrono
+    BATCH_JOB_WORKERS: int = 4
+    # "threads" processa no proprio processo da API; "queue" grava os itens em
+    # `payout_jobs` para os workers de `python -m app.worker`
+    BATCH_EXECUTION_BACKEND: Literal["threads", "queue"] = "threads"
+    # Job do pool de threads sem progresso ha mais que isso e orfao (o processo
+    # caiu) e e retomado; a verificacao roda no startup e a cada intervalo
+    BATCH_JOB_RECOVERY_SECONDS: int = 60
+
+    # Fila duravel: itens por claim, duracao do lease e intervalo de polling
+    QUEUE_CLAIM_CHUNK_SIZE: int = 100
+    QUEUE_LEASE_SECONDS: int = 60
+    QUEUE_POLL_INTERVAL_SECONDS: float = 0.5
+    WORKER_PROCESSES: int = 2
+
+    # Retentativas de itens que falharam na liquidacao (`python -m app.retries`).
+    # Cada falha agenda a proxima tentativa com backoff exponencial e jitter; ao
+    # atingir RETRY_MAX_ATTEMPTS (contando a original) o item vira `failed_permanently`
+    RETRY_ENABLED: bool = True
+    RETRY_MAX_ATTEMPTS: int = 5
+    RETRY_BASE_DELAY_SECONDS: float = 30.0
+    RETRY_MAX_DELAY_SECONDS: float = 3600.0
+    RETRY_CLAIM_CHUNK_SIZE: int = 100
+    RETRY_LEASE_SECONDS: int = 60
+    RETRY_POLL_INTERVAL_SECONDS: float = 1.0
+    # Chamadas simultaneas por provedor durante as retentativas, ex.: {"simulated": 8}
+    RETRY_PROVIDER_CONCURRENCY: Dict[str, int] = {}
+    RETRY_DEFAULT_CONCURRENCY: int = 4
+
+    # Conciliacao (`python -m app.cli reconcile`): linhas de `payouts` por leitura do cursor
+    RECONCILIATION_FETCH_SIZE: int = 10_000
+
+    # Webhooks de resultado (`python -m app.webhooks`; requer httpx). Assinantes por
+    # nome, ex.: {"erp": {"url": "https://erp/hooks/pix", "secret": "..."}}. Sem
+    # assinantes nenhum evento e gravado no outbox
+    WEBHOOK_SUBSCRIBERS: Dict[str, Dict[str, str]] = {}
+    # Eventos por POST, eventos por claim e POSTs simultaneos do dispatcher
+    WEBHOOK_BATCH_SIZE: int = 100
+    WEBHOOK_CLAIM_CHUNK_SIZE: int = 1000
+    WEBHOOK_MAX_CONCURRENCY: int = 8
+    WEBHOOK_TIMEOUT_SECONDS: float = 5.0
+    WEBHOOK_LEASE_SECONDS: int = 60
+    WEBHOOK_POLL_INTERVAL_SECONDS: float = 1.0
+    # Entregas recusadas voltam com backoff exponencial e jitter; ao atingir
+    # WEBHOOK_MAX_ATTEMPTS o evento vira `dead`
+    WEBHOOK_MAX_ATTEMPTS: int = 10
+    WEBHOOK_RETRY_BASE_DELAY_SECONDS: float = 1.0
+    WEBHOOK_RETRY_MAX_DELAY_SECONDS: float = 300.0
+
+    @model_validator(mode="after")
+    def _check_reservation_timeout(self) -> "Settings":
+        # Quem detem o lease retoma as reservas `pending` do proprio lote; os demais
+        # so depois do vencimento, que precisa cobrir uma chamada e um lease inteiros
+        timeout = self.PAYOUT_RESERVATION_TIMEOUT_SECONDS
+        if timeout <= self.SETTLEMENT_TIMEOUT_SECONDS:
+            raise ValueError("PAYOUT_RESERVATION_TIMEOUT_SECONDS must be greater than SETTLEMENT_TIMEOUT_SECONDS")
+        if timeout < max(self.QUEUE_LEASE_SECONDS, self.RETRY_LEASE_SECONDS):
+            raise ValueError(
+                "PAYOUT_RESERVATION_TIMEOUT_SECONDS must be at least QUEUE_LEASE_SECONDS and RETRY_LEASE_SECONDS"
+            )
+        return self
 
 settings = Settings()
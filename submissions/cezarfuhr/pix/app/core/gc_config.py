@@ -0,0 +1,27 @@
+import gc
+from typing import Optional
+
+from .config import settings
+
+
+def configure_gc(threshold: Optional[int] = None) -> None:
+    """
+    Ajusta o limiar da geracao 0 do coletor de lixo (padrao:
+    GC_GEN0_THRESHOLD). Chamado no startup do processo, nunca no import.
+
+    Validar um lote grande cria centenas de milhares de objetos que vivem ate
+    o fim da requisicao; com o limiar padrao (700) o coletor roda a cada
+    poucos itens e percorre todos eles de novo, o que custa mais que a
+    propria validacao. Sem limiar configurado nada muda.
+    """
+    threshold = threshold if threshold is not None else settings.GC_GEN0_THRESHOLD
+    if threshold:
+        _, gen1, gen2 = gc.get_threshold()
+        gc.set_threshold(threshold, gen1, gen2)
+
+
+def freeze_startup_objects() -> None:
+    """Tira os objetos criados no import/startup das proximas coletas completas."""
+    if settings.GC_FREEZE_AFTER_STARTUP:
+        gc.collect()
+        gc.freeze()
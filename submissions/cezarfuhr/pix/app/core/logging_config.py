@@ -1,9 +1,38 @@
+import atexit
 import json
 import logging
+import queue
+import random
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional
+
+from .config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - extra opcional `fast-json`
+    orjson = None
+
+# Atributos padrao de um LogRecord; o resto veio de `extra` e vai para o JSON
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _json_encoder() -> Callable[[dict], str]:
+    if settings.LOG_JSON_ENCODER == "orjson" or (settings.LOG_JSON_ENCODER == "auto" and orjson is not None):
+        if orjson is None:
+            raise RuntimeError("LOG_JSON_ENCODER=orjson requer o pacote orjson")
+        # default=str mantem o comportamento do json para tipos nao serializaveis
+        return lambda entry: orjson.dumps(entry, default=str).decode()
+    return lambda entry: json.dumps(entry, ensure_ascii=False, default=str)
+
 
 class JSONFormatter(logging.Formatter):
+    def __init__(self, encoder: Optional[Callable[[dict], str]] = None):
+        super().__init__()
+        self.encode = encoder or _json_encoder()
+
     def format(self, record: logging.LogRecord) -> str:
         log_entry = {
             "timestamp": datetime.fromtimestamp(record.created).isoformat(),
@@ -17,28 +46,68 @@ class JSONFormatter(logging.Formatter):
 
         # Add extra fields for structured logging (metrics)
         for key, value in record.__dict__.items():
-            if key not in ['name', 'msg', 'args', 'created', 'filename', 'funcName',
-                          'levelname', 'levelno', 'lineno', 'module', 'msecs',
-                          'message', 'pathname', 'process', 'processName',
-                          'relativeCreated', 'thread', 'threadName', 'exc_info',
-                          'exc_text', 'stack_info', 'taskName']:
+            if key not in RESERVED_ATTRS:
                 log_entry[key] = value
 
         if record.exc_info:
             log_entry["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_entry, ensure_ascii=False)
+        return self.encode(log_entry)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler que deixa a formatacao para a thread do listener.
+
+    O `prepare` padrao formata o registro na thread que logou; aqui so a
+    mensagem e resolvida (os args podem mudar depois), e o JSON e a escrita
+    em stdout acontecem fora do caminho da requisicao.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        # Esvazia a fila antes de sair para nao perder os ultimos registros
+        _listener.stop()
+        _listener = None
+
+
+def should_log_item_event() -> bool:
+    """Decide se um evento por item (timeout, erro do provedor) e registrado, conforme LOG_ITEM_SAMPLE_RATE."""
+    rate = settings.LOG_ITEM_SAMPLE_RATE
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
 
 def configure_logging() -> None:
     # Remove handlers existentes para evitar duplicacao
     root_logger = logging.getLogger()
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
+    _stop_listener()
 
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(JSONFormatter())
-    root_logger.addHandler(handler)
+    if settings.LOG_ASYNC:
+        global _listener
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        root_logger.addHandler(DeferredQueueHandler(log_queue))
+    else:
+        root_logger.addHandler(handler)
     root_logger.setLevel(logging.INFO)
 
     # Reduz a verbosidade de loggers de bibliotecas
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
     logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
+
+
+atexit.register(_stop_listener)
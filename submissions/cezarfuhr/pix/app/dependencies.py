@@ -1,10 +1,13 @@
+import hmac
+from typing import Optional
 from fastapi import Security, HTTPException, status, Depends
-from fastapi.security import APIKeyHeader
+from fastapi.security import APIKeyHeader, HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 from .core.config import settings
 from .database import SessionLocal
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+bearer_token = HTTPBearer(auto_error=False)
 
 def validate_api_key(key: str = Security(api_key_header)):
     if not key or key != settings.API_KEY:
@@ -13,6 +16,19 @@ def validate_api_key(key: str = Security(api_key_header)):
             detail="Invalid or missing API Key"
         )
 
+def validate_metrics_key(
+    key: Optional[str] = Security(api_key_header),
+    bearer: Optional[HTTPAuthorizationCredentials] = Security(bearer_token),
+):
+    # O Prometheus autentica com `authorization`/`bearer_token`; X-API-Key tambem vale
+    expected = settings.METRICS_API_KEY or settings.API_KEY
+    provided = key or (bearer.credentials if bearer else None)
+    if not provided or not hmac.compare_digest(provided.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or missing API Key"
+        )
+
 def get_db_session():
     db = None
     try:
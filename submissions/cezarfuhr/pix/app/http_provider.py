@@ -0,0 +1,229 @@
+"""
+Provedor PIX real por HTTP (SETTLEMENT_PROVIDER=http).
+
+Protocolo esperado (o mesmo do servidor local `python -m app.mock_provider`):
+
+    POST {PROVIDER_BASE_URL}/payments
+    Idempotency-Key: <external_id>
+    {"external_id": ..., "user_id": ..., "amount_cents": ..., "pix_key": ...}
+
+    2xx {"status": "paid", "reference": "..."}  -> pago
+    4xx (exceto 429)                             -> recusado pelo provedor
+    429, 5xx, timeout ou erro de rede            -> erro
+
+Um unico httpx.Client por processo mantem o pool de conexoes keep-alive
+(HTTP/2 quando o pacote h2 esta instalado), entao o handshake TCP/TLS nao se
+repete a cada pagamento. Um semaforo limita as chamadas simultaneas no host
+do provedor, e o CircuitBreaker corta as chamadas quando a taxa de erro
+dispara: os itens falham na hora e seguem para a fila de retentativas, em vez
+de ocupar slots do SettlementEngine ate o timeout.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+from .core.config import settings
+from .core.logging_config import should_log_item_event
+from .metrics import record_provider_call
+from .models import PayoutItem
+from .settlement import UNKNOWN, SettlementResult
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - extra opcional `provider-http`
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker sobre as ultimas `window` chamadas.
+
+    Com ao menos `min_calls` resultados e taxa de erro >= `error_rate`, o
+    circuito abre por `open_seconds` e `allow()` devolve False. Depois disso
+    fica meio aberto: uma unica chamada de teste passa; sucesso fecha o
+    circuito, erro o abre de novo.
+    """
+
+    def __init__(
+        self,
+        window: int,
+        min_calls: int,
+        error_rate: float,
+        open_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._clock = clock
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._errors = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "CircuitBreaker":
+        return cls(
+            window=settings.PROVIDER_BREAKER_WINDOW,
+            min_calls=settings.PROVIDER_BREAKER_MIN_CALLS,
+            error_rate=settings.PROVIDER_BREAKER_ERROR_RATE,
+            open_seconds=settings.PROVIDER_BREAKER_OPEN_SECONDS,
+        )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and self._clock() - self._opened_at >= self.open_seconds:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return self.state != "open"
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                self._close() if success else self._open()
+                return
+            if self.state == "open":
+                # Chamada iniciada antes da abertura: nao muda o estado
+                return
+            if len(self._results) == self._results.maxlen and not self._results[0]:
+                self._errors -= 1
+            self._results.append(success)
+            self._errors += not success
+            if len(self._results) >= self.min_calls and self._errors >= self.error_rate * len(self._results):
+                self._open()
+
+    def _open(self) -> None:
+        if self.state != "open":
+            logger.warning("provider_circuit_open", extra={"event": "provider_circuit_open"})
+        self.state = "open"
+        self._opened_at = self._clock()
+
+    def _close(self) -> None:
+        logger.info("provider_circuit_closed", extra={"event": "provider_circuit_closed"})
+        self.state = "closed"
+        self._results.clear()
+        self._errors = 0
+
+
+class HTTPProvider:
+    """Cliente do provedor PIX; seguro para as threads do SettlementEngine."""
+
+    def __init__(
+        self,
+        base_url: str,
+        name: str = "pix-http",
+        api_key: str = "",
+        timeout_seconds: float = 3.0,
+        connect_timeout_seconds: float = 1.0,
+        max_concurrency: int = 32,
+        keepalive_expiry_seconds: float = 30.0,
+        http2: bool = True,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional["httpx.BaseTransport"] = None,
+    ):
+        if httpx is None:
+            raise RuntimeError("SETTLEMENT_PROVIDER=http requires httpx (install the `provider-http` extra)")
+        self.name = name
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.breaker = breaker or CircuitBreaker.from_settings()
+        # O pool ja limita conexoes, mas com HTTP/2 varias chamadas dividem uma conexao
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.Client(
+            base_url=base_url,
+            headers=headers,
+            http2=self.http2,
+            timeout=httpx.Timeout(timeout_seconds, connect=connect_timeout_seconds),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+                keepalive_expiry=keepalive_expiry_seconds,
+            ),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_settings(cls) -> "HTTPProvider":
+        return cls(
+            base_url=settings.PROVIDER_BASE_URL,
+            name=settings.PROVIDER_NAME,
+            api_key=settings.PROVIDER_API_KEY,
+            timeout_seconds=settings.PROVIDER_TIMEOUT_SECONDS,
+            connect_timeout_seconds=settings.PROVIDER_CONNECT_TIMEOUT_SECONDS,
+            max_concurrency=settings.PROVIDER_MAX_CONCURRENCY_PER_HOST,
+            keepalive_expiry_seconds=settings.PROVIDER_KEEPALIVE_EXPIRY_SECONDS,
+            http2=settings.PROVIDER_HTTP2,
+        )
+
+    def pay(self, item: PayoutItem) -> SettlementResult:
+        if not self.breaker.allow():
+            record_provider_call(self.name, "short_circuited")
+            return SettlementResult(False)
+
+        with self._slots:
+            start = time.perf_counter()
+            try:
+                response = self._client.post(
+                    "/payments",
+                    json={
+                        "external_id": item.external_id,
+                        "user_id": item.user_id,
+                        "amount_cents": item.amount_cents,
+                        "pix_key": item.pix_key.get_secret_value(),
+                    },
+                    # O provedor deduplica retentativas do mesmo pagamento
+                    headers={"Idempotency-Key": item.external_id},
+                )
+                body = response.json() if response.is_success else None
+            except (httpx.ReadTimeout, httpx.WriteTimeout) as exc:
+                # O pedido pode ter chegado ao provedor: como num timeout do SettlementEngine,
+                # o resultado e desconhecido e a reserva fica `pending` para a retentativa
+                self._error(item, start, type(exc).__name__)
+                return UNKNOWN
+            except (httpx.HTTPError, ValueError) as exc:
+                return self._error(item, start, type(exc).__name__)
+        seconds = time.perf_counter() - start
+
+        if response.status_code == 429 or response.status_code >= 500:
+            return self._error(item, start, f"HTTP {response.status_code}", seconds)
+        # Uma recusa do provedor (4xx) e uma resposta saudavel para o circuit breaker
+        self.breaker.record(True)
+        paid = body is not None and body.get("status") == "paid"
+        record_provider_call(self.name, "paid" if paid else "rejected", seconds)
+        return SettlementResult(paid, body.get("reference") if paid else None)
+
+    def _error(self, item: PayoutItem, start: float, reason: str, seconds: Optional[float] = None) -> SettlementResult:
+        self.breaker.record(False)
+        record_provider_call(self.name, "error", seconds if seconds is not None else time.perf_counter() - start)
+        if should_log_item_event():
+            logger.warning(
+                "provider_call_failed",
+                extra={
+                    "external_id": item.external_id,
+                    "provider": self.name,
+                    "reason": reason,
+                    "event": "provider_call_failed",
+                    "sample_rate": settings.LOG_ITEM_SAMPLE_RATE,
+                }
+            )
+        return SettlementResult(False)
+
+    def close(self) -> None:
+        self._client.close()
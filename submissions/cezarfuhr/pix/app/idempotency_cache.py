@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .core.config import settings
+
+# Custo aproximado de um external_id no LRU (no do OrderedDict + str curta)
+LRU_ENTRY_BYTES = 128
+
+
+class IdempotencyCache:
+    """
+    LRU em processo com os external_ids pagos recentemente, na frente da
+    deteccao de duplicatas.
+
+    Um id do LRU responde como duplicata sem ir ao banco: a reserva
+    (`PayoutRepository.reserve`) pula esses ids. Os demais
+    seguem para o banco, que e quem decide a reserva; por isso o cache nao
+    tenta responder negativos, que nao economizariam nenhum round trip.
+
+    Como uma reserva pode terminar em falha e ser retomada, o LRU so recebe
+    ids sabidamente pagos. A constraint de unicidade de `payouts` continua
+    sendo a fonte da verdade: com varios processos gravando no mesmo banco,
+    um id recem-pago por outro processo passa pelo cache e so e barrado na
+    reserva.
+    """
+
+    def __init__(self, memory_bytes: int):
+        self.lru_capacity = max(1, memory_bytes // LRU_ENTRY_BYTES)
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def partition(self, external_ids: Iterable[str]) -> Tuple[Set[str], List[str]]:
+        """Separa os ids em (pagos segundo o LRU, ids que precisam ir ao banco)."""
+        known: Set[str] = set()
+        unknown: List[str] = []
+        with self._lock:
+            for external_id in external_ids:
+                if external_id in self._lru:
+                    self._lru.move_to_end(external_id)
+                    known.add(external_id)
+                else:
+                    unknown.append(external_id)
+            self.hits += len(known)
+            self.misses += len(unknown)
+        return known, unknown
+
+    def known_paid(self, external_ids: Iterable[str]) -> Set[str]:
+        """Ids que o LRU sabe pagos; os demais precisam passar pela reserva no banco."""
+        return self.partition(external_ids)[0]
+
+    def add(self, external_ids: Iterable[str]) -> None:
+        """Registra ids sabidamente pagos."""
+        with self._lock:
+            for external_id in external_ids:
+                self._lru[external_id] = None
+                self._lru.move_to_end(external_id)
+                if len(self._lru) > self.lru_capacity:
+                    self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "lru_size": len(self._lru),
+            "lru_capacity": self.lru_capacity,
+        }
+
+
+idempotency_cache: Optional[IdempotencyCache] = (
+    IdempotencyCache(memory_bytes=settings.IDEMPOTENCY_CACHE_MEMORY_BYTES)
+    if settings.IDEMPOTENCY_CACHE_ENABLED
+    else None
+)
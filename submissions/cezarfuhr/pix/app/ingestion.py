@@ -0,0 +1,206 @@
+import re
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .models import PayoutBatchHeader, PayoutItem
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+READ_SIZE = 64 * 1024
+# Cabecalho (tudo antes de "items") e item individual maximos aceitos no arquivo JSON
+MAX_HEADER_BYTES = 64 * 1024
+MAX_ITEM_BYTES = 64 * 1024
+# Linha maxima aceita no NDJSON: uma linha sem quebra nao pode crescer o buffer sem limite
+MAX_LINE_BYTES = 64 * 1024
+
+_ITEMS_ARRAY = re.compile(rb'"items"\s*:\s*\[')
+# Objeto JSON plano (sem objetos aninhados); chaves dentro de strings nao encerram o objeto
+_FLAT_OBJECT = re.compile(rb'\{(?:[^"{}]++|"(?:[^"\\]++|\\.)*+")*+\}')
+_SEPARATORS = re.compile(rb'[\s,]*')
+
+
+class NDJSONIngestionError(ValueError):
+    """Linha invalida em um lote NDJSON."""
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f"line {line_number}: {message}")
+        self.line_number = line_number
+        self.message = message
+
+
+class NDJSONLineTooLong(NDJSONIngestionError):
+    """Linha maior que MAX_LINE_BYTES (ou sem quebra de linha ate esse tamanho)."""
+
+
+class NDJSONBatchParser:
+    """
+    Parser incremental de lotes NDJSON: uma linha de cabecalho com o
+    `batch_id` e depois um `PayoutItem` por linha.
+
+    Os bytes chegam via `feed` em pedacos de qualquer tamanho; cada chamada
+    devolve os chunks de `chunk_size` itens ja validados. Apenas a linha
+    incompleta e o chunk em formacao ficam em memoria, entao o consumo nao
+    depende do tamanho do lote. Pelo mesmo motivo, um `external_id` repetido
+    com `amount_cents` diferente so e rejeitado dentro do mesmo chunk.
+    """
+
+    def __init__(self, chunk_size: int, max_line_bytes: int = MAX_LINE_BYTES):
+        self.chunk_size = chunk_size
+        self.max_line_bytes = max_line_bytes
+        self.header: Optional[PayoutBatchHeader] = None
+        self.item_count = 0
+        self._buffer = b""
+        self._line_number = 0
+        self._items: List[PayoutItem] = []
+        self._amounts: Dict[str, int] = {}
+
+    @property
+    def batch_id(self) -> Optional[str]:
+        return self.header.batch_id if self.header else None
+
+    def feed(self, data: bytes) -> List[List[PayoutItem]]:
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        if len(self._buffer) > self.max_line_bytes:
+            raise NDJSONLineTooLong(self._line_number + len(lines) + 1, f"line exceeds {self.max_line_bytes} bytes")
+        ready = []
+        for line in lines:
+            if len(line) > self.max_line_bytes:
+                raise NDJSONLineTooLong(self._line_number + 1, f"line exceeds {self.max_line_bytes} bytes")
+            chunk = self._parse_line(line)
+            if chunk:
+                ready.append(chunk)
+        return ready
+
+    def close(self) -> List[List[PayoutItem]]:
+        """Processa a ultima linha (sem quebra final) e devolve o chunk restante."""
+        ready = self.feed(b"\n") if self._buffer.strip() else []
+        if self.header is None:
+            raise NDJSONIngestionError(self._line_number, "missing batch header line")
+        if self.item_count == 0:
+            raise NDJSONIngestionError(self._line_number, "batch must have at least 1 item")
+        if self._items:
+            ready.append(self._items)
+            self._items = []
+        return ready
+
+    def _parse_line(self, line: bytes) -> Optional[List[PayoutItem]]:
+        self._line_number += 1
+        if not line.strip():
+            return None
+
+        try:
+            if self.header is None:
+                self.header = PayoutBatchHeader.model_validate_json(line)
+                return None
+            item = PayoutItem.model_validate_json(line)
+        except ValidationError as exc:
+            errors = "; ".join(f"{'.'.join(map(str, e['loc'])) or 'line'}: {e['msg']}" for e in exc.errors())
+            raise NDJSONIngestionError(self._line_number, errors) from None
+
+        first_amount = self._amounts.setdefault(item.external_id, item.amount_cents)
+        if first_amount != item.amount_cents:
+            raise NDJSONIngestionError(
+                self._line_number, f"external_id {item.external_id!r} repeated with a different amount_cents"
+            )
+
+        self.item_count += 1
+        self._items.append(item)
+        if len(self._items) >= self.chunk_size:
+            chunk, self._items = self._items, []
+            self._amounts = {}
+            return chunk
+        return None
+
+
+class BatchFileError(ValueError):
+    """Arquivo de lote JSON invalido."""
+
+
+class JSONBatchFileReader:
+    """
+    Leitura incremental de um lote no formato de `POST /payouts/batch`
+    (`{"batch_id": ..., "items": [...]}`), sem carregar o arquivo inteiro.
+
+    O `batch_id` precisa vir antes de `items`. Cada item (um objeto plano) e
+    validado como PayoutItem e entregue com o offset em bytes onde comeca, o
+    que permite retomar a leitura do meio do array com `offset`/`batch_id`.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        batch_id: Optional[str] = None,
+        offset: int = 0,
+        read_size: int = READ_SIZE,
+    ):
+        if offset:
+            if batch_id is None:
+                raise ValueError("resuming from an offset requires the batch_id")
+            stream.seek(offset)
+        self.stream = stream
+        self.batch_id = batch_id
+        self.read_size = read_size
+        self._buffer = b""
+        self._base = offset
+        self._pos = 0
+
+    @property
+    def position(self) -> int:
+        """Offset em bytes logo depois do ultimo item entregue."""
+        return self._base + self._pos
+
+    def __iter__(self) -> Iterator[Tuple[int, PayoutItem]]:
+        self.read_header()
+        while self._skip_separators() != b"]":
+            match = self._next_object()
+            offset = self.position
+            self._pos = match.end()
+            try:
+                item = PayoutItem.model_validate_json(match.group())
+            except ValidationError as exc:
+                errors = "; ".join(f"{'.'.join(map(str, e['loc'])) or 'item'}: {e['msg']}" for e in exc.errors())
+                raise BatchFileError(f"byte {offset}: {errors}") from None
+            yield offset, item
+
+    def read_header(self) -> str:
+        """Le o cabecalho ate o inicio de `items` (sem efeito ao retomar) e devolve o batch_id."""
+        if self.batch_id is not None:
+            return self.batch_id
+        while (match := _ITEMS_ARRAY.search(self._buffer)) is None:
+            if len(self._buffer) > MAX_HEADER_BYTES or not self._fill():
+                raise BatchFileError('missing "items" array')
+        # Fecha o objeto antes de "items" para validar so o cabecalho
+        prefix = self._buffer[:match.start()].rstrip().rstrip(b",") + b"}"
+        try:
+            self.batch_id = PayoutBatchHeader.model_validate_json(prefix).batch_id
+        except ValidationError:
+            raise BatchFileError('a valid "batch_id" must precede "items"') from None
+        self._pos = match.end()
+        return self.batch_id
+
+    def _skip_separators(self) -> bytes:
+        """Avanca espacos e virgulas e devolve o proximo byte significativo."""
+        while True:
+            self._pos = _SEPARATORS.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos:self._pos + 1]
+            if not self._fill():
+                raise BatchFileError(f"byte {self.position}: unterminated \"items\" array")
+
+    def _next_object(self) -> re.Match:
+        while (match := _FLAT_OBJECT.match(self._buffer, self._pos)) is None:
+            if len(self._buffer) - self._pos > MAX_ITEM_BYTES or not self._fill():
+                raise BatchFileError(f"byte {self.position}: invalid or truncated item")
+        return match
+
+    def _fill(self) -> bool:
+        data = self.stream.read(self.read_size)
+        if not data:
+            return False
+        # Descarta o que ja foi consumido para a memoria nao crescer com o arquivo
+        self._base += self._pos
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
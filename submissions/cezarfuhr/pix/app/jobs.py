@@ -0,0 +1,148 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .database import SessionLocal
+from .models import BatchJobDB, BatchJobStatus, PayoutBatch, PayoutReport
+from .repository import BatchJobRepository, PayoutQueueRepository
+from .services import PayoutService
+
+logger = logging.getLogger(__name__)
+
+
+def job_status(job: BatchJobDB) -> BatchJobStatus:
+    """Converte o registro do job no modelo exposto pela API."""
+    return BatchJobStatus(
+        batch_id=job.batch_id,
+        status=job.status,
+        total_items=job.total_items,
+        processed_items=job.processed_items or 0,
+        successful=job.successful or 0,
+        failed=job.failed or 0,
+        duplicates=job.duplicates or 0,
+        report=PayoutReport.model_validate_json(job.report) if job.report else None,
+    )
+
+
+class BatchJobRunner:
+    """
+    Pool de threads que processa em background os lotes submetidos em modo
+    assincrono. Cada job usa a sua propria sessao de banco.
+
+    Os jobs vivem na memoria do processo: se ele cai, `recover` (no startup
+    e depois a cada BATCH_JOB_RECOVERY_SECONDS) retoma os que ficaram
+    `queued`/`running` sem progresso. Reprocessar e seguro, pois a reserva
+    em `payouts` nao paga de novo os itens ja liquidados.
+    """
+
+    def __init__(self, max_workers: int, session_factory: Callable[[], Session] = SessionLocal):
+        self.max_workers = max_workers
+        self.session_factory = session_factory
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._recovery: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def submit(self, batch_id: str) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="batch-job"
+            )
+        self._executor.submit(self.run, batch_id)
+
+    def run(self, batch_id: str) -> None:
+        """Liquida o lote; num job retomado, as reservas `pending` deixadas pela execucao que caiu sao retomadas."""
+        db = self.session_factory()
+        jobs = BatchJobRepository(db)
+        try:
+            if not jobs.start(batch_id):
+                # Ja iniciado por outra thread ou processo que retomou o mesmo job
+                return
+            batch = jobs.load_batch(jobs.get(batch_id))
+
+            service = PayoutService(db_session=db, reservation_owner=jobs.reservation_owner(batch_id))
+            report = service.process_batch(
+                batch, on_progress=lambda details: jobs.add_progress(batch_id, details)
+            )
+            jobs.complete(batch_id, report)
+        except Exception:
+            logger.exception(
+                "batch_job_failed",
+                extra={"batch_id": batch_id, "event": "batch_job_failed"}
+            )
+            db.rollback()
+            jobs.set_status(batch_id, "failed")
+        finally:
+            db.close()
+
+    def recover(self) -> List[str]:
+        """Resubmete os jobs orfaos e devolve os seus batch_ids."""
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.BATCH_JOB_RECOVERY_SECONDS)
+        db = self.session_factory()
+        try:
+            batch_ids = BatchJobRepository(db).claim_orphaned(stale_before)
+        finally:
+            db.close()
+        for batch_id in batch_ids:
+            logger.warning(
+                "batch_job_recovered",
+                extra={"batch_id": batch_id, "event": "batch_job_recovered"}
+            )
+            self.submit(batch_id)
+        return batch_ids
+
+    def start_recovery(self) -> None:
+        """Verifica os jobs orfaos agora e depois a cada BATCH_JOB_RECOVERY_SECONDS, em background."""
+        if self._recovery is not None:
+            return
+        self._stop.clear()
+        self._recovery = threading.Thread(target=self._recovery_loop, name="batch-job-recovery", daemon=True)
+        self._recovery.start()
+
+    def _recovery_loop(self) -> None:
+        while True:
+            try:
+                self.recover()
+            except Exception:
+                logger.exception("batch_job_recovery_failed", extra={"event": "batch_job_recovery_failed"})
+            if self._stop.wait(settings.BATCH_JOB_RECOVERY_SECONDS):
+                return
+
+    def shutdown(self) -> None:
+        """
+        Para a verificacao de orfaos e espera os jobs em andamento. Os que
+        ainda nao comecaram sao cancelados e continuam `queued` no banco,
+        para serem retomados no proximo startup.
+        """
+        self._stop.set()
+        if self._recovery is not None:
+            self._recovery.join()
+            self._recovery = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+job_runner = BatchJobRunner(max_workers=settings.BATCH_JOB_WORKERS)
+
+
+def submit_batch(db: Session, batch: PayoutBatch) -> BatchJobDB:
+    """
+    Registra um lote para processamento em background, conforme
+    `BATCH_EXECUTION_BACKEND`: no pool de threads da API ou na fila duravel
+    consumida por `python -m app.worker`. Um `batch_id` ja submetido devolve o
+    job existente sem reenfileirar.
+    """
+    jobs = BatchJobRepository(db)
+    if settings.BATCH_EXECUTION_BACKEND == "queue":
+        job, _ = jobs.create(batch, enqueue=PayoutQueueRepository(db).enqueue)
+        return job
+
+    job, created = jobs.create(batch)
+    if created:
+        job_runner.submit(job.batch_id)
+    return job
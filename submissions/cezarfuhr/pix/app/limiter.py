@@ -1,5 +1,304 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+"""
+Rate limiter por X-API-Key com token buckets em um backend plugavel.
 
-# O limiter usara o endereco de IP do cliente como chave
-limiter = Limiter(key_func=get_remote_address)
+Cada chave tem duas quotas: requisicoes por minuto e itens por minuto, de
+modo que um lote de 100k itens custa mais do que um de 2. Os buckets sao
+repostos continuamente (`per_minute / 60` tokens por segundo) ate a
+capacidade de um minuto.
+
+Backends (`RATE_LIMIT_BACKEND`):
+
+- `memory`: dicionario em processo; cada worker/replica tem o seu contador.
+- `database`: tabela `rate_limit_buckets`, atualizada com compare-and-set.
+- `redis`: script Lua atomico; requer o extra `redis`.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from .core.config import settings
+from .models import RateLimitBucketDB
+
+# (permitido, tokens restantes, segundos ate haver tokens suficientes)
+TakeResult = Tuple[bool, float, float]
+
+
+def take_tokens(tokens: float, updated_at: float, now: float, capacity: float, rate: float, cost: float) -> TakeResult:
+    """Repoe o bucket ate `now` e tenta consumir `cost` tokens."""
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rate
+
+
+@dataclass(frozen=True)
+class Quota:
+    name: str
+    per_minute: int
+
+    @property
+    def capacity(self) -> float:
+        return float(self.per_minute)
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+    def describe(self) -> str:
+        return f"{self.per_minute} {self.name} per minute"
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, quota: Quota, retry_after: Optional[float]):
+        self.quota = quota
+        self.retry_after = retry_after
+        super().__init__(quota.describe())
+
+
+class MemoryBucketStore:
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, quota: Quota, cost: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (quota.capacity, now))
+            allowed, tokens, retry_after = take_tokens(tokens, updated_at, now, quota.capacity, quota.rate, cost)
+            self._buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+    def refund(self, key: str, quota: Quota, cost: float) -> None:
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(quota.capacity, tokens + cost), updated_at)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class DatabaseBucketStore:
+    """
+    Buckets na tabela `rate_limit_buckets`, compartilhados entre processos.
+
+    A escrita so vale se `updated_at` ainda for o valor lido (compare-and-set),
+    entao duas requisicoes concorrentes nunca gastam o mesmo token; quem perde
+    a corrida le de novo. Funciona igual em Postgres e SQLite.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+
+    def take(self, key: str, quota: Quota, cost: float) -> Tuple[bool, float]:
+        bucket = RateLimitBucketDB.__table__
+        db = self.session_factory()
+        try:
+            for _ in range(self.MAX_ATTEMPTS):
+                now = time.time()
+                row = db.execute(
+                    select(bucket.c.tokens, bucket.c.updated_at).where(bucket.c.key == key)
+                ).first()
+                if row is None:
+                    allowed, tokens, retry_after = take_tokens(quota.capacity, now, now, quota.capacity, quota.rate, cost)
+                    try:
+                        db.execute(insert(bucket).values(key=key, tokens=tokens, updated_at=now))
+                        db.commit()
+                    except IntegrityError:
+                        db.rollback()
+                        continue
+                    return allowed, retry_after
+
+                allowed, tokens, retry_after = take_tokens(
+                    row.tokens, row.updated_at, now, quota.capacity, quota.rate, cost
+                )
+                if not allowed:
+                    # Nada foi consumido: a reposicao e recalculada a partir do mesmo updated_at
+                    db.rollback()
+                    return False, retry_after
+                result = db.execute(
+                    update(bucket)
+                    .where(bucket.c.key == key, bucket.c.updated_at == row.updated_at)
+                    .values(tokens=tokens, updated_at=now)
+                )
+                db.commit()
+                if result.rowcount == 1:
+                    return True, 0.0
+            # Disputa continua pela mesma chave: recusa em vez de arriscar exceder a quota
+            return False, 1.0
+        finally:
+            db.close()
+
+    def refund(self, key: str, quota: Quota, cost: float) -> None:
+        bucket = RateLimitBucketDB.__table__
+        refunded = bucket.c.tokens + cost
+        db = self.session_factory()
+        try:
+            # Soma atomica no banco, limitada a capacidade; `updated_at` fica como esta
+            db.execute(
+                update(bucket)
+                .where(bucket.c.key == key)
+                .values(tokens=case((refunded > quota.capacity, quota.capacity), else_=refunded))
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def reset(self) -> None:
+        db = self.session_factory()
+        try:
+            db.query(RateLimitBucketDB).delete()
+            db.commit()
+        finally:
+            db.close()
+
+
+class RedisBucketStore:
+    """Buckets em um Redis (ou servidor compativel), atualizados por um script Lua atomico."""
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+    REFUND_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(capacity, tokens + cost)))
+end
+return 1
+"""
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(self.SCRIPT)
+        self._refund_script = client.register_script(self.REFUND_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBucketStore":
+        import redis
+
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key: str, quota: Quota, cost: float) -> Tuple[bool, float]:
+        allowed, retry_after = self._script(keys=[f"ratelimit:{key}"], args=[quota.capacity, quota.rate, cost])
+        return bool(int(allowed)), float(retry_after)
+
+    def refund(self, key: str, quota: Quota, cost: float) -> None:
+        self._refund_script(keys=[f"ratelimit:{key}"], args=[quota.capacity, cost])
+
+    def reset(self) -> None:
+        for key in self.client.scan_iter("ratelimit:*"):
+            self.client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self, store_factory: Callable[[], object]):
+        self._store_factory = store_factory
+        self._store = None
+        self.enabled = True
+
+    @property
+    def store(self):
+        # Criado no primeiro uso: o backend (ou o cliente Redis) so e exigido quando ha trafego
+        if self._store is None:
+            self._store = self._store_factory()
+        return self._store
+
+    @staticmethod
+    def quotas_for(api_key: str) -> Tuple[Quota, Quota]:
+        overrides = settings.RATE_LIMIT_OVERRIDES.get(api_key, {})
+        return (
+            Quota("requests", overrides.get("requests_per_minute", settings.RATE_LIMIT_REQUESTS_PER_MINUTE)),
+            Quota("items", overrides.get("items_per_minute", settings.RATE_LIMIT_ITEMS_PER_MINUTE)),
+        )
+
+    @staticmethod
+    def client_key(request: Request) -> str:
+        """Hash da X-API-Key (a chave em si nao vai para o backend); sem chave, o IP."""
+        api_key = request.headers.get("x-api-key")
+        if not api_key:
+            return f"ip:{request.client.host if request.client else 'unknown'}"
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+
+    def hit(self, request: Request, items: int = 0) -> None:
+        """
+        Consome uma requisicao e, se informado, `items` itens da quota da chave.
+        Uma recusa na quota de itens devolve o token de requisicao: um lote
+        recusado nao gasta nenhuma das duas quotas.
+        """
+        if not self.enabled:
+            return
+        requests_quota, items_quota = self.quotas_for(request.headers.get("x-api-key", ""))
+        if items > items_quota.capacity:
+            raise RateLimitExceeded(items_quota, retry_after=None)
+        key = self.client_key(request)
+        self._take(key, requests_quota, 1)
+        if items:
+            try:
+                self.hit_items(request, items, items_quota)
+            except RateLimitExceeded:
+                self.store.refund(f"{requests_quota.name}:{key}", requests_quota, 1)
+                raise
+
+    def hit_items(self, request: Request, items: int, quota: Optional[Quota] = None) -> None:
+        """Consome apenas a quota de itens (lotes cujo tamanho so e conhecido aos poucos)."""
+        if not self.enabled or items <= 0:
+            return
+        quota = quota or self.quotas_for(request.headers.get("x-api-key", ""))[1]
+        if items > quota.capacity:
+            # Nunca cabera no bucket: esperar nao adianta
+            raise RateLimitExceeded(quota, retry_after=None)
+        self._take(self.client_key(request), quota, items)
+
+    def _take(self, key: str, quota: Quota, cost: float) -> None:
+        allowed, retry_after = self.store.take(f"{quota.name}:{key}", quota, cost)
+        if not allowed:
+            raise RateLimitExceeded(quota, retry_after)
+
+    def reset(self) -> None:
+        if self._store is not None:
+            self._store.reset()
+
+
+def _build_store():
+    if settings.RATE_LIMIT_BACKEND == "database":
+        from .database import SessionLocal
+
+        return DatabaseBucketStore(SessionLocal)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBucketStore.from_url(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryBucketStore()
+
+
+limiter = RateLimiter(_build_store)
@@ -1,26 +1,51 @@
-from fastapi import FastAPI
-from app import api, database, models
+import math
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
+from fastapi.concurrency import run_in_threadpool
+from app import api, database
+from app.async_database import dispose_async_engine
+from app.core.config import settings
+from app.core.gc_config import configure_gc, freeze_startup_objects
 from app.core.logging_config import configure_logging
-from app.limiter import limiter
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
+from app.dependencies import validate_metrics_key
+from app.idempotency_cache import idempotency_cache
+from app.jobs import job_runner
+from app.limiter import RateLimitExceeded, limiter
+from app.metrics import PROMETHEUS_CONTENT_TYPE, RATE_LIMIT_REJECTIONS, register_pool_metrics, registry
+from app.migrations import migrate
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 
 # Configura o logging como a primeira acao
 configure_logging()
 
-models.Base.metadata.create_all(bind=database.engine)
+register_pool_metrics(database.engine)
 
-app = FastAPI(title="Conty PIX Challenge")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Com varios workers o schema e criado antes, uma unica vez, pelo app.server
+    if settings.DB_AUTO_MIGRATE:
+        migrate(database.engine)
+    if settings.BATCH_EXECUTION_BACKEND == "threads":
+        # Retoma os jobs que um processo anterior deixou pela metade
+        job_runner.start_recovery()
+    configure_gc()
+    freeze_startup_objects()
+    yield
+    await run_in_threadpool(job_runner.shutdown)
+    await dispose_async_engine()
+
+app = FastAPI(title="Conty PIX Challenge", lifespan=lifespan)
 app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
 
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    RATE_LIMIT_REJECTIONS.inc()
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
     return JSONResponse(
         status_code=429,
-        content={"detail": f"Rate limit exceeded: {exc.detail}"}
+        content={"detail": f"Rate limit exceeded: {exc}"},
+        headers=headers,
     )
 
 app.include_router(api.router, prefix="/api/v1")
@@ -29,6 +54,11 @@ app.include_router(api.router, prefix="/api/v1")
 def read_root():
     return {"status": "ok"}
 
+@app.get("/metrics", tags=["Health Check"], include_in_schema=False, dependencies=[Depends(validate_metrics_key)])
+def metrics():
+    """Metricas do processo no formato texto do Prometheus."""
+    return Response(content=registry.expose(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.get("/health", tags=["Health Check"])
 def health_check():
     """Rich health check with database connectivity and application info."""
@@ -57,4 +87,7 @@ def health_check():
         health_data["status"] = "degraded"
         health_data["checks"]["database"] = f"unhealthy: {str(e)}"
 
+    if idempotency_cache is not None:
+        health_data["idempotency_cache"] = idempotency_cache.stats()
+
     return health_data
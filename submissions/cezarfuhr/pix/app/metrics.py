@@ -0,0 +1,266 @@
+"""
+Registro de metricas em processo, exposto em `/metrics` no formato texto do Prometheus.
+
+Sem dependencias externas: cada metrica guarda seus valores sob um lock proprio
+e uma observacao custa um `bisect` e algumas somas, entao a instrumentacao pode
+ficar ligada em producao. Gauges calculados na coleta (pool do banco) usam
+callbacks, sem custo no caminho quente.
+
+Os valores sao por processo: cada worker de `app.worker` tem o seu registro.
+"""
+import collections
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .core.config import settings
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Limites em segundos: de operacoes em memoria (sub-ms) a lotes grandes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def expose(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._callback = callback
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Incrementa enquanto o bloco executa."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def value(self) -> float:
+        return self._callback() if self._callback is not None else self._value
+
+    def _samples(self) -> Iterable[str]:
+        try:
+            value = self.value()
+        except Exception:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por serie: contagem por bucket (nao cumulativa; o ultimo e o +Inf), soma e total
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), total[0]) for key, (counts, total) in self._series.items()]
+
+        lines = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "payout_stage_duration_seconds",
+    "Duracao de cada etapa do processamento de um chunk",
+    labelnames=("stage",),
+)
+ITEMS_TOTAL = registry.counter(
+    "payout_items_total", "Itens processados por status final", labelnames=("status",)
+)
+BATCHES_IN_FLIGHT = registry.gauge("payout_batches_in_flight", "Lotes em processamento neste processo")
+RATE_LIMIT_REJECTIONS = registry.counter(
+    "rate_limit_rejections_total", "Requisicoes recusadas pelo rate limiter (HTTP 429)"
+)
+
+PROVIDER_CALLS = registry.counter(
+    "provider_calls_total",
+    "Chamadas ao provedor PIX por resultado (paid, rejected, error, short_circuited)",
+    labelnames=("provider", "result"),
+)
+PROVIDER_CALL_DURATION = registry.histogram(
+    "provider_call_duration_seconds", "Duracao das chamadas HTTP ao provedor PIX", labelnames=("provider",)
+)
+
+
+@contextmanager
+def _noop() -> Iterator[None]:
+    yield
+
+
+def stage_timer(stage: str):
+    """Mede uma etapa (`duplicate_lookup`, `settlement`, `persistence`, `serialization`)."""
+    if not settings.METRICS_ENABLED:
+        return _noop()
+    return STAGE_DURATION.time(stage=stage)
+
+
+def track_batch():
+    """Conta o lote em `payout_batches_in_flight` enquanto o bloco executa."""
+    if not settings.METRICS_ENABLED:
+        return _noop()
+    return BATCHES_IN_FLIGHT.track()
+
+
+def record_outcomes(statuses: Iterable[str]) -> None:
+    if not settings.METRICS_ENABLED:
+        return
+    for status, count in collections.Counter(statuses).items():
+        ITEMS_TOTAL.inc(count, status=status)
+
+
+def record_provider_call(provider: str, result: str, seconds: Optional[float] = None) -> None:
+    if not settings.METRICS_ENABLED:
+        return
+    PROVIDER_CALLS.inc(provider=provider, result=result)
+    if seconds is not None:
+        PROVIDER_CALL_DURATION.observe(seconds, provider=provider)
+
+
+def register_pool_metrics(engine) -> None:
+    """Gauges de saturacao do pool do engine sincrono, lidos apenas na coleta."""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return
+    registry.gauge(
+        "db_pool_checked_out", "Conexoes do pool em uso", callback=lambda: pool.checkedout()
+    )
+    registry.gauge(
+        "db_pool_size", "Conexoes persistentes do pool (sem overflow)", callback=lambda: pool.size()
+    )
+    registry.gauge(
+        "db_pool_capacity",
+        "Maximo de conexoes simultaneas (pool + max_overflow)",
+        callback=lambda: pool.size() + max(0, getattr(pool, "_max_overflow", 0)),
+    )
@@ -0,0 +1,125 @@
+"""
+Passo explicito de criacao/atualizacao do schema.
+
+Roda uma vez por deploy (`python -m app.cli migrate`, ou pelo `app.server`
+antes de subir os workers), e nao a cada import de `app.main`. Alem do
+`create_all`, acrescenta colunas e indices que modelos novos trouxeram para
+tabelas ja existentes. Mudancas destrutivas (remover ou alterar colunas)
+continuam manuais.
+
+Com `PAYOUTS_PARTITIONING=monthly` no Postgres, uma tabela `payouts` ainda
+inexistente e criada particionada por mes de `created_at` (particao default
+mais os meses correntes e `PAYOUTS_PARTITIONS_AHEAD` seguintes). Uma tabela
+ja populada nao e convertida automaticamente.
+"""
+import copy
+import logging
+from datetime import date, timedelta
+from typing import List, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn, CreateIndex, DefaultClause
+
+from . import models
+from .core.config import settings
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(engine: Optional[Engine] = None) -> List[str]:
+    """Cria tabelas ausentes e adiciona colunas/indices novos; devolve o que foi alterado."""
+    if engine is None:
+        from .database import engine
+
+    applied: List[str] = []
+    partitioned = engine.dialect.name == "postgresql" and settings.PAYOUTS_PARTITIONING != "none"
+    if partitioned and not inspect(engine).has_table(models.PayoutDB.__tablename__):
+        with engine.begin() as conn:
+            _create_partitioned_payouts(conn)
+        applied.append("create partitioned table payouts")
+
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        if partitioned:
+            applied.extend(ensure_payout_partitions(conn))
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(
+                        f"{table.name}.{column.name} e NOT NULL sem server_default; migre manualmente"
+                    )
+                conn.exec_driver_sql(_add_column_ddl(engine, column))
+                applied.append(f"add column {table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    conn.execute(CreateIndex(index))
+                    applied.append(f"create index {index.name}")
+
+    if applied:
+        logger.info("schema_migrated", extra={"changes": applied, "event": "schema_migrated"})
+    return applied
+
+
+def _add_column_ddl(engine: Engine, column) -> str:
+    table = engine.dialect.identifier_preparer.format_table(column.table)
+    if engine.dialect.name == "sqlite" and isinstance(column.server_default, DefaultClause) \
+            and not isinstance(column.server_default.arg, str):
+        # O SQLite so aceita defaults constantes em ADD COLUMN (nada de CURRENT_TIMESTAMP);
+        # a coluna anulavel entra sem default e as linhas antigas ficam com NULL
+        column = copy.copy(column)
+        column.server_default = None
+    spec = CreateColumn(column).compile(dialect=engine.dialect)
+    return f"ALTER TABLE {table} ADD COLUMN {spec}"
+
+
+def _create_partitioned_payouts(conn: Connection) -> None:
+    # A chave de particionamento precisa fazer parte da PK; a unicidade global
+    # de external_id fica na tabela `payout_keys`
+    conn.exec_driver_sql(
+        "CREATE TABLE payouts ("
+        "id BIGINT GENERATED BY DEFAULT AS IDENTITY, "
+        "external_id VARCHAR NOT NULL, "
+        "status VARCHAR, "
+        "amount_cents INTEGER, "
+        "batch_id VARCHAR, "
+        "user_id VARCHAR, "
+        "provider_reference VARCHAR, "
+        "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "reserved_at TIMESTAMP WITHOUT TIME ZONE, "
+        "reservation_owner VARCHAR, "
+        "PRIMARY KEY (id, created_at)"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    conn.exec_driver_sql("CREATE INDEX ix_payouts_external_id ON payouts (external_id)")
+    conn.exec_driver_sql("CREATE TABLE payouts_default PARTITION OF payouts DEFAULT")
+
+
+def ensure_payout_partitions(conn: Connection, today: Optional[date] = None) -> List[str]:
+    """Cria (se faltarem) as particoes mensais do mes corrente e dos proximos meses."""
+    month = (today or date.today()).replace(day=1)
+    created: List[str] = []
+    existing = set(
+        conn.exec_driver_sql(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'payouts'"
+        ).scalars()
+    )
+    for _ in range(settings.PAYOUTS_PARTITIONS_AHEAD + 1):
+        following = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        name = f"payouts_{month:%Y_%m}"
+        if name not in existing:
+            conn.exec_driver_sql(
+                f"CREATE TABLE {name} PARTITION OF payouts "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            )
+            created.append(f"create partition {name}")
+        month = following
+    return created
@@ -0,0 +1,122 @@
+"""
+Provedor PIX local para testes e benchmarks do HTTPProvider.
+
+Uso:
+
+    python -m app.mock_provider --port 9000                      # perfil healthy
+    python -m app.mock_provider --profile degraded --error-rate 0.4
+
+Responde `POST /payments` no protocolo descrito em `app.http_provider`, com
+latencia e falhas definidas por um perfil (PROFILES). `GET /profile` mostra
+o perfil atual e `PUT /profile` troca o perfil com o servidor rodando, para
+simular uma degradacao no meio de um lote. O Idempotency-Key e respeitado:
+um pagamento repetido devolve a mesma referencia.
+"""
+import argparse
+import asyncio
+import random
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+
+class Profile(BaseModel):
+    name: str = "custom"
+    latency_ms: float = Field(20.0, ge=0)
+    jitter_ms: float = Field(0.0, ge=0)
+    # Respostas 503
+    error_rate: float = Field(0.0, ge=0, le=1)
+    # Recusas de negocio (422)
+    reject_rate: float = Field(0.0, ge=0, le=1)
+    # Chamadas que nunca respondem a tempo (o cliente estoura o timeout)
+    hang_rate: float = Field(0.0, ge=0, le=1)
+    hang_seconds: float = Field(30.0, ge=0)
+    # Chamadas simultaneas aceitas; acima disso responde 429 (0: sem limite)
+    max_in_flight: int = Field(0, ge=0)
+
+
+PROFILES: Dict[str, Profile] = {
+    "healthy": Profile(name="healthy", latency_ms=20, jitter_ms=10, reject_rate=0.02),
+    "slow": Profile(name="slow", latency_ms=250, jitter_ms=150, reject_rate=0.02),
+    "degraded": Profile(name="degraded", latency_ms=150, jitter_ms=200, error_rate=0.3, reject_rate=0.02, hang_rate=0.05),
+    "outage": Profile(name="outage", latency_ms=50, error_rate=1.0),
+}
+
+
+def create_app(profile: Profile, seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI(title="Mock PIX provider")
+    state = {"profile": profile, "in_flight": 0}
+    references: Dict[str, str] = {}
+    rng = random.Random(seed)
+
+    @app.get("/profile")
+    def get_profile() -> Profile:
+        return state["profile"]
+
+    @app.put("/profile")
+    def put_profile(new_profile: Profile) -> Profile:
+        # Um nome conhecido sem outros campos seleciona o perfil pronto
+        if new_profile.name in PROFILES and not new_profile.model_fields_set - {"name"}:
+            new_profile = PROFILES[new_profile.name]
+        state["profile"] = new_profile
+        return new_profile
+
+    @app.post("/payments")
+    async def payments(payment: dict, idempotency_key: Optional[str] = Header(None)):
+        current: Profile = state["profile"]
+        key = idempotency_key or payment.get("external_id")
+        if key in references:
+            return {"status": "paid", "reference": references[key]}
+        if current.max_in_flight and state["in_flight"] >= current.max_in_flight:
+            return JSONResponse({"error": "too many requests"}, status_code=429)
+
+        state["in_flight"] += 1
+        try:
+            roll = rng.random()
+            if roll < current.hang_rate:
+                await asyncio.sleep(current.hang_seconds)
+            await asyncio.sleep((current.latency_ms + rng.uniform(0, current.jitter_ms)) / 1000)
+        finally:
+            state["in_flight"] -= 1
+
+        roll = rng.random()
+        if roll < current.error_rate:
+            return JSONResponse({"error": "provider unavailable"}, status_code=503)
+        if roll < current.error_rate + current.reject_rate:
+            return JSONResponse({"status": "rejected", "reason": "invalid pix key"}, status_code=422)
+        references[key] = uuid.uuid4().hex
+        return {"status": "paid", "reference": references[key]}
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.mock_provider", description="Provedor PIX local")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="healthy")
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--jitter-ms", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--reject-rate", type=float)
+    parser.add_argument("--hang-rate", type=float)
+    parser.add_argument("--max-in-flight", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    overrides = {
+        field: value for field, value in vars(args).items()
+        if field in Profile.model_fields and value is not None
+    }
+    profile = PROFILES[args.profile].model_copy(update=overrides)
+
+    import uvicorn
+
+    uvicorn.run(create_app(profile, args.seed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
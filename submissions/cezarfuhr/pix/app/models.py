@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field, SecretStr, field_validator, ConfigDict
-from typing import List
-from sqlalchemy import Column, String, Integer, UniqueConstraint
+from pydantic import BaseModel, Field, SecretStr, field_validator, model_validator, ConfigDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, LargeBinary, String, Integer, Text, UniqueConstraint, func
 from .database import Base
 
 class PayoutItem(BaseModel):
@@ -24,23 +25,281 @@ class PayoutBatch(BaseModel):
     batch_id: str = Field(..., min_length=1, max_length=255, description="Batch identifier")
     items: List[PayoutItem] = Field(..., min_length=1, description="List of payout items (must have at least 1)")
 
+    @model_validator(mode='after')
+    def reject_conflicting_amounts(self) -> 'PayoutBatch':
+        # Um id repetido e so uma duplicata se for o mesmo pagamento; com outro valor o lote e ambiguo
+        amounts: Dict[str, int] = {}
+        conflicting = {
+            item.external_id
+            for item in self.items
+            if amounts.setdefault(item.external_id, item.amount_cents) != item.amount_cents
+        }
+        if conflicting:
+            raise ValueError(f'external_id repeated with different amount_cents: {sorted(conflicting)[:10]}')
+        return self
+
+class PayoutBatchHeader(BaseModel):
+    """Primeira linha de um lote NDJSON; os itens vem nas linhas seguintes."""
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    batch_id: str = Field(..., min_length=1, max_length=255, description="Batch identifier")
+
 class PayoutDetail(BaseModel):
     external_id: str
     status: str
     amount_cents: int
 
+class PayoutRecord(PayoutDetail):
+    """Payout pago como e gravado em `payouts`: o detalhe mais as dimensoes do lote."""
+    batch_id: Optional[str] = None
+    user_id: Optional[str] = None
+    provider_reference: Optional[str] = None
+
 class PayoutReport(BaseModel):
     batch_id: str
     processed: int = Field(..., ge=0)
     successful: int = Field(..., ge=0)
     failed: int = Field(..., ge=0)
     duplicates: int = Field(..., ge=0)
+    # Itens com a reserva de outra liquidacao ainda em andamento: resultado desconhecido
+    pending: int = Field(0, ge=0)
     details: List[PayoutDetail]
 
+class BatchSummary(BaseModel):
+    """Contadores e totais por status de um lote, lidos da tabela `batch_summary`."""
+    model_config = ConfigDict(from_attributes=True)
+
+    batch_id: str
+    processed: int = Field(..., ge=0)
+    successful: int = Field(..., ge=0)
+    failed: int = Field(..., ge=0)
+    duplicates: int = Field(..., ge=0)
+    paid_amount_cents: int = Field(..., ge=0)
+    failed_amount_cents: int = Field(..., ge=0)
+    duplicate_amount_cents: int = Field(..., ge=0)
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class BatchSummaryPage(BaseModel):
+    items: List[BatchSummary]
+    # batch_id a passar em `after` para a proxima pagina; None na ultima
+    next_cursor: Optional[str] = None
+
+class BatchJobStatus(BaseModel):
+    batch_id: str
+    status: str
+    total_items: int = Field(..., ge=0)
+    processed_items: int = Field(..., ge=0)
+    successful: int = Field(..., ge=0)
+    failed: int = Field(..., ge=0)
+    duplicates: int = Field(..., ge=0)
+    report: Optional[PayoutReport] = None
+
 class PayoutDB(Base):
     __tablename__ = "payouts"
+    __table_args__ = (
+        Index("ix_payouts_batch_status", "batch_id", "status"),
+        Index("ix_payouts_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    # Indice unico (B-tree): a deteccao de duplicatas e O(log n) no tamanho da tabela
     external_id = Column(String, unique=True, index=True)
     status = Column(String)
     amount_cents = Column(Integer)
+    batch_id = Column(String, nullable=True)
+    user_id = Column(String, nullable=True)
+    # Identificador da transacao no provedor, quando ele devolve um
+    provider_reference = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
+    # Inicio da reserva corrente (status `pending`); vencida, a reserva pode ser retomada
+    reserved_at = Column(DateTime, nullable=True)
+    # Job dono da reserva corrente (lote assincrono ou retentativa); so ele a retoma antes do vencimento
+    reservation_owner = Column(String, nullable=True)
+
+class PayoutKeyDB(Base):
+    """
+    Chaves de idempotencia fora da tabela `payouts`, usadas apenas com
+    `PAYOUTS_PARTITIONING` no Postgres: uma tabela particionada por
+    `created_at` nao aceita UNIQUE so em `external_id`, entao a unicidade
+    global fica aqui e cada INSERT em `payouts` passa antes por esta tabela.
+    """
+    __tablename__ = "payout_keys"
+
+    external_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class BatchJobDB(Base):
+    __tablename__ = "batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String, unique=True, index=True, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    total_items = Column(Integer, nullable=False)
+    processed_items = Column(Integer, nullable=False, default=0)
+    successful = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    payload = Column(Text, nullable=True)
+    report = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class BatchSummaryDB(Base):
+    """
+    Agregado por lote, incrementado a cada chunk liquidado (em qualquer
+    caminho: sincrono, streaming, NDJSON, CLI ou fila), para que o relatorio
+    de um lote nao precise varrer `payouts`.
+    """
+    __tablename__ = "batch_summary"
+
+    batch_id = Column(String, primary_key=True)
+    # Liquidacoes tentadas (`successful + failed`), como em PayoutReport.processed
+    processed = Column(Integer, nullable=False, default=0)
+    successful = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    paid_amount_cents = Column(BigInteger, nullable=False, default=0)
+    failed_amount_cents = Column(BigInteger, nullable=False, default=0)
+    duplicate_amount_cents = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class BatchResponseDB(Base):
+    """
+    Primeira resposta de `POST /payouts/batch` por chave de idempotencia
+    (header `Idempotency-Key` ou o `batch_id`). Enquanto a primeira execucao
+    roda, a linha fica `in_progress` com um lease; depois vira `completed` com
+    o relatorio JSON comprimido (zlib), devolvido byte a byte nos replays.
+    """
+    __tablename__ = "batch_responses"
+
+    idempotency_key = Column(String, primary_key=True)
+    batch_id = Column(String, nullable=False)
+    # sha256 do corpo da requisicao: a mesma chave com outro corpo e rejeitada
+    request_hash = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="in_progress")
+    response = Column(LargeBinary, nullable=True)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class PayoutJobDB(Base):
+    """Item de lote na fila duravel consumida por `python -m app.worker`."""
+    __tablename__ = "payout_jobs"
+    __table_args__ = (
+        Index("ix_payout_jobs_claim", "status", "lease_expires_at"),
+        Index("ix_payout_jobs_batch_position", "batch_id", "position"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String, nullable=False)
+    position = Column(Integer, nullable=False)
+    external_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    amount_cents = Column(Integer, nullable=False)
+    pix_key = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    result_status = Column(String, nullable=True)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+
+class PayoutRetryDB(Base):
+    """
+    Item que falhou na liquidacao, ou cuja chamada ficou sem resposta no
+    prazo, aguardando retentativa por `python -m app.retries`.
+
+    Status: `pending` (aguardando `next_attempt_at`), `leased` (em tentativa),
+    `paid`, `duplicate` (pago por outro caminho antes da retentativa) e
+    `failed_permanently` (esgotou RETRY_MAX_ATTEMPTS).
+    """
+    __tablename__ = "payout_retries"
+    __table_args__ = (
+        Index("ix_payout_retries_due", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    external_id = Column(String, nullable=False, unique=True)
+    batch_id = Column(String, nullable=True)
+    user_id = Column(String, nullable=False)
+    amount_cents = Column(Integer, nullable=False)
+    pix_key = Column(String, nullable=False)
+    provider = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    # Como o item esta no agregado `batch_summary`: `failed`, ou `pending` (chamada sem
+    # resposta no prazo, ainda fora do agregado ate a primeira resposta definitiva)
+    original_status = Column(String, nullable=False, server_default="failed")
+    # Tentativas ja feitas, incluindo a liquidacao original
+    attempts = Column(Integer, nullable=False, default=1)
+    next_attempt_at = Column(DateTime, nullable=False)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class WebhookOutboxDB(Base):
+    """
+    Evento de resultado de um payout para um assinante de webhook (outbox
+    transacional). E gravado na mesma transacao que o fato que descreve
+    (`payouts`, `payout_retries`) e entregue depois por `python -m app.webhooks`.
+
+    Status: `pending` (aguardando `next_attempt_at`), `leased` (em entrega),
+    `delivered` e `dead` (esgotou WEBHOOK_MAX_ATTEMPTS).
+    """
+    __tablename__ = "webhook_outbox"
+    __table_args__ = (
+        Index("ix_webhook_outbox_due", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    subscriber = Column(String, nullable=False)
+    # payout.paid, payout.failed ou payout.failed_permanently
+    event_type = Column(String, nullable=False)
+    external_id = Column(String, nullable=False)
+    batch_id = Column(String, nullable=True)
+    user_id = Column(String, nullable=True)
+    amount_cents = Column(Integer, nullable=False)
+    provider_reference = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class ReconciliationDB(Base):
+    """Resumo de uma conciliacao entre um arquivo de liquidacao do provedor e `payouts`."""
+    __tablename__ = "reconciliations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)
+    # Janela de `payouts.created_at` conciliada (NULL: sem limite)
+    since = Column(DateTime, nullable=True)
+    until = Column(DateTime, nullable=True)
+    file_rows = Column(Integer, nullable=False, default=0)
+    db_rows = Column(Integer, nullable=False, default=0)
+    matched = Column(Integer, nullable=False, default=0)
+    # Pago em `payouts` e ausente do arquivo
+    missing = Column(Integer, nullable=False, default=0)
+    # No arquivo e ausente de `payouts`
+    extra = Column(Integer, nullable=False, default=0)
+    amount_mismatch = Column(Integer, nullable=False, default=0)
+    # Linhas repetidas do mesmo external_id no arquivo
+    duplicates = Column(Integer, nullable=False, default=0)
+    file_amount_cents = Column(BigInteger, nullable=False, default=0)
+    db_amount_cents = Column(BigInteger, nullable=False, default=0)
+    discrepancies_path = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+
+class RateLimitBucketDB(Base):
+    """Token bucket do rate limiter compartilhado (`RATE_LIMIT_BACKEND=database`)."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
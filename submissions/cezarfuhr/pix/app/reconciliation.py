@@ -0,0 +1,176 @@
+"""
+Conciliacao entre o arquivo de liquidacao do provedor (CSV) e a tabela `payouts`.
+
+Uso:
+
+    python -m app.cli reconcile liquidacao.csv --since 2026-10-17 --until 2026-10-18
+
+O arquivo tem cabecalho com ao menos `external_id` e `amount_cents` (as demais
+colunas sao ignoradas) e vem ordenado por `external_id` em ordem de bytes
+(`LC_ALL=C sort -t, -k1,1`). Arquivo e tabela sao percorridos juntos em um
+merge-join: cada lado e lido uma unica vez, em streaming e na mesma ordem, e
+so a linha corrente de cada um fica em memoria, entao o consumo nao depende
+do numero de linhas.
+
+As divergencias vao para um CSV (`kind,external_id,file_amount_cents,db_amount_cents`):
+
+- `missing`: pago em `payouts` e ausente do arquivo
+- `extra`: no arquivo e ausente de `payouts`
+- `amount_mismatch`: nos dois, com valores diferentes
+- `duplicate`: `external_id` repetido no arquivo
+
+O resumo (contadores e totais) e gravado em `reconciliations`.
+"""
+import csv
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional, TextIO, Tuple
+
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .database import SessionLocal
+from .repository import ReconciliationRepository
+
+Row = Tuple[str, int]
+Report = Callable[[Tuple[str, str, Optional[int], Optional[int]]], object]
+
+
+class ReconciliationError(ValueError):
+    """Arquivo de liquidacao invalido ou fora de ordem."""
+
+
+@dataclass
+class ReconciliationSummary:
+    source: str
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    file_rows: int = 0
+    db_rows: int = 0
+    matched: int = 0
+    missing: int = 0
+    extra: int = 0
+    amount_mismatch: int = 0
+    duplicates: int = 0
+    file_amount_cents: int = 0
+    db_amount_cents: int = 0
+    discrepancies_path: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+def read_settlement_file(stream: TextIO) -> Iterator[Row]:
+    """(external_id, amount_cents) de cada linha, conferindo a ordem do arquivo."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None or "external_id" not in header or "amount_cents" not in header:
+        raise ReconciliationError("settlement file header must include external_id and amount_cents")
+    id_column, amount_column = header.index("external_id"), header.index("amount_cents")
+
+    previous = ""
+    for row in reader:
+        if not row:
+            continue
+        try:
+            external_id, amount_cents = row[id_column], int(row[amount_column])
+        except (IndexError, ValueError):
+            raise ReconciliationError(f"line {reader.line_num}: invalid row") from None
+        if external_id < previous:
+            raise ReconciliationError(
+                f"line {reader.line_num}: file is not sorted by external_id (sort it with LC_ALL=C sort)"
+            )
+        previous = external_id
+        yield external_id, amount_cents
+
+
+def merge(file_rows: Iterable[Row], db_rows: Iterable[Row], summary: ReconciliationSummary, report: Report) -> None:
+    """
+    Merge-join de dois fluxos ordenados por external_id. Acumula os
+    contadores em `summary` e chama `report` para cada divergencia.
+    """
+    files, rows = iter(file_rows), iter(db_rows)
+    current = next(rows, None)
+    file_count = db_count = matched = missing = extra = mismatch = duplicates = 0
+    file_amount = db_amount = 0
+    last_id = None
+
+    for external_id, amount_cents in files:
+        file_count += 1
+        if external_id == last_id:
+            duplicates += 1
+            report(("duplicate", external_id, amount_cents, None))
+            continue
+        last_id = external_id
+        file_amount += amount_cents
+
+        while current is not None and current[0] < external_id:
+            db_count += 1
+            db_amount += current[1]
+            missing += 1
+            report(("missing", current[0], None, current[1]))
+            current = next(rows, None)
+
+        if current is not None and current[0] == external_id:
+            db_count += 1
+            db_amount += current[1]
+            if current[1] == amount_cents:
+                matched += 1
+            else:
+                mismatch += 1
+                report(("amount_mismatch", external_id, amount_cents, current[1]))
+            current = next(rows, None)
+        else:
+            extra += 1
+            report(("extra", external_id, amount_cents, None))
+
+    while current is not None:
+        db_count += 1
+        db_amount += current[1]
+        missing += 1
+        report(("missing", current[0], None, current[1]))
+        current = next(rows, None)
+
+    summary.file_rows += file_count
+    summary.db_rows += db_count
+    summary.matched += matched
+    summary.missing += missing
+    summary.extra += extra
+    summary.amount_mismatch += mismatch
+    summary.duplicates += duplicates
+    summary.file_amount_cents += file_amount
+    summary.db_amount_cents += db_amount
+
+
+def reconcile(
+    path: str,
+    discrepancies_path: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session_factory: Callable[[], Session] = SessionLocal,
+    batch_size: int = settings.RECONCILIATION_FETCH_SIZE,
+) -> dict:
+    """Concilia o arquivo com `payouts` (na janela de created_at), grava o resumo e o devolve."""
+    discrepancies_path = discrepancies_path or f"{path}.discrepancies.csv"
+    summary = ReconciliationSummary(
+        source=os.path.abspath(path), since=since, until=until,
+        discrepancies_path=os.path.abspath(discrepancies_path), started_at=datetime.utcnow(),
+    )
+    db = session_factory()
+    try:
+        repository = ReconciliationRepository(db)
+        with open(path, newline="") as stream, open(discrepancies_path, "w", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(("kind", "external_id", "file_amount_cents", "db_amount_cents"))
+            merge(
+                read_settlement_file(stream),
+                repository.stream_paid(since, until, batch_size),
+                summary,
+                writer.writerow,
+            )
+        summary.finished_at = datetime.utcnow()
+        result = asdict(summary)
+        result["id"] = repository.save(asdict(summary))
+    finally:
+        db.close()
+    return result
@@ -0,0 +1,87 @@
+"""
+Idempotency-Key em `POST /payouts/batch`.
+
+A primeira requisicao com uma chave reserva a linha em `batch_responses`,
+liquida o lote e grava o relatorio JSON comprimido. Um replay com o mesmo
+corpo recebe esse relatorio byte a byte com uma unica leitura pela PK, sem
+consultar `payouts` nem chamar o provedor. Replays que chegam enquanto a
+primeira execucao roda esperam por ela (polling no banco, entao funciona
+entre workers e replicas) ate IDEMPOTENCY_WAIT_TIMEOUT_SECONDS.
+"""
+import asyncio
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .repository import BatchResponseRepository
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyKeyReused(Exception):
+    """A chave ja foi usada com outro corpo de requisicao."""
+
+
+class IdempotencyKeyInProgress(Exception):
+    """A primeira execucao da chave nao terminou dentro do tempo de espera."""
+
+
+def idempotency_key(header: Optional[str], batch_id: str) -> Optional[str]:
+    """O header, se enviado; senao o `batch_id` quando IDEMPOTENCY_KEY_FROM_BATCH_ID esta ligado."""
+    if header:
+        return header
+    if settings.IDEMPOTENCY_KEY_FROM_BATCH_ID:
+        return f"batch_id:{batch_id}"
+    return None
+
+
+def request_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+class BatchReplay:
+    """Coordena a primeira execucao e os replays de uma chave de idempotencia."""
+
+    def __init__(self, db_session: Session, key: str, batch_id: str, body_hash: str):
+        self.responses = BatchResponseRepository(db_session)
+        self.key = key
+        self.batch_id = batch_id
+        self.body_hash = body_hash
+        self.owner = uuid.uuid4().hex
+
+    async def acquire(self) -> Optional[bytes]:
+        """
+        Devolve a resposta gravada (replay) ou None quando esta requisicao
+        reservou a chave e deve liquidar o lote.
+        """
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+        while True:
+            row = await run_in_threadpool(self.responses.get, self.key)
+            if row is not None and row.request_hash != self.body_hash:
+                raise IdempotencyKeyReused(self.key)
+            if row is not None and row.status == "completed":
+                return BatchResponseRepository.decode(row)
+            # Sem linha, ou com o lease da primeira execucao vencido: tenta reservar
+            if row is None or row.lease_expires_at < datetime.utcnow():
+                claimed = await run_in_threadpool(
+                    self.responses.claim,
+                    self.key, self.batch_id, self.body_hash, self.owner, settings.IDEMPOTENCY_LEASE_SECONDS,
+                )
+                if claimed:
+                    return None
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInProgress(self.key)
+            await asyncio.sleep(settings.IDEMPOTENCY_WAIT_POLL_SECONDS)
+
+    async def complete(self, response: bytes) -> None:
+        await run_in_threadpool(self.responses.complete, self.key, self.owner, response)
+
+    async def release(self) -> None:
+        await run_in_threadpool(self.responses.release, self.key, self.owner)
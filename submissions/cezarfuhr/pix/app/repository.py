@@ -1,32 +1,1125 @@
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import Row, String, and_, any_, bindparam, case, column, delete, func, insert, literal, or_, select, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from . import models
+from .core.config import settings
+from .settlement import backoff_delay
+from .idempotency_cache import IdempotencyCache, idempotency_cache
+
+if TYPE_CHECKING:
+    # Importado so para anotacoes: o modo assincrono e opcional
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+# Sentinela para "usar o cache global", ja que None desliga o cache
+_GLOBAL_CACHE = object()
+
+def _partitioned(dialect: str) -> bool:
+    return dialect == "postgresql" and settings.PAYOUTS_PARTITIONING != "none"
+
+def _in_ids(dialect: str, column, ids: Sequence[str]):
+    """`= ANY(:ids)` no Postgres (um unico parametro), `IN (...)` nos demais."""
+    if dialect == "postgresql":
+        return column == any_(bindparam("ids", value=list(ids), type_=ARRAY(String)))
+    return column.in_(ids)
+
+def _in_flight_query(dialect: str, ids: Sequence[str]):
+    """SELECT dos ids com reserva `pending`."""
+    table = models.PayoutDB.__table__
+    return select(table.c.external_id).where(_in_ids(dialect, table.c.external_id, ids), table.c.status == "pending")
+
+def _insert_partitioned(rows: List[dict]):
+    """
+    Um unico statement para a tabela particionada: a CTE reserva os ids em
+    `payout_keys` (ON CONFLICT DO NOTHING) e so as linhas cujo id foi
+    reservado entram em `payouts`, na mesma transacao. O DISTINCT ON evita
+    gravar duas vezes um id repetido dentro do mesmo chunk.
+    """
+    table = models.PayoutDB.__table__
+    keys = models.PayoutKeyDB.__table__
+    new_keys = (
+        postgresql.insert(keys)
+        .values([{"external_id": row["external_id"], "created_at": row["created_at"]} for row in rows])
+        .on_conflict_do_nothing(index_elements=[keys.c.external_id])
+        .returning(keys.c.external_id)
+        .cte("new_keys")
+    )
+    names = list(rows[0])
+    incoming = values(*(column(name, table.c[name].type) for name in names), name="incoming").data(
+        [tuple(row[name] for name in names) for row in rows]
+    )
+    return (
+        insert(table)
+        .from_select(
+            names,
+            select(*incoming.c)
+            .join(new_keys, new_keys.c.external_id == incoming.c.external_id)
+            .ext(postgresql.distinct_on(incoming.c.external_id)),
+        )
+        .returning(table.c.external_id)
+    )
+
+# Colunas gravadas ao reservar um id (inclusive ao retomar uma reserva existente)
+_RESERVATION_COLUMNS = (
+    "status", "amount_cents", "batch_id", "user_id", "provider_reference", "reserved_at", "reservation_owner",
+)
+
+# Dono das reservas feitas pelo agendador de retentativas (`app.retries`). Basta um
+# valor fixo: `payout_retries` tem uma linha por external_id, reservada por lease
+RETRY_RESERVATION_OWNER = "retry"
+
+def _reservation_rows(items: Iterable, batch_id: Optional[str], owner: Optional[str] = None) -> List[dict]:
+    """Linhas `pending` dos itens a reservar, uma por external_id."""
+    now = datetime.utcnow()
+    rows: Dict[str, dict] = {}
+    for item in items:
+        rows.setdefault(item.external_id, {
+            "external_id": item.external_id,
+            "status": "pending",
+            "amount_cents": item.amount_cents,
+            "batch_id": getattr(item, "batch_id", None) or batch_id,
+            "user_id": getattr(item, "user_id", None),
+            "provider_reference": None,
+            "reserved_at": now,
+            "reservation_owner": owner,
+            "created_at": now,
+        })
+    return list(rows.values())
+
+def _reclaimable(stale_before: datetime, owner=None):
+    """
+    Reservas que podem ser retomadas: liquidacoes que falharam e `pending`
+    vencidas. Com `owner` (o reservation_owner da linha que chega), tambem as
+    `pending` gravadas por esse mesmo dono, de qualquer idade. Uma reserva
+    sem dono (NULL) nunca e igual a outra.
+    """
+    table = models.PayoutDB.__table__
+    conditions = [table.c.status == "failed", and_(table.c.status == "pending", table.c.reserved_at < stale_before)]
+    if owner is not None:
+        conditions.append(and_(table.c.status == "pending", table.c.reservation_owner == owner))
+    return or_(*conditions)
+
+def _reserve(dialect: str, rows: List[dict], stale_before: datetime, resume_own: bool = False):
+    """
+    INSERT ... ON CONFLICT DO UPDATE ... WHERE: um id novo entra como
+    `pending` e um id existente so e retomado se `_reclaimable`. O RETURNING
+    devolve exatamente os ids que este statement reservou.
+    """
+    table = models.PayoutDB.__table__
+    insert_for = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert_for(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.external_id],
+        set_={name: stmt.excluded[name] for name in _RESERVATION_COLUMNS},
+        where=_reclaimable(stale_before, stmt.excluded.reservation_owner if resume_own else None),
+    ).returning(table.c.external_id)
+
+def _reclaim_partitioned(rows: List[dict], stale_before: datetime, resume_own: bool = False):
+    """
+    Na tabela particionada nao ha ON CONFLICT em `external_id`: os ids novos
+    entram por `_insert_partitioned` e as reservas existentes sao retomadas
+    com este UPDATE ... FROM (VALUES ...). O lock de linha do UPDATE faz uma
+    segunda requisicao reavaliar o WHERE e nao retomar o mesmo id.
+    """
+    table = models.PayoutDB.__table__
+    names = ["external_id", *_RESERVATION_COLUMNS]
+    incoming = values(*(column(name, table.c[name].type) for name in names), name="incoming").data(
+        [tuple(row[name] for name in names) for row in rows]
+    )
+    return (
+        update(table)
+        .where(
+            table.c.external_id == incoming.c.external_id,
+            _reclaimable(stale_before, incoming.c.reservation_owner if resume_own else None),
+        )
+        .values({name: incoming.c[name] for name in _RESERVATION_COLUMNS})
+        .returning(table.c.external_id)
+    )
+
+def _mark_paid(dialect: str, paid: Sequence[models.PayoutDetail]):
+    """UPDATE das reservas pagas para `paid`, com o provider_reference de cada uma em um CASE."""
+    table = models.PayoutDB.__table__
+    references = {p.external_id: p.provider_reference for p in paid if getattr(p, "provider_reference", None)}
+    new_values = {"status": "paid"}
+    if references:
+        new_values["provider_reference"] = case(references, value=table.c.external_id, else_=None)
+    return (
+        update(table)
+        .where(_in_ids(dialect, table.c.external_id, [p.external_id for p in paid]), table.c.status == "pending")
+        .values(new_values)
+    )
+
+def _mark_failed(dialect: str, external_ids: Sequence[str]):
+    table = models.PayoutDB.__table__
+    return (
+        update(table)
+        .where(_in_ids(dialect, table.c.external_id, external_ids), table.c.status == "pending")
+        .values(status="failed")
+    )
+
+def _without_known_paid(items: Sequence, cache: Optional[IdempotencyCache]) -> List:
+    # Ids que o LRU sabe pagos nao precisam nem tentar a reserva
+    if cache is None:
+        return list(items)
+    known = cache.known_paid(item.external_id for item in items)
+    return [item for item in items if item.external_id not in known]
+
+_SUMMARY_STATUSES = {
+    "paid": ("successful", "paid_amount_cents"),
+    "failed": ("failed", "failed_amount_cents"),
+    "duplicate": ("duplicates", "duplicate_amount_cents"),
+}
+
+def _summary_increments(details: Sequence[models.PayoutDetail]) -> Dict[str, int]:
+    """
+    Contadores e totais de um chunk, no formato das colunas de `batch_summary`.
+    `processed` segue a definicao do PayoutReport (`successful + failed`):
+    duplicatas ficam so em `duplicates`, entao reenviar um lote nao infla
+    `processed` e o agregado e a soma dos relatorios das execucoes.
+    """
+    increments = {column: 0 for columns in _SUMMARY_STATUSES.values() for column in columns}
+    for detail in details:
+        if detail.status not in _SUMMARY_STATUSES:
+            # `pending`: o item entra no agregado por quem detem a reserva, quando ela terminar
+            continue
+        count_column, amount_column = _SUMMARY_STATUSES[detail.status]
+        increments[count_column] += 1
+        increments[amount_column] += detail.amount_cents
+    increments["processed"] = increments["successful"] + increments["failed"]
+    return increments
+
+def _upsert_batch_summary(dialect: str, batch_id: str, increments: Dict[str, int]):
+    """INSERT ... ON CONFLICT DO UPDATE somando os incrementos a linha do lote, atomico no banco."""
+    table = models.BatchSummaryDB.__table__
+    insert_for = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert_for(table).values(batch_id=batch_id, **increments)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.batch_id],
+        set_={
+            **{column: table.c[column] + stmt.excluded[column] for column in increments},
+            "updated_at": func.now(),
+        },
+    )
+
+def _retry_rows(
+    items: Sequence[models.PayoutItem], batch_id: Optional[str], provider: str, original_status: str = "failed"
+) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {
+            "external_id": item.external_id,
+            "batch_id": batch_id,
+            "user_id": item.user_id,
+            "amount_cents": item.amount_cents,
+            "pix_key": item.pix_key.get_secret_value(),
+            "provider": provider,
+            "status": "pending",
+            "original_status": original_status,
+            "attempts": 1,
+            "next_attempt_at": now + timedelta(seconds=backoff_delay(1)),
+        }
+        for item in items
+    ]
+
+def _schedule_retries(dialect: str, rows: List[dict]):
+    """
+    INSERT que ignora ids ja agendados (uma nova falha do mesmo id nao
+    reinicia o backoff) e devolve os ids agendados agora.
+    """
+    table = models.PayoutRetryDB.__table__
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table).values(rows).on_conflict_do_nothing(index_elements=[table.c.external_id])
+    else:
+        stmt = insert(table).prefix_with("OR IGNORE").values(rows)
+    return stmt.returning(table.c.external_id)
+
+def _hand_over_to_retries(dialect: str, external_ids: Sequence[str]):
+    """Passa as reservas `pending` para o agendador de retentativas, que pode retoma-las na hora."""
+    table = models.PayoutDB.__table__
+    return (
+        update(table)
+        .where(_in_ids(dialect, table.c.external_id, external_ids), table.c.status == "pending")
+        .values(reservation_owner=RETRY_RESERVATION_OWNER)
+    )
+
+def _outbox_rows(event_type: str, payouts: Iterable, batch_id: Optional[str] = None) -> List[dict]:
+    """Um evento por assinante de WEBHOOK_SUBSCRIBERS para cada payout; vazio sem assinantes."""
+    subscribers = list(settings.WEBHOOK_SUBSCRIBERS)
+    if not subscribers:
+        return []
+    now = datetime.utcnow()
+    return [
+        {
+            "subscriber": subscriber,
+            "event_type": event_type,
+            "external_id": p.external_id,
+            "batch_id": getattr(p, "batch_id", None) or batch_id,
+            "user_id": getattr(p, "user_id", None),
+            "amount_cents": p.amount_cents,
+            "provider_reference": getattr(p, "provider_reference", None),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+        }
+        for p in payouts
+        for subscriber in subscribers
+    ]
 
 class PayoutRepository:
+    def __init__(self, db_session: Session, cache: Optional[IdempotencyCache] = _GLOBAL_CACHE):
+        self.db = db_session
+        self.cache = idempotency_cache if cache is _GLOBAL_CACHE else cache
+
+    def reserve(
+        self,
+        items: Sequence,
+        batch_id: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> Set[str]:
+        """
+        Reserva os external_ids em `payouts` antes de chamar o provedor, com
+        um unico statement e um commit por chunk.
+
+        Um id novo entra como `pending`. Um id existente so e reservado de
+        novo se a liquidacao anterior falhou ou se a reserva venceu
+        (PAYOUT_RESERVATION_TIMEOUT_SECONDS). A decisao e do proprio banco
+        (`INSERT ... ON CONFLICT DO UPDATE ... WHERE ... RETURNING`), entao
+        duas requisicoes concorrentes nunca reservam o mesmo id. Devolve os
+        ids reservados por esta chamada: so eles podem ir ao provedor, e cada
+        um precisa terminar em `complete_reservations`.
+
+        `items` precisam de `external_id`, `amount_cents` e `user_id`; o
+        `batch_id` de cada item, se houver, tem precedencia sobre o argumento.
+
+        `owner` identifica o job que detem o lease dos itens (o lote
+        assincrono ou a retentativa) e fica gravado na reserva. Uma reserva
+        `pending` com o mesmo `owner` e de uma execucao anterior desse job que
+        caiu, e e retomada sem esperar o vencimento; reservas de qualquer
+        outro dono (ou sem dono) nunca sao.
+        """
+        chunk_size = chunk_size or settings.PAYOUT_WRITE_CHUNK_SIZE
+        dialect = self.db.get_bind().dialect.name
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.PAYOUT_RESERVATION_TIMEOUT_SECONDS)
+        resume_own = owner is not None
+        items = _without_known_paid(items, self.cache)
+        claimed: Set[str] = set()
+        for start in range(0, len(items), chunk_size):
+            rows = _reservation_rows(items[start:start + chunk_size], batch_id, owner)
+            if _partitioned(dialect):
+                claimed.update(self.db.execute(_reclaim_partitioned(rows, stale_before, resume_own)).scalars())
+                claimed.update(self.db.execute(_insert_partitioned(rows)).scalars())
+            elif dialect in ("postgresql", "sqlite"):
+                claimed.update(self.db.execute(_reserve(dialect, rows, stale_before, resume_own)).scalars())
+            else:
+                claimed.update(self._reserve_row_by_row(rows, stale_before, resume_own))
+            self.db.commit()
+        return claimed
+
+    def find_in_flight(self, external_ids: Iterable[str], chunk_size: Optional[int] = None) -> Set[str]:
+        """
+        Dos ids que `reserve` nao reservou, os que estao `pending`: outra
+        liquidacao esta em andamento (ou caiu e a reserva ainda nao venceu),
+        entao o resultado ainda nao e conhecido. Os demais ja foram pagos.
+        """
+        chunk_size = chunk_size or settings.DUPLICATE_LOOKUP_CHUNK_SIZE
+        dialect = self.db.get_bind().dialect.name
+        ids = list(external_ids)
+        found: Set[str] = set()
+        for start in range(0, len(ids), chunk_size):
+            found.update(self.db.execute(_in_flight_query(dialect, ids[start:start + chunk_size])).scalars())
+        return found
+
+    def _reserve_row_by_row(self, rows: List[dict], stale_before: datetime, resume_own: bool) -> Set[str]:
+        table = models.PayoutDB.__table__
+        claimed: Set[str] = set()
+        for row in rows:
+            owner = literal(row["reservation_owner"], String) if resume_own else None
+            reclaimed = self.db.execute(
+                update(table)
+                .where(table.c.external_id == row["external_id"], _reclaimable(stale_before, owner))
+                .values({name: row[name] for name in _RESERVATION_COLUMNS})
+            ).rowcount
+            if not reclaimed:
+                try:
+                    with self.db.begin_nested():
+                        self.db.execute(insert(table).values(row))
+                except IntegrityError:
+                    continue
+            claimed.add(row["external_id"])
+        return claimed
+
+    def complete_reservations(self, paid: Sequence[models.PayoutDetail], failed_ids: Sequence[str]) -> None:
+        """
+        Fecha as reservas de um chunk em uma unica transacao: os pagos viram
+        `paid` (com o provider_reference), com os eventos `payout.paid`, e os
+        que falharam viram `failed`, que um reenvio ou a retentativa podem
+        reservar de novo.
+        """
+        dialect = self.db.get_bind().dialect.name
+        if paid:
+            self.db.execute(_mark_paid(dialect, paid))
+            self._add_events(_outbox_rows("payout.paid", paid))
+        if failed_ids:
+            self.db.execute(_mark_failed(dialect, failed_ids))
+        self.db.commit()
+        if self.cache is not None:
+            self.cache.add(p.external_id for p in paid)
+
+    def schedule_retries(
+        self,
+        items: Sequence[models.PayoutItem],
+        batch_id: Optional[str],
+        provider: str,
+        unknown: Sequence[models.PayoutItem] = (),
+    ) -> None:
+        """
+        Agenda em `payout_retries` a retentativa dos itens que falharam na
+        liquidacao, com os eventos `payout.failed`, e dos itens `unknown`
+        (chamada sem resposta no prazo). A reserva `pending` destes passa para
+        o agendador (RETRY_RESERVATION_OWNER), que a retoma na proxima
+        tentativa com a mesma Idempotency-Key; sem isso, nada levaria o item
+        a um status final antes do vencimento da reserva.
+        """
+        rows = _retry_rows(items, batch_id, provider) + _retry_rows(unknown, batch_id, provider, "pending")
+        if not rows:
+            return
+        dialect = self.db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            scheduled = set(self.db.execute(_schedule_retries(dialect, rows)).scalars())
+        else:
+            scheduled = set()
+            for row in rows:
+                try:
+                    with self.db.begin_nested():
+                        self.db.execute(insert(models.PayoutRetryDB), [row])
+                    scheduled.add(row["external_id"])
+                except IntegrityError:
+                    continue
+        handed_over = [item.external_id for item in unknown if item.external_id in scheduled]
+        if handed_over:
+            self.db.execute(_hand_over_to_retries(dialect, handed_over))
+        self._add_events(_outbox_rows("payout.failed", items, batch_id))
+        self.db.commit()
+
+    def save_failed_events(self, items: Sequence[models.PayoutItem], batch_id: Optional[str]) -> None:
+        """Eventos `payout.failed` de itens que nao serao retentados (RETRY_ENABLED desligado)."""
+        events = _outbox_rows("payout.failed", items, batch_id)
+        if events:
+            self._add_events(events)
+            self.db.commit()
+
+    def _add_events(self, events: List[dict]) -> None:
+        # Na transacao corrente: o commit fica com quem grava o fato descrito pelo evento
+        if events:
+            self.db.execute(insert(models.WebhookOutboxDB), events)
+
+    def add_to_batch_summary(self, batch_id: str, details: Sequence[models.PayoutDetail]) -> None:
+        """Soma o resultado de um chunk ao agregado `batch_summary` do lote."""
+        if details:
+            self.increment_batch_summary(batch_id, _summary_increments(details))
+
+    def increment_batch_summary(self, batch_id: str, increments: Dict[str, int]) -> None:
+        """Soma `increments` (coluna -> delta, que pode ser negativo) a linha do lote."""
+        dialect = self.db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            self.db.execute(_upsert_batch_summary(dialect, batch_id, increments))
+        else:
+            self._add_to_batch_summary_fallback(batch_id, increments)
+        self.db.commit()
+
+    def _add_to_batch_summary_fallback(self, batch_id: str, increments: Dict[str, int]) -> None:
+        summary = models.BatchSummaryDB
+        updated = self.db.execute(
+            update(summary)
+            .where(summary.batch_id == batch_id)
+            .values({column: getattr(summary, column) + value for column, value in increments.items()})
+        ).rowcount
+        if not updated:
+            self.db.execute(insert(summary).values(batch_id=batch_id, **increments))
+
+
+
+class AsyncPayoutRepository:
+    """
+    Variante assincrona (AsyncSession) das operacoes em lote do
+    PayoutRepository, com os mesmos SQLs. Suporta Postgres e SQLite.
+    """
+
+    def __init__(self, db_session: "AsyncSession", cache: Optional[IdempotencyCache] = _GLOBAL_CACHE):
+        self.db = db_session
+        self.cache = idempotency_cache if cache is _GLOBAL_CACHE else cache
+
+    @property
+    def _dialect(self) -> str:
+        return self.db.bind.dialect.name
+
+    async def reserve(
+        self,
+        items: Sequence,
+        batch_id: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> Set[str]:
+        chunk_size = chunk_size or settings.PAYOUT_WRITE_CHUNK_SIZE
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.PAYOUT_RESERVATION_TIMEOUT_SECONDS)
+        resume_own = owner is not None
+        items = _without_known_paid(items, self.cache)
+        claimed: Set[str] = set()
+        for start in range(0, len(items), chunk_size):
+            rows = _reservation_rows(items[start:start + chunk_size], batch_id, owner)
+            if _partitioned(self._dialect):
+                claimed.update((await self.db.execute(_reclaim_partitioned(rows, stale_before, resume_own))).scalars())
+                claimed.update((await self.db.execute(_insert_partitioned(rows))).scalars())
+            else:
+                claimed.update((await self.db.execute(_reserve(self._dialect, rows, stale_before, resume_own))).scalars())
+            await self.db.commit()
+        return claimed
+
+    async def find_in_flight(self, external_ids: Iterable[str], chunk_size: Optional[int] = None) -> Set[str]:
+        chunk_size = chunk_size or settings.DUPLICATE_LOOKUP_CHUNK_SIZE
+        ids = list(external_ids)
+        found: Set[str] = set()
+        for start in range(0, len(ids), chunk_size):
+            rows = await self.db.execute(_in_flight_query(self._dialect, ids[start:start + chunk_size]))
+            found.update(rows.scalars())
+        return found
+
+    async def complete_reservations(self, paid: Sequence[models.PayoutDetail], failed_ids: Sequence[str]) -> None:
+        if paid:
+            await self.db.execute(_mark_paid(self._dialect, paid))
+            await self._add_events(_outbox_rows("payout.paid", paid))
+        if failed_ids:
+            await self.db.execute(_mark_failed(self._dialect, failed_ids))
+        await self.db.commit()
+        if self.cache is not None:
+            self.cache.add(p.external_id for p in paid)
+
+    async def schedule_retries(
+        self,
+        items: Sequence[models.PayoutItem],
+        batch_id: Optional[str],
+        provider: str,
+        unknown: Sequence[models.PayoutItem] = (),
+    ) -> None:
+        rows = _retry_rows(items, batch_id, provider) + _retry_rows(unknown, batch_id, provider, "pending")
+        if not rows:
+            return
+        scheduled = set((await self.db.execute(_schedule_retries(self._dialect, rows))).scalars())
+        handed_over = [item.external_id for item in unknown if item.external_id in scheduled]
+        if handed_over:
+            await self.db.execute(_hand_over_to_retries(self._dialect, handed_over))
+        await self._add_events(_outbox_rows("payout.failed", items, batch_id))
+        await self.db.commit()
+
+    async def save_failed_events(self, items: Sequence[models.PayoutItem], batch_id: Optional[str]) -> None:
+        events = _outbox_rows("payout.failed", items, batch_id)
+        if events:
+            await self._add_events(events)
+            await self.db.commit()
+
+    async def _add_events(self, events: List[dict]) -> None:
+        if events:
+            await self.db.execute(insert(models.WebhookOutboxDB), events)
+
+    async def add_to_batch_summary(self, batch_id: str, details: Sequence[models.PayoutDetail]) -> None:
+        if not details:
+            return
+        await self.db.execute(_upsert_batch_summary(self._dialect, batch_id, _summary_increments(details)))
+        await self.db.commit()
+
+class BatchSummaryRepository:
+    """Leitura dos agregados por lote mantidos pelo PayoutRepository."""
+
     def __init__(self, db_session: Session):
         self.db = db_session
 
-    def was_processed(self, external_id: str) -> bool:
-        """Verifica se um external_id ja foi processado consultando o banco."""
-        return self.db.query(models.PayoutDB).filter(models.PayoutDB.external_id == external_id).first() is not None
+    def get(self, batch_id: str) -> Optional[models.BatchSummaryDB]:
+        return self.db.get(models.BatchSummaryDB, batch_id)
 
-    def save_payout(self, payout: models.PayoutDetail) -> models.PayoutDetail:
+    def list(self, limit: int, after: Optional[str] = None) -> List[models.BatchSummaryDB]:
+        """Pagina por chave (`batch_id > after`) sobre a PK: o custo nao cresce com a pagina."""
+        query = select(models.BatchSummaryDB).order_by(models.BatchSummaryDB.batch_id).limit(limit)
+        if after is not None:
+            query = query.where(models.BatchSummaryDB.batch_id > after)
+        return list(self.db.execute(query).scalars())
+
+class BatchResponseRepository:
+    """
+    Respostas gravadas por chave de idempotencia em `batch_responses`.
+
+    A chave e reservada por um INSERT que ignora conflitos: quem insere executa
+    o lote, os demais leem a linha. Um replay de uma resposta pronta custa uma
+    leitura pela PK.
+    """
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def get(self, key: str) -> Optional[Row]:
+        # SELECT direto (sem identity map): quem espera outra execucao sempre le o estado atual
+        table = models.BatchResponseDB.__table__
+        row = self.db.execute(
+            select(table.c.status, table.c.request_hash, table.c.lease_expires_at, table.c.response).where(table.c.idempotency_key == key)
+        ).first()
+        self.db.commit()
+        return row
+
+    def claim(self, key: str, batch_id: str, request_hash: str, owner: str, lease_seconds: int) -> bool:
+        """Reserva a chave para `owner`; tambem assume uma execucao com lease vencido e o mesmo corpo."""
+        table = models.BatchResponseDB.__table__
+        now = datetime.utcnow()
+        lease = {"lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds)}
+        row = {"idempotency_key": key, "batch_id": batch_id, "request_hash": request_hash, "status": "in_progress", **lease}
+        if self.db.get_bind().dialect.name == "postgresql":
+            stmt = postgresql.insert(table).values(row).on_conflict_do_nothing(index_elements=[table.c.idempotency_key])
+        else:
+            stmt = insert(table).prefix_with("OR IGNORE").values(row)
+        claimed = self.db.execute(stmt.returning(table.c.idempotency_key)).first() is not None
+        if not claimed:
+            claimed = self.db.execute(
+                update(table)
+                .where(
+                    table.c.idempotency_key == key,
+                    table.c.status == "in_progress",
+                    table.c.request_hash == request_hash,
+                    table.c.lease_expires_at < now,
+                )
+                .values(**lease)
+            ).rowcount == 1
+        self.db.commit()
+        return claimed
+
+    def complete(self, key: str, owner: str, response: bytes) -> None:
+        table = models.BatchResponseDB.__table__
+        self.db.execute(
+            update(table)
+            .where(table.c.idempotency_key == key, table.c.lease_owner == owner)
+            .values(
+                status="completed",
+                response=zlib.compress(response, settings.IDEMPOTENCY_COMPRESSION_LEVEL),
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+        )
+        self.db.commit()
+
+    def release(self, key: str, owner: str) -> None:
+        """Libera a chave de uma execucao que falhou, para que o cliente possa tentar de novo."""
+        table = models.BatchResponseDB.__table__
+        # A falha pode ter deixado a transacao da sessao abortada
+        self.db.rollback()
+        self.db.execute(
+            delete(table).where(
+                table.c.idempotency_key == key, table.c.lease_owner == owner, table.c.status == "in_progress"
+            )
+        )
+        self.db.commit()
+
+    @staticmethod
+    def decode(row: Row) -> bytes:
+        return zlib.decompress(row.response)
+
+class BatchJobRepository:
+    """Persistencia dos lotes submetidos em modo assincrono."""
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def get(self, batch_id: str) -> Optional[models.BatchJobDB]:
+        return self.db.execute(
+            select(models.BatchJobDB).where(models.BatchJobDB.batch_id == batch_id)
+        ).scalar_one_or_none()
+
+    def create(
+        self,
+        batch: models.PayoutBatch,
+        enqueue: Optional[Callable[[models.PayoutBatch], Dict[str, int]]] = None,
+    ) -> Tuple[models.BatchJobDB, bool]:
         """
-        Salva um Payout no banco. A idempotencia e garantida pela
-        constraint de unicidade na coluna `external_id`.
+        Persiste o lote como um job `queued`. Se o `batch_id` ja existe, o job
+        existente e devolvido com `created=False`; a constraint de unicidade
+        resolve submissoes concorrentes do mesmo lote.
+
+        Com `enqueue`, os itens sao gravados na fila duravel na mesma transacao
+        do job, em vez de no payload do proprio job; os que ela ja resolve
+        (repeticoes) entram nos contadores do job.
         """
-        db_payout = models.PayoutDB(
-            external_id=payout.external_id,
-            status=payout.status,
-            amount_cents=payout.amount_cents
+        existing = self.get(batch.batch_id)
+        if existing is not None:
+            return existing, False
+
+        job = models.BatchJobDB(
+            batch_id=batch.batch_id,
+            status="queued",
+            total_items=len(batch.items),
+            payload=None if enqueue else self._serialize_batch(batch),
         )
         try:
-            self.db.add(db_payout)
+            self.db.add(job)
+            if enqueue is not None:
+                settled = enqueue(batch)
+                job.processed_items = sum(settled.values())
+                job.duplicates = settled.get("duplicate", 0)
             self.db.commit()
-            self.db.refresh(db_payout)
-            return payout
+            self.db.refresh(job)
+            return job, True
         except IntegrityError:
             self.db.rollback()
-            # Retorna um detalhe indicando duplicata
-            payout.status = "duplicate"
-            return payout
+            return self.get(batch.batch_id), False
+
+    @staticmethod
+    def reservation_owner(batch_id: str) -> str:
+        """
+        Dono das reservas em `payouts` feitas pelo job do lote. O job e unico
+        por `batch_id` e so roda em quem detem o seu lease (`start`,
+        `claim_orphaned` ou o claim da fila, que tem um item por external_id).
+        """
+        return f"batch-job:{batch_id}"
+
+    def load_batch(self, job: models.BatchJobDB) -> models.PayoutBatch:
+        return models.PayoutBatch.model_validate_json(job.payload)
+
+    def set_status(self, batch_id: str, status: str) -> None:
+        self._update(batch_id, status=status)
+
+    def start(self, batch_id: str) -> bool:
+        """
+        Passa o job de `queued` para `running`. Devolve False se outro
+        processo ja o iniciou, para que o mesmo job nunca rode duas vezes.
+        """
+        started = self.db.execute(
+            update(models.BatchJobDB)
+            .where(models.BatchJobDB.batch_id == batch_id, models.BatchJobDB.status == "queued")
+            .values(status="running", updated_at=datetime.utcnow())
+        ).rowcount == 1
+        self.db.commit()
+        return started
+
+    def claim_orphaned(self, stale_before: datetime) -> List[str]:
+        """
+        Jobs do pool de threads (com payload) ainda `queued` ou `running` e
+        sem progresso desde `stale_before`: o processo que os rodava caiu.
+        Voltam a `queued` com os contadores zerados; o UPDATE condicional
+        garante que apenas um processo retoma cada job.
+        """
+        job = models.BatchJobDB
+        orphaned = (
+            job.status.in_(("queued", "running")),
+            job.payload.is_not(None),
+            job.updated_at < stale_before,
+        )
+        candidates = self.db.execute(select(job.batch_id).where(*orphaned)).scalars().all()
+
+        claimed = []
+        for batch_id in candidates:
+            # Quem retoma antes renova `updated_at`, entao o mesmo UPDATE nao vale para mais ninguem
+            result = self.db.execute(
+                update(job)
+                .where(job.batch_id == batch_id, *orphaned)
+                .values(
+                    status="queued", processed_items=0, successful=0, failed=0, duplicates=0,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            if result.rowcount == 1:
+                claimed.append(batch_id)
+        self.db.commit()
+        return claimed
+
+    def add_progress(self, batch_id: str, details: Sequence[models.PayoutDetail]) -> None:
+        """Incrementa os contadores do job com o resultado de um chunk."""
+        self.add_counts(batch_id, Counter(d.status for d in details))
+
+    def add_counts(self, batch_id: str, counts: Dict[str, int]) -> None:
+        """Incrementa os contadores do job a partir de uma contagem por status."""
+        job = models.BatchJobDB
+        self._update(
+            batch_id,
+            status="running",
+            processed_items=job.processed_items + sum(counts.values()),
+            successful=job.successful + counts.get("paid", 0),
+            failed=job.failed + counts.get("failed", 0),
+            duplicates=job.duplicates + counts.get("duplicate", 0),
+        )
+
+    def complete(self, batch_id: str, report: models.PayoutReport) -> None:
+        self._update(batch_id, status="completed", report=report.model_dump_json())
+
+    def complete_if_done(
+        self, batch_id: str, build_report: Callable[[str], models.PayoutReport]
+    ) -> bool:
+        """
+        Finaliza o job quando todos os itens foram processados. O UPDATE
+        condicional garante que apenas um worker grava o relatorio.
+        """
+        job = self.get(batch_id)
+        if job is None or job.status == "completed" or job.processed_items < job.total_items:
+            return False
+
+        report = build_report(batch_id)
+        finalized = self.db.execute(
+            update(models.BatchJobDB)
+            .where(
+                models.BatchJobDB.batch_id == batch_id,
+                models.BatchJobDB.status != "completed",
+                models.BatchJobDB.processed_items >= models.BatchJobDB.total_items,
+            )
+            .values(status="completed", report=report.model_dump_json())
+        ).rowcount == 1
+        self.db.commit()
+        return finalized
+
+    def _update(self, batch_id: str, **values) -> None:
+        self.db.execute(
+            update(models.BatchJobDB).where(models.BatchJobDB.batch_id == batch_id).values(**values)
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _serialize_batch(batch: models.PayoutBatch) -> str:
+        # A chave PIX e necessaria para liquidar o lote depois, entao e gravada sem mascara
+        return json.dumps({
+            "batch_id": batch.batch_id,
+            "items": [
+                {
+                    "external_id": item.external_id,
+                    "user_id": item.user_id,
+                    "amount_cents": item.amount_cents,
+                    "pix_key": item.pix_key.get_secret_value(),
+                }
+                for item in batch.items
+            ],
+        })
+
+
+class PayoutQueueRepository:
+    """
+    Fila duravel de itens de payout na tabela `payout_jobs`.
+
+    Um claim marca ate N itens como `leased` para um dono e por um prazo; o
+    ack os marca como `done`. Itens com lease vencido voltam a ser
+    elegiveis, entao o trabalho de um worker que morreu e retomado por outro.
+    """
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def enqueue(self, batch: models.PayoutBatch) -> Counter:
+        """
+        Adiciona os itens do lote a transacao corrente (o commit fica com quem chama).
+
+        So a primeira ocorrencia de cada external_id vira um job `queued`: as
+        repeticoes entram ja `done` como `duplicate`, como no caminho
+        sincrono, entao dois workers nunca disputam o mesmo id do mesmo lote.
+        Devolve a contagem por status desses itens ja resolvidos.
+        """
+        seen: Set[str] = set()
+        rows = []
+        for position, item in enumerate(batch.items):
+            repeated = item.external_id in seen
+            seen.add(item.external_id)
+            rows.append({
+                "batch_id": batch.batch_id,
+                "position": position,
+                "external_id": item.external_id,
+                "user_id": item.user_id,
+                "amount_cents": item.amount_cents,
+                "pix_key": item.pix_key.get_secret_value(),
+                "status": "done" if repeated else "queued",
+                "result_status": "duplicate" if repeated else None,
+                "attempts": 0,
+            })
+        self.db.execute(insert(models.PayoutJobDB), rows)
+        return Counter(row["result_status"] for row in rows if row["result_status"] is not None)
+
+    def claim(self, owner: str, limit: int, lease_seconds: int) -> List[Row]:
+        """
+        Reserva ate `limit` itens para `owner` em um unico UPDATE.
+
+        No Postgres a subconsulta usa `FOR UPDATE SKIP LOCKED`, entao workers
+        concorrentes pegam linhas disjuntas sem esperar uns pelos outros. No
+        SQLite o UPDATE ja roda com o lock de escrita do banco, o que torna o
+        claim atomico; o lease com prazo cobre a retomada em ambos.
+        """
+        job = models.PayoutJobDB
+        now = datetime.utcnow()
+        claimable = (
+            select(job.id)
+            .where(or_(
+                job.status == "queued",
+                and_(job.status == "leased", job.lease_expires_at < now),
+            ))
+            .order_by(job.id)
+            .limit(limit)
+        )
+        if self.db.get_bind().dialect.name == "postgresql":
+            claimable = claimable.with_for_update(skip_locked=True)
+
+        rows = self.db.execute(
+            update(job)
+            .where(job.id.in_(claimable))
+            .values(
+                status="leased",
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=job.attempts + 1,
+            )
+            .returning(
+                job.id, job.batch_id, job.position, job.external_id,
+                job.user_id, job.amount_cents, job.pix_key, job.attempts,
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        self.db.commit()
+        # Linhas simples (nao entidades ORM), entao nada e recarregado apos o commit
+        return sorted(rows, key=lambda row: row.id)
+
+    def ack(self, owner: str, outcomes: Dict[int, str]) -> Dict[str, Counter]:
+        """
+        Marca como `done` os itens ainda reservados por `owner`, gravando o
+        resultado de cada um. Acks de um lease que ja venceu e foi retomado
+        sao ignorados. Retorna a contagem por status dos itens confirmados,
+        agrupada por lote.
+        """
+        job = models.PayoutJobDB
+        ids_by_status: Dict[str, List[int]] = {}
+        for job_id, result_status in outcomes.items():
+            ids_by_status.setdefault(result_status, []).append(job_id)
+
+        acked: Dict[str, Counter] = {}
+        for result_status, ids in ids_by_status.items():
+            rows = self.db.execute(
+                update(job)
+                .where(job.id.in_(ids), job.lease_owner == owner, job.status == "leased")
+                .values(status="done", result_status=result_status, lease_expires_at=None)
+                .returning(job.batch_id)
+                .execution_options(synchronize_session=False)
+            ).scalars()
+            for batch_id in rows:
+                acked.setdefault(batch_id, Counter())[result_status] += 1
+        self.db.commit()
+        return acked
+
+    def build_report(self, batch_id: str) -> models.PayoutReport:
+        """Monta o relatorio do lote a partir dos resultados gravados na fila."""
+        job = models.PayoutJobDB
+        rows = self.db.execute(
+            select(job.external_id, job.result_status, job.amount_cents)
+            .where(job.batch_id == batch_id)
+            .order_by(job.position)
+        ).all()
+        details = [
+            models.PayoutDetail(external_id=external_id, status=result_status, amount_cents=amount_cents)
+            for external_id, result_status, amount_cents in rows
+        ]
+        counts = Counter(detail.status for detail in details)
+        return models.PayoutReport(
+            batch_id=batch_id,
+            processed=counts["paid"] + counts["failed"],
+            successful=counts["paid"],
+            failed=counts["failed"],
+            duplicates=counts["duplicate"],
+            pending=counts["pending"],
+            details=details,
+        )
+
+
+class RetryRepository:
+    """
+    Itens agendados para retentativa em `payout_retries`.
+
+    O claim segue o mesmo modelo da fila duravel: lease com prazo e, no
+    Postgres, `FOR UPDATE SKIP LOCKED`. So entram no claim itens cujo
+    `next_attempt_at` ja passou, entao o custo de cada ciclo e proporcional
+    as falhas vencidas, e nao ao tamanho dos lotes.
+    """
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def claim(self, owner: str, limit: int, lease_seconds: int) -> List[Row]:
+        retry = models.PayoutRetryDB
+        now = datetime.utcnow()
+        claimable = (
+            select(retry.id)
+            .where(or_(
+                and_(retry.status == "pending", retry.next_attempt_at <= now),
+                and_(retry.status == "leased", retry.lease_expires_at < now),
+            ))
+            .order_by(retry.next_attempt_at)
+            .limit(limit)
+        )
+        if self.db.get_bind().dialect.name == "postgresql":
+            claimable = claimable.with_for_update(skip_locked=True)
+
+        rows = self.db.execute(
+            update(retry)
+            .where(retry.id.in_(claimable))
+            .values(status="leased", lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+            .returning(
+                retry.id, retry.external_id, retry.batch_id, retry.user_id,
+                retry.amount_cents, retry.pix_key, retry.provider, retry.attempts, retry.original_status,
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        self.db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def resolve(self, owner: str, outcomes: Dict[int, str]) -> None:
+        """
+        Grava o status final (`paid`, `duplicate`, `failed_permanently`) dos
+        itens ainda reservados por `owner`, com o evento `payout.failed_permanently`
+        dos que esgotaram as tentativas na mesma transacao.
+        """
+        retry = models.PayoutRetryDB
+        ids_by_status: Dict[str, List[int]] = {}
+        for retry_id, status in outcomes.items():
+            ids_by_status.setdefault(status, []).append(retry_id)
+        for status, ids in ids_by_status.items():
+            if status == "failed_permanently" and settings.WEBHOOK_SUBSCRIBERS:
+                exhausted = self.db.execute(
+                    select(retry.external_id, retry.batch_id, retry.user_id, retry.amount_cents)
+                    .where(retry.id.in_(ids), retry.lease_owner == owner, retry.status == "leased")
+                ).all()
+                if exhausted:
+                    self.db.execute(insert(models.WebhookOutboxDB), _outbox_rows("payout.failed_permanently", exhausted))
+            self.db.execute(
+                update(retry)
+                .where(retry.id.in_(ids), retry.lease_owner == owner, retry.status == "leased")
+                .values(
+                    status=status,
+                    # `duplicate` e resolvido sem chamar o provedor
+                    attempts=retry.attempts + (0 if status == "duplicate" else 1),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+                .execution_options(synchronize_session=False)
+            )
+        self.db.commit()
+
+    def reschedule(
+        self, owner: str, retry_id: int, next_attempt_at: datetime, original_status: Optional[str] = None
+    ) -> None:
+        """Devolve o item a fila com o novo `next_attempt_at` (e, se informado, o novo `original_status`)."""
+        retry = models.PayoutRetryDB
+        self.db.execute(
+            update(retry)
+            .where(retry.id == retry_id, retry.lease_owner == owner, retry.status == "leased")
+            .values(
+                status="pending",
+                attempts=retry.attempts + 1,
+                next_attempt_at=next_attempt_at,
+                original_status=original_status or retry.original_status,
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+
+class WebhookOutboxRepository:
+    """
+    Eventos de webhook em `webhook_outbox`, consumidos por `python -m app.webhooks`.
+
+    O claim segue o modelo da fila duravel e das retentativas: lease com prazo
+    e, no Postgres, `FOR UPDATE SKIP LOCKED`, entao varios dispatchers dividem
+    o outbox sem entregar o mesmo evento ao mesmo tempo.
+    """
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def claim(self, owner: str, limit: int, lease_seconds: int) -> List[Row]:
+        outbox = models.WebhookOutboxDB
+        now = datetime.utcnow()
+        claimable = (
+            select(outbox.id)
+            .where(or_(
+                and_(outbox.status == "pending", outbox.next_attempt_at <= now),
+                and_(outbox.status == "leased", outbox.lease_expires_at < now),
+            ))
+            .order_by(outbox.id)
+            .limit(limit)
+        )
+        if self.db.get_bind().dialect.name == "postgresql":
+            claimable = claimable.with_for_update(skip_locked=True)
+
+        rows = self.db.execute(
+            update(outbox)
+            .where(outbox.id.in_(claimable))
+            .values(status="leased", lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+            .returning(
+                outbox.id, outbox.subscriber, outbox.event_type, outbox.external_id, outbox.batch_id,
+                outbox.user_id, outbox.amount_cents, outbox.provider_reference, outbox.attempts, outbox.created_at,
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        self.db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def mark_delivered(self, owner: str, ids: Sequence[int]) -> None:
+        self._release(owner, ids, status="delivered")
+
+    def reschedule(self, owner: str, ids: Sequence[int], next_attempt_at: datetime) -> None:
+        self._release(owner, ids, status="pending", next_attempt_at=next_attempt_at)
+
+    def mark_dead(self, owner: str, ids: Sequence[int]) -> None:
+        self._release(owner, ids, status="dead")
+
+    def _release(self, owner: str, ids: Sequence[int], **values) -> None:
+        """Encerra o lease de `owner` nos eventos, contando a tentativa (exceto na entrega)."""
+        outbox = models.WebhookOutboxDB
+        attempts = outbox.attempts + (0 if values["status"] == "delivered" else 1)
+        self.db.execute(
+            update(outbox)
+            .where(outbox.id.in_(ids), outbox.lease_owner == owner, outbox.status == "leased")
+            .values(attempts=attempts, lease_owner=None, lease_expires_at=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+
+class ReconciliationRepository:
+    """Leitura ordenada de `payouts` e gravacao dos resumos de conciliacao."""
+
+    def __init__(self, db_session: Session):
+        self.db = db_session
+
+    def stream_paid(
+        self, since: Optional[datetime] = None, until: Optional[datetime] = None, batch_size: int = 10_000
+    ) -> Iterator[Tuple[str, int]]:
+        """
+        (external_id, amount_cents) dos payouts pagos em ordem de external_id,
+        lidos em blocos de `batch_size` (cursor do lado do servidor no
+        Postgres), entao a memoria nao cresce com a tabela.
+
+        A ordem e a de bytes (a mesma das strings em Python): no SQLite e o
+        padrao; no Postgres o ORDER BY usa COLLATE "C", e o indice unico so
+        atende essa ordem se o banco tambem usar a collation C.
+        """
+        payout = models.PayoutDB
+        external_id = payout.external_id
+        if self.db.get_bind().dialect.name == "postgresql":
+            external_id = external_id.collate("C")
+        query = select(payout.external_id, payout.amount_cents).where(payout.status == "paid").order_by(external_id)
+        if since is not None:
+            query = query.where(payout.created_at >= since)
+        if until is not None:
+            query = query.where(payout.created_at < until)
+        result = self.db.execute(query.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            yield from partition
+
+    def save(self, summary: dict) -> int:
+        row = models.ReconciliationDB(**summary)
+        self.db.add(row)
+        self.db.commit()
+        return row.id
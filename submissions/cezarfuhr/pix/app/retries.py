@@ -0,0 +1,210 @@
+"""
+Agendador de retentativas dos itens que falharam na liquidacao.
+
+Uso:
+
+    python -m app.retries            # roda continuamente
+    python -m app.retries --drain    # sai quando nao houver retentativas vencidas
+
+Alem das falhas, entram em `payout_retries` as chamadas que ficaram sem
+resposta no prazo (a reserva em `payouts` continua `pending` e passa para
+o agendador). A cada ciclo reserva ate RETRY_CLAIM_CHUNK_SIZE itens de `payout_retries`
+com `next_attempt_at` vencido, agrupa por provedor e liquida cada grupo com
+o limite de concorrencia do provedor (RETRY_PROVIDER_CONCURRENCY). Antes de
+chamar o provedor, cada id e reservado em `payouts`, como na liquidacao do
+lote; os que nao puderam ser reservados (pagos ou em liquidacao por um
+reenvio do lote) sao resolvidos como `duplicate`. Uma nova falha
+reagenda o item com backoff exponencial e jitter, ate RETRY_MAX_ATTEMPTS.
+Uma chamada sem resposta no prazo mantem a reserva `pending` e e sempre
+reagendada: a proxima tentativa reenvia a mesma Idempotency-Key e o
+provedor devolve o resultado da primeira.
+"""
+import argparse
+import itertools
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .core.logging_config import configure_logging
+from .database import SessionLocal
+from .models import PayoutItem, PayoutRecord
+from .repository import RETRY_RESERVATION_OWNER, PayoutRepository, RetryRepository
+from .settlement import SettlementEngine, SettlementProvider, backoff_delay, default_provider, is_unknown
+
+logger = logging.getLogger(__name__)
+
+
+def default_providers() -> Dict[str, SettlementProvider]:
+    provider = default_provider()
+    return {provider.name: provider}
+
+
+def provider_concurrency(name: str) -> int:
+    return settings.RETRY_PROVIDER_CONCURRENCY.get(name, settings.RETRY_DEFAULT_CONCURRENCY)
+
+
+class RetryScheduler:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        providers: Optional[Dict[str, SettlementProvider]] = None,
+        chunk_size: int = settings.RETRY_CLAIM_CHUNK_SIZE,
+        lease_seconds: int = settings.RETRY_LEASE_SECONDS,
+        poll_interval: float = settings.RETRY_POLL_INTERVAL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.providers = providers if providers is not None else default_providers()
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopped = False
+
+    def run_once(self) -> int:
+        """Tenta de novo um chunk de itens vencidos e retorna quantos foram reservados."""
+        db = self.session_factory()
+        try:
+            retries = RetryRepository(db)
+            owner = f"{self.worker_id}-{uuid.uuid4().hex[:8]}"
+            claimed = retries.claim(owner, self.chunk_size, self.lease_seconds)
+            if not claimed:
+                return 0
+
+            payouts = PayoutRepository(db)
+            # Com o lease da retentativa, a reserva `pending` deixada por uma tentativa que caiu e retomada
+            reserved = payouts.reserve(claimed, owner=RETRY_RESERVATION_OWNER)
+            outcomes: Dict[int, str] = {
+                row.id: "duplicate" for row in claimed if row.external_id not in reserved
+            }
+            due = sorted((row for row in claimed if row.id not in outcomes), key=lambda row: row.provider)
+            for provider_name, rows in itertools.groupby(due, key=lambda row: row.provider):
+                self._settle_group(owner, payouts, retries, provider_name, list(rows), outcomes)
+
+            retries.resolve(owner, outcomes)
+            logger.info(
+                "retries_processed",
+                extra={
+                    "claimed": len(claimed),
+                    "outcomes": dict(Counter(outcomes.values())),
+                    "event": "retries_processed",
+                },
+            )
+            return len(claimed)
+        finally:
+            db.close()
+
+    def _settle_group(
+        self,
+        owner: str,
+        payouts: PayoutRepository,
+        retries: RetryRepository,
+        provider_name: str,
+        rows: List[Row],
+        outcomes: Dict[int, str],
+    ) -> None:
+        provider = self.providers.get(provider_name) or next(iter(self.providers.values()))
+        engine = SettlementEngine(
+            max_in_flight=provider_concurrency(provider_name),
+            timeout_seconds=settings.SETTLEMENT_TIMEOUT_SECONDS,
+        )
+        items = [
+            PayoutItem(external_id=row.external_id, user_id=row.user_id, amount_cents=row.amount_cents, pix_key=row.pix_key)
+            for row in rows
+        ]
+        settled = engine.settle_all(items, provider.pay)
+
+        payouts.complete_reservations(
+            [
+                PayoutRecord(
+                    external_id=row.external_id, status="paid", amount_cents=row.amount_cents,
+                    batch_id=row.batch_id, user_id=row.user_id,
+                    provider_reference=getattr(outcome, "reference", None),
+                )
+                for row, outcome in zip(rows, settled) if outcome
+            ],
+            [row.external_id for row, outcome in zip(rows, settled) if not outcome and not is_unknown(outcome)],
+        )
+
+        now = datetime.utcnow()
+        for row, ok in zip(rows, settled):
+            if ok:
+                outcomes[row.id] = "paid"
+                if row.batch_id is not None:
+                    payouts.increment_batch_summary(row.batch_id, _paid_increments(row))
+                continue
+            # Um item que ficou sem resposta no prazo ainda nao esta no agregado do lote
+            uncounted = row.original_status == "pending" and not is_unknown(ok)
+            if uncounted and row.batch_id is not None:
+                # Primeira resposta definitiva: o item entra no agregado como falha
+                payouts.increment_batch_summary(row.batch_id, {
+                    "processed": 1, "failed": 1, "failed_amount_cents": row.amount_cents,
+                })
+            if row.attempts + 1 >= settings.RETRY_MAX_ATTEMPTS and not is_unknown(ok):
+                outcomes[row.id] = "failed_permanently"
+                logger.warning(
+                    "retry_exhausted",
+                    extra={"external_id": row.external_id, "attempts": row.attempts + 1, "event": "retry_exhausted"},
+                )
+            else:
+                retries.reschedule(
+                    owner, row.id, now + timedelta(seconds=backoff_delay(row.attempts + 1)),
+                    original_status="failed" if uncounted else None,
+                )
+
+    def run(self, drain: bool = False) -> int:
+        """Loop principal. Com `drain`, sai assim que nao houver retentativas vencidas."""
+        processed = 0
+        while not self._stopped:
+            claimed = self.run_once()
+            processed += claimed
+            if claimed == 0:
+                if drain:
+                    break
+                time.sleep(self.poll_interval)
+        return processed
+
+    def stop(self, *_args) -> None:
+        self._stopped = True
+
+
+def _paid_increments(row: Row) -> Dict[str, int]:
+    paid = {"successful": 1, "paid_amount_cents": row.amount_cents}
+    if row.original_status == "pending":
+        return {"processed": 1, **paid}
+    # O item ja estava contado como falha no agregado do lote
+    return {**paid, "failed": -1, "failed_amount_cents": -row.amount_cents}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Retentativas de itens que falharam na liquidacao")
+    parser.add_argument("--chunk-size", type=int, default=settings.RETRY_CLAIM_CHUNK_SIZE)
+    parser.add_argument("--drain", action="store_true", help="Sai quando nao houver retentativas vencidas")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if settings.DB_AUTO_MIGRATE:
+        from .migrations import migrate
+        migrate()
+
+    scheduler = RetryScheduler(chunk_size=args.chunk_size)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    processed = scheduler.run(drain=args.drain)
+    logger.info(
+        "retry_scheduler_stopped",
+        extra={"worker_id": scheduler.worker_id, "processed": processed, "event": "retry_scheduler_stop"},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Servidor HTTP de producao: migracao unica e N workers do uvicorn.
+
+Uso:
+
+    python -m app.server                      # WEB_CONCURRENCY ou um worker por CPU
+    python -m app.server --workers 4 --port 8000
+
+O processo principal aplica as migracoes uma vez e so entao sobe os workers,
+com DB_AUTO_MIGRATE desligado para que nenhum deles repita o passo. Os workers
+sao processos novos (spawn), e nao forks de um app pre-carregado: a thread do
+QueueListener de logs e os pools de conexao nao sobrevivem a um fork, entao
+cada worker importa o app e abre os seus proprios recursos.
+"""
+import argparse
+import os
+from typing import List, Optional
+
+from .core.config import settings
+from .core.logging_config import configure_logging
+
+
+def default_workers() -> int:
+    return settings.WEB_CONCURRENCY or os.cpu_count() or 1
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.server", description="Servidor HTTP de producao")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--skip-migrations", action="store_true", help="O schema ja foi migrado neste deploy")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if not args.skip_migrations:
+        from .migrations import migrate
+        migrate()
+    # Herdado pelos workers: cada um le as settings do ambiente ao importar o app
+    os.environ["DB_AUTO_MIGRATE"] = "false"
+
+    import uvicorn
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        # O app configura os proprios logs JSON; o access log por requisicao fica desligado
+        log_config=None,
+        access_log=False,
+        proxy_headers=True,
+        timeout_graceful_shutdown=30,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,392 @@
+import asyncio
 import logging
-import random
-from typing import List
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Generator, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
 from sqlalchemy.orm import Session
 
-from .models import PayoutBatch, PayoutReport, PayoutDetail
-from .repository import PayoutRepository
+from .core.config import settings
+from .metrics import record_outcomes, stage_timer, track_batch
+from .models import PayoutBatch, PayoutItem, PayoutRecord, PayoutReport, PayoutDetail
+from .repository import AsyncPayoutRepository, PayoutRepository
+from .settlement import Outcome, SettlementEngine, SettlementProvider, default_provider, is_unknown
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
+class ReportBuilder:
+    """
+    Acumula os detalhes liquidados, chunk a chunk, ate o PayoutReport final.
+    Com `keep_details=False` guarda apenas os contadores (memoria constante);
+    com `max_details`, guarda no maximo esse numero de detalhes e marca
+    `truncated` (os contadores continuam completos).
+    """
+
+    def __init__(self, batch_id: str, keep_details: bool = True, max_details: Optional[int] = None):
+        self.batch_id = batch_id
+        self.keep_details = keep_details
+        self.max_details = max_details
+        self.truncated = False
+        self.details: List[PayoutDetail] = []
+        self.item_count = 0
+        self.successful = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.pending = 0
+
+    def add(self, details: Sequence[PayoutDetail]) -> None:
+        self.item_count += len(details)
+        if self.keep_details:
+            room = len(details) if self.max_details is None else self.max_details - len(self.details)
+            self.details.extend(details[:room])
+            self.truncated = self.truncated or room < len(details)
+        for detail in details:
+            if detail.status == "paid":
+                self.successful += 1
+            elif detail.status == "failed":
+                self.failed += 1
+            elif detail.status == "duplicate":
+                self.duplicates += 1
+            elif detail.status == "pending":
+                self.pending += 1
+
+    def add_counts(self, counts: Dict[str, int]) -> None:
+        """Soma contadores por status ja agregados (por exemplo, vindos de outro processo)."""
+        self.item_count += sum(counts.values())
+        self.successful += counts.get("paid", 0)
+        self.failed += counts.get("failed", 0)
+        self.duplicates += counts.get("duplicate", 0)
+        self.pending += counts.get("pending", 0)
+
+    def build(self) -> PayoutReport:
+        return PayoutReport(
+            batch_id=self.batch_id,
+            processed=self.successful + self.failed,
+            successful=self.successful,
+            failed=self.failed,
+            duplicates=self.duplicates,
+            pending=self.pending,
+            details=self.details,
+        )
+
 class PayoutService:
-    def __init__(self, db_session: Session):
+    def __init__(
+        self,
+        db_session: Session,
+        provider: Optional[SettlementProvider] = None,
+        engine: Optional[SettlementEngine] = None,
+        reservation_owner: Optional[str] = None,
+    ):
+        """
+        `reservation_owner` e o job que detem o lease dos itens (lote
+        assincrono na fila ou no pool de threads): as reservas levam esse dono
+        e as `pending` deixadas por uma execucao anterior do mesmo job, que
+        caiu, sao retomadas (`PayoutRepository.reserve`).
+        """
         self.repository = PayoutRepository(db_session=db_session)
+        self.provider, self.engine = _settlement_defaults(provider, engine)
+        self.provider_name = _provider_name(self.provider)
+        self.reservation_owner = reservation_owner
 
-    def _simulate_payment(self) -> bool:
-        """Simula a chamada a um provedor de pagamento externo."""
-        return random.random() < 0.95  # 95% de sucesso
-
-    def process_batch(self, batch: PayoutBatch) -> PayoutReport:
-        """Processa um lote de pagamentos, garantindo idempotencia via DB."""
-        import time
-        start_time = time.time()
-
-        logger.info(
-            "batch_processing_started",
-            extra={
-                "batch_id": batch.batch_id,
-                "item_count": len(batch.items),
-                "event": "batch_start"
-            }
-        )
+    def _simulate_payment(self, item: PayoutItem) -> Outcome:
+        """Chama o provedor de pagamento (SETTLEMENT_PROVIDER; simulado por padrao)."""
+        return self.provider.pay(item)
 
-        report_details: List[PayoutDetail] = []
-        successful_count = 0
-        failed_count = 0
-        duplicate_count = 0
-
-        for item in batch.items:
-            if self.repository.was_processed(item.external_id):
-                duplicate_count += 1
-                status = "duplicate"
-            else:
-                payment_succeeded = self._simulate_payment()
-                if payment_succeeded:
-                    successful_count += 1
-                    status = "paid"
-                    # Apenas marcamos como processado se o pagamento for um sucesso
-                    payout_to_save = PayoutDetail(
-                        external_id=item.external_id,
-                        status=status,
-                        amount_cents=item.amount_cents
-                    )
-                    self.repository.save_payout(payout_to_save)
+    def process_items(
+        self,
+        items: Sequence[PayoutItem],
+        batch_id: Optional[str] = None,
+        seen: Optional[Set[str]] = None,
+    ) -> List[PayoutDetail]:
+        """
+        Liquida um chunk de itens: uma reserva em lote dos ids em `payouts`,
+        os pagamentos so dos ids reservados e uma unica transacao que vira
+        cada reserva para `paid`/`failed`. As linhas levam o `batch_id` do
+        lote e o `user_id` de cada item. Com `batch_id`, o resultado do chunk
+        tambem e somado ao agregado `batch_summary`.
+
+        Um id que outra requisicao ja pagou nao e reservado e vira
+        `duplicate` sem chamar o provedor, mesmo com as duas requisicoes
+        chegando ao mesmo tempo. Se a outra requisicao ainda esta liquidando
+        o id, o resultado nao e conhecido e o item vira `pending`.
+
+        `seen` guarda os ids ja vistos em chunks anteriores do mesmo lote:
+        repeticoes viram `duplicate` sem consulta ao banco nem ao provedor.
+        """
+        steps = _settle_chunk(items, batch_id, seen, self.reservation_owner, self.provider_name)
+        try:
+            result = None
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration as done:
+                    return done.value
+                if step.method == SETTLE:
+                    result = self.engine.settle_all(*step.args, self._simulate_payment)
                 else:
-                    failed_count += 1
-                    status = "failed"
-
-            report_details.append(
-                PayoutDetail(
-                    external_id=item.external_id,
-                    status=status,
-                    amount_cents=item.amount_cents
+                    result = getattr(self.repository, step.method)(*step.args, **step.kwargs)
+        finally:
+            steps.close()
+
+    def iter_chunks(self, items: Sequence[PayoutItem], batch_id: Optional[str] = None) -> Iterator[List[PayoutDetail]]:
+        """Liquida os itens em chunks de PAYOUT_WRITE_CHUNK_SIZE, entregando cada chunk ja persistido."""
+        seen: Set[str] = set()
+        for chunk in _chunks(items):
+            yield self.process_items(chunk, batch_id, seen)
+
+    def process_batch(
+        self,
+        batch: PayoutBatch,
+        on_progress: Optional[Callable[[List[PayoutDetail]], None]] = None,
+    ) -> PayoutReport:
+        """
+        Processa um lote de pagamentos, garantindo idempotencia via DB.
+
+        `on_progress`, se informado, recebe os detalhes de cada chunk assim que
+        ele e persistido.
+        """
+        start_time = _log_batch_started(batch)
+
+        builder = ReportBuilder(batch.batch_id)
+        with track_batch():
+            for chunk_details in self.iter_chunks(batch.items, batch.batch_id):
+                builder.add(chunk_details)
+                if on_progress is not None:
+                    on_progress(chunk_details)
+
+        _log_batch_completed(batch, builder, start_time)
+        return builder.build()
+
+
+class AsyncPayoutService:
+    """
+    Mesmo fluxo do PayoutService sobre uma AsyncSession: as consultas e
+    gravacoes nao ocupam uma thread do threadpool enquanto esperam o banco.
+    As chamadas ao provedor continuam no SettlementEngine, fora do event loop.
+    """
+
+    def __init__(
+        self,
+        db_session: "AsyncSession",
+        provider: Optional[SettlementProvider] = None,
+        engine: Optional[SettlementEngine] = None,
+        reservation_owner: Optional[str] = None,
+    ):
+        self.repository = AsyncPayoutRepository(db_session=db_session)
+        self.provider, self.engine = _settlement_defaults(provider, engine)
+        self.provider_name = _provider_name(self.provider)
+        self.reservation_owner = reservation_owner
+
+    def _simulate_payment(self, item: PayoutItem) -> Outcome:
+        return self.provider.pay(item)
+
+    async def process_items(
+        self,
+        items: Sequence[PayoutItem],
+        batch_id: Optional[str] = None,
+        seen: Optional[Set[str]] = None,
+    ) -> List[PayoutDetail]:
+        steps = _settle_chunk(items, batch_id, seen, self.reservation_owner, self.provider_name)
+        try:
+            result = None
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration as done:
+                    return done.value
+                if step.method == SETTLE:
+                    # O SettlementEngine bloqueia ate o fim das chamadas: fica fora do event loop
+                    result = await asyncio.to_thread(self.engine.settle_all, *step.args, self._simulate_payment)
+                else:
+                    result = await getattr(self.repository, step.method)(*step.args, **step.kwargs)
+        finally:
+            steps.close()
+
+    async def process_batch(self, batch: PayoutBatch) -> PayoutReport:
+        start_time = _log_batch_started(batch)
+
+        builder = ReportBuilder(batch.batch_id)
+        seen: Set[str] = set()
+        with track_batch():
+            for chunk in _chunks(batch.items):
+                builder.add(await self.process_items(chunk, batch.batch_id, seen))
+
+        _log_batch_completed(batch, builder, start_time)
+        return builder.build()
+
+
+# Etapa de `_settle_chunk` executada pelo SettlementEngine, e nao pelo repositorio
+SETTLE = "settle"
+
+
+class _Step(NamedTuple):
+    """Operacao de I/O pedida por `_settle_chunk`: um metodo do repositorio ou SETTLE."""
+    method: str
+    args: Tuple = ()
+    kwargs: Dict[str, object] = {}
+
+
+def _settle_chunk(
+    items: Sequence[PayoutItem],
+    batch_id: Optional[str],
+    seen: Optional[Set[str]],
+    owner: Optional[str],
+    provider_name: str,
+) -> Generator[_Step, object, List[PayoutDetail]]:
+    """
+    Etapas de `process_items`, compartilhadas pelo PayoutService e pelo
+    AsyncPayoutService. Cada I/O sai como um `_Step`; o servico o executa
+    (direto ou com await) e devolve o resultado com `send`. Os stage_timers
+    ficam abertos enquanto o servico executa, entao medem o I/O de cada etapa.
+    """
+    with stage_timer("dedupe"):
+        first_seen = _collapse_repeats(items, seen if seen is not None else set())
+    # Reserva antes de pagar: o banco decide, em um statement por chunk, quem liquida cada id
+    with stage_timer("reservation"):
+        claimed = yield _Step(
+            "reserve", ([items[index] for index in first_seen], batch_id), {"owner": owner}
+        )
+        unclaimed = [items[index].external_id for index in first_seen if items[index].external_id not in claimed]
+        in_flight = (yield _Step("find_in_flight", (unclaimed,))) if unclaimed else set()
+    to_settle = [index for index in first_seen if items[index].external_id in claimed]
+    pending = {index for index in first_seen if items[index].external_id in in_flight}
+
+    # As chamadas ao provedor saem em paralelo; o resultado volta na ordem dos itens
+    with stage_timer("settlement"):
+        settled = yield _Step(SETTLE, ([items[index] for index in to_settle],))
+    outcomes: Dict[int, Outcome] = dict(zip(to_settle, settled))
+
+    details, paid = _build_details(items, outcomes, batch_id, pending)
+    failed = _failed_items(items, outcomes)
+    unknown = [items[index] for index, outcome in outcomes.items() if is_unknown(outcome)]
+    if paid or failed or unknown or batch_id is not None:
+        with stage_timer("persistence"):
+            if paid or failed:
+                yield _Step("complete_reservations", (paid, [item.external_id for item in failed]))
+            if (failed or unknown) and settings.RETRY_ENABLED:
+                # Sem resposta no prazo: a retentativa assume a reserva e reenvia a mesma Idempotency-Key
+                yield _Step("schedule_retries", (failed, batch_id, provider_name), {"unknown": unknown})
+            elif failed:
+                yield _Step("save_failed_events", (failed, batch_id))
+            if batch_id is not None:
+                yield _Step("add_to_batch_summary", (batch_id, details))
+    record_outcomes(detail.status for detail in details)
+    return details
+
+def _chunks(items: Sequence[PayoutItem]) -> Iterator[Sequence[PayoutItem]]:
+    chunk_size = settings.PAYOUT_WRITE_CHUNK_SIZE
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+def _settlement_defaults(
+    provider: Optional[SettlementProvider], engine: Optional[SettlementEngine]
+) -> Tuple[SettlementProvider, SettlementEngine]:
+    provider = provider or default_provider()
+    engine = engine or SettlementEngine(
+        max_in_flight=settings.SETTLEMENT_MAX_IN_FLIGHT,
+        timeout_seconds=settings.SETTLEMENT_TIMEOUT_SECONDS,
+    )
+    return provider, engine
+
+def _provider_name(provider) -> str:
+    # Usado nas retentativas para aplicar o limite de concorrencia do provedor certo
+    name = getattr(provider, "name", None)
+    return name if isinstance(name, str) else type(provider).__name__
+
+def _collapse_repeats(items: Sequence[PayoutItem], seen: Set[str]) -> List[int]:
+    """
+    Indices das primeiras ocorrencias de cada id, em O(n) com um hash set.
+
+    Os demais itens nao entram no resultado, entao nunca chegam a reserva
+    nem ao provedor e sao reportados como `duplicate`. Valores
+    divergentes para o mesmo id ja foram rejeitados na validacao do lote
+    (no NDJSON, dentro de cada chunk).
+    """
+    first_seen: List[int] = []
+    for index, item in enumerate(items):
+        if item.external_id not in seen:
+            seen.add(item.external_id)
+            first_seen.append(index)
+    return first_seen
+
+def _build_details(
+    items: Sequence[PayoutItem],
+    outcomes: Dict[int, Outcome],
+    batch_id: Optional[str] = None,
+    pending: Set[int] = frozenset(),
+) -> Tuple[List[PayoutDetail], List[PayoutRecord]]:
+    """
+    Monta os detalhes na ordem dos itens; devolve (todos, registros dos pagos).
+    Os indices em `pending` nao foram liquidados por estarem reservados por
+    outra liquidacao em andamento. Uma chamada sem resposta no prazo
+    tambem vira `pending`: a reserva continua aberta para conciliacao.
+
+    Um item pago tem um unico objeto: o PayoutRecord gravado em `payouts` e o
+    mesmo que entra no relatorio, onde so os campos de PayoutDetail sao
+    serializados.
+    """
+    details: List[PayoutDetail] = []
+    paid: List[PayoutRecord] = []
+    # Repeticoes de um id compartilham o mesmo detalhe `duplicate` (mesmo id e
+    # valor, nunca alterado depois), o que barateia lotes com muitas repeticoes
+    duplicates: Dict[str, PayoutDetail] = {}
+    for index, item in enumerate(items):
+        outcome = outcomes.get(index)
+        if index in pending or is_unknown(outcome):
+            details.append(PayoutDetail(external_id=item.external_id, status="pending", amount_cents=item.amount_cents))
+            continue
+        if outcome is None:
+            detail = duplicates.get(item.external_id)
+            if detail is None:
+                detail = duplicates[item.external_id] = PayoutDetail(
+                    external_id=item.external_id, status="duplicate", amount_cents=item.amount_cents
                 )
+            details.append(detail)
+            continue
+
+        if outcome:
+            record = PayoutRecord(
+                external_id=item.external_id,
+                status="paid",
+                amount_cents=item.amount_cents,
+                batch_id=batch_id,
+                user_id=item.user_id,
+                provider_reference=getattr(outcome, "reference", None),
             )
+            paid.append(record)
+            details.append(record)
+        else:
+            details.append(PayoutDetail(external_id=item.external_id, status="failed", amount_cents=item.amount_cents))
+    return details, paid
 
-        processing_time = time.time() - start_time
-
-        logger.info(
-            "batch_processing_completed",
-            extra={
-                "batch_id": batch.batch_id,
-                "item_count": len(batch.items),
-                "successful": successful_count,
-                "failed": failed_count,
-                "duplicates": duplicate_count,
-                "processing_time_seconds": round(processing_time, 3),
-                "event": "batch_complete"
-            }
-        )
+def _failed_items(items: Sequence[PayoutItem], outcomes: Dict[int, Outcome]) -> List[PayoutItem]:
+    # Um resultado desconhecido nao e falha: marcar `failed` liberaria a reserva para um segundo pagamento
+    return [items[index] for index, ok in outcomes.items() if not ok and not is_unknown(ok)]
 
-        return PayoutReport(
-            batch_id=batch.batch_id,
-            processed=successful_count + failed_count,
-            successful=successful_count,
-            failed=failed_count,
-            duplicates=duplicate_count,
-            details=report_details,
-        )
+def _log_batch_started(batch: PayoutBatch) -> float:
+    logger.info(
+        "batch_processing_started",
+        extra={
+            "batch_id": batch.batch_id,
+            "item_count": len(batch.items),
+            "event": "batch_start"
+        }
+    )
+    return time.time()
+
+def _log_batch_completed(batch: PayoutBatch, builder: ReportBuilder, start_time: float) -> None:
+    processing_time = time.time() - start_time
+    logger.info(
+        "batch_processing_completed",
+        extra={
+            "batch_id": batch.batch_id,
+            "item_count": len(batch.items),
+            "successful": builder.successful,
+            "failed": builder.failed,
+            "duplicates": builder.duplicates,
+            "pending": builder.pending,
+            "processing_time_seconds": round(processing_time, 3),
+            "event": "batch_complete"
+        }
+    )
@@ -0,0 +1,253 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Protocol, Sequence, Set, Union
+
+from .core.config import settings
+from .core.logging_config import should_log_item_event
+from .models import PayoutItem
+
+logger = logging.getLogger(__name__)
+
+
+
+@dataclass(frozen=True)
+class SettlementResult:
+    """
+    Resposta de um provedor: sucesso e, quando houver, o identificador da
+    transacao no provedor (gravado em `payouts.provider_reference`). Vale como
+    booleano, entao provedores que devolvem apenas True/False continuam validos.
+    """
+    ok: bool
+    reference: Optional[str] = None
+    # Sem resposta no prazo: o provedor pode ou nao ter pago
+    unknown: bool = False
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+
+# Resultado de uma chamada que excedeu o timeout da liquidacao
+UNKNOWN = SettlementResult(ok=False, unknown=True)
+
+Outcome = Union[bool, SettlementResult]
+
+
+def is_unknown(outcome: Outcome) -> bool:
+    return isinstance(outcome, SettlementResult) and outcome.unknown
+SettleFn = Callable[[PayoutItem], Outcome]
+
+
+class SettlementProvider(Protocol):
+    """Interface de um provedor PIX: `name` identifica o provedor nas retentativas."""
+
+    name: str
+
+    def pay(self, item: PayoutItem) -> Outcome:
+        ...
+
+
+def backoff_delay(
+    attempts: int,
+    rng: Optional[random.Random] = None,
+    base_delay: Optional[float] = None,
+    max_delay: Optional[float] = None,
+) -> float:
+    """
+    Segundos ate a proxima tentativa apos `attempts` tentativas falhas.
+
+    Exponencial a partir de `base_delay` (RETRY_BASE_DELAY_SECONDS), limitado
+    a `max_delay` (RETRY_MAX_DELAY_SECONDS), com "equal jitter": metade fixa e
+    metade aleatoria, para que itens que falharam juntos nao voltem todos juntos.
+    """
+    base_delay = settings.RETRY_BASE_DELAY_SECONDS if base_delay is None else base_delay
+    max_delay = settings.RETRY_MAX_DELAY_SECONDS if max_delay is None else max_delay
+    delay = min(max_delay, base_delay * 2 ** max(0, attempts - 1))
+    return delay / 2 + (rng or random).uniform(0, delay / 2)
+
+
+class SimulatedProvider:
+    """
+    Provedor PIX simulado, com modelo de latencia e de falhas injetavel.
+
+    A latencia de cada chamada e `latency_seconds` mais um jitter uniforme
+    em `[0, jitter_seconds]`; o resultado e sucesso com probabilidade
+    `success_rate`. Um `seed` torna a sequencia reproduzivel em testes.
+
+    Como o provedor real com o `Idempotency-Key`, um external_id ja pago
+    responde sucesso de novo sem pagar outra vez (ate `idempotency_capacity`
+    ids, os mais antigos saem primeiro). Uma falha nao e memorizada: a
+    retentativa com a mesma chave tenta o pagamento de novo.
+    """
+
+    # Identifica o provedor nas retentativas (limite de concorrencia por provedor)
+    name = "simulated"
+
+    def __init__(
+        self,
+        success_rate: float = 0.95,
+        latency_seconds: float = 0.0,
+        jitter_seconds: float = 0.0,
+        seed: Optional[int] = None,
+        idempotency_capacity: int = 1_000_000,
+    ):
+        self.success_rate = success_rate
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.idempotency_capacity = idempotency_capacity
+        self._random = random.Random(seed)
+        self._paid: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pay(self, item: PayoutItem) -> bool:
+        delay = self.latency_seconds + self._random.uniform(0, self.jitter_seconds)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            if item.external_id in self._paid:
+                return True
+            if self._random.random() >= self.success_rate:
+                return False
+            self._paid[item.external_id] = None
+            if len(self._paid) > self.idempotency_capacity:
+                self._paid.popitem(last=False)
+        return True
+
+
+_http_provider: Optional[SettlementProvider] = None
+_simulated_provider: Optional[SimulatedProvider] = None
+_provider_lock = threading.Lock()
+
+
+def default_provider() -> SettlementProvider:
+    """
+    Provedor configurado em SETTLEMENT_PROVIDER, unico por processo: o pool de
+    conexoes keep-alive e o estado do circuit breaker do provedor HTTP, e os
+    ids ja pagos do simulado, se perderiam com uma instancia por requisicao.
+    """
+    global _http_provider, _simulated_provider
+    with _provider_lock:
+        if settings.SETTLEMENT_PROVIDER == "http":
+            if _http_provider is None:
+                from .http_provider import HTTPProvider
+                _http_provider = HTTPProvider.from_settings()
+            return _http_provider
+        if _simulated_provider is None:
+            _simulated_provider = SimulatedProvider(
+                success_rate=settings.SIMULATED_PROVIDER_SUCCESS_RATE,
+                latency_seconds=settings.SIMULATED_PROVIDER_LATENCY_SECONDS,
+            )
+        return _simulated_provider
+
+
+class SettlementEngine:
+    """
+    Executa as chamadas ao provedor em paralelo, com limite de chamadas em voo.
+
+    Os resultados voltam na mesma ordem dos itens. Uma excecao do provedor e
+    tratada como falha. Uma chamada que passa de `timeout_seconds` (contados
+    do inicio da propria chamada) pode ter sido paga ou nao, entao volta como
+    `UNKNOWN`: a reserva fica `pending` para conciliacao em vez de virar falha.
+    Como threads nao podem ser interrompidas, a chamada continua ocupando seu
+    slot ate retornar; se todos os slots ficarem presos por mais de
+    `timeout_seconds`, os itens que ainda nao foram enviados voltam como falha.
+    """
+
+    def __init__(self, max_in_flight: int, timeout_seconds: float):
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout_seconds = timeout_seconds
+
+    def settle_all(self, items: Sequence[PayoutItem], settle: SettleFn) -> List[Outcome]:
+        outcomes: List[Outcome] = [False] * len(items)
+        if not items:
+            return outcomes
+
+        slots = min(self.max_in_flight, len(items))
+        queue = iter(enumerate(items))
+        in_flight: Dict[Future, int] = {}
+        # Chamadas que venceram o prazo mas ainda ocupam um slot
+        stuck: Set[Future] = set()
+        # Preenchido pela propria thread: uma chamada enfileirada nao consome o prazo
+        started: Dict[int, float] = {}
+        pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="settlement")
+
+        def call(index: int, item: PayoutItem) -> Outcome:
+            started[index] = time.monotonic()
+            return settle(item)
+
+        def fill_slots() -> None:
+            while len(in_flight) + len(stuck) < slots:
+                entry = next(queue, None)
+                if entry is None:
+                    return
+                index, item = entry
+                in_flight[pool.submit(call, index, item)] = index
+
+        try:
+            fill_slots()
+            while in_flight:
+                deadlines = [started[index] + self.timeout_seconds for index in in_flight.values() if index in started]
+                done, _ = wait(
+                    in_flight,
+                    timeout=max(0.0, min(deadlines) - time.monotonic()) if deadlines else self.timeout_seconds,
+                    return_when=FIRST_COMPLETED,
+                )
+                now = time.monotonic()
+                for future, index in list(in_flight.items()):
+                    if future in done:
+                        outcomes[index] = self._outcome(future, items[index])
+                    elif index in started and started[index] + self.timeout_seconds <= now:
+                        outcomes[index] = UNKNOWN
+                        stuck.add(future)
+                        self._log_item("settlement_timeout", items[index])
+                    else:
+                        continue
+                    del in_flight[future]
+
+                stuck = {future for future in stuck if not future.done()}
+                if not in_flight and stuck:
+                    # Todos os slots presos: espera um deles liberar antes de desistir do resto
+                    wait(stuck, timeout=self.timeout_seconds, return_when=FIRST_COMPLETED)
+                    stuck = {future for future in stuck if not future.done()}
+                fill_slots()
+
+            for index, item in queue:
+                # Nunca enviados ao provedor: falha comum, segura para a retentativa
+                self._log_item("settlement_not_started", item)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        return outcomes
+
+    @staticmethod
+    def _log_item(event: str, item: PayoutItem) -> None:
+        if should_log_item_event():
+            logger.warning(
+                event,
+                extra={
+                    "external_id": item.external_id,
+                    "event": event,
+                    "sample_rate": settings.LOG_ITEM_SAMPLE_RATE,
+                }
+            )
+
+    @staticmethod
+    def _outcome(future: Future, item: PayoutItem) -> Outcome:
+        try:
+            result = future.result()
+            return result if isinstance(result, SettlementResult) else bool(result)
+        except Exception:
+            if should_log_item_event():
+                logger.exception(
+                    "settlement_error",
+                    extra={
+                        "external_id": item.external_id,
+                        "event": "settlement_error",
+                        "sample_rate": settings.LOG_ITEM_SAMPLE_RATE,
+                    }
+                )
+            return False
@@ -0,0 +1,56 @@
+import json
+from typing import Iterable
+
+from pydantic import TypeAdapter
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from .ingestion import NDJSON_MEDIA_TYPE
+from .metrics import stage_timer
+from .models import PayoutDetail, PayoutReport
+
+# Serializador compilado (pydantic-core): emite so os campos de PayoutDetail,
+# mesmo quando o detalhe de um item pago e o PayoutRecord gravado no banco
+_DETAIL_JSON = TypeAdapter(PayoutDetail)
+
+def wants_stream(request: Request, stream: bool) -> bool:
+    """Modo streaming: `?stream=true` ou `Accept: application/x-ndjson`."""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def detail_lines(details: Iterable[PayoutDetail]) -> bytes:
+    """Uma linha NDJSON por item liquidado."""
+    with stage_timer("serialization"):
+        return b"".join(b'{"type":"detail",' + _DETAIL_JSON.dump_json(detail)[1:] + b"\n" for detail in details)
+
+
+def summary_line(report: PayoutReport) -> bytes:
+    """Registro final com os contadores do lote (o relatorio sem os detalhes)."""
+    return json.dumps({"type": "summary", **report.model_dump(exclude={"details"})}).encode() + b"\n"
+
+
+def error_line(error: str, **extra) -> bytes:
+    """Registro final quando o lote e interrompido depois que a resposta ja comecou."""
+    return json.dumps({"type": "error", "error": error, **extra}).encode() + b"\n"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse para relatorios NDJSON.
+
+    Diferente da classe base, nao escuta `http.disconnect` durante o envio:
+    o gerador pode continuar lendo o corpo da requisicao enquanto responde
+    (ingestao e relatorio em streaming ao mesmo tempo), e um cliente que
+    desconecta nao interrompe a liquidacao no meio de um chunk.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,67 @@
+"""
+Receptor local de webhooks para testar o dispatcher (`python -m app.webhooks`).
+
+Uso:
+
+    python -m app.webhook_sink --port 9100 --secret s3cr3t
+    python -m app.webhook_sink --port 9100 --secret s3cr3t --fail-rate 0.3
+
+Com WEBHOOK_SUBSCRIBERS='{"local": {"url": "http://127.0.0.1:9100/webhooks", "secret": "s3cr3t"}}'
+o dispatcher entrega aqui. `POST /webhooks` confere a assinatura (401 se
+invalida), recusa uma fracao `--fail-rate` dos POSTs com 503 para exercitar
+as retentativas e guarda os eventos aceitos, deduplicados pelo `id`.
+`GET /events` lista o que chegou.
+"""
+import argparse
+import json
+import random
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from .webhooks import SIGNATURE_HEADER, verify_signature
+
+
+def create_app(secret: str, fail_rate: float = 0.0, seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI(title="Webhook sink")
+    state = {"posts": 0, "rejected": 0, "events": {}}
+    rng = random.Random(seed)
+
+    @app.post("/webhooks")
+    async def receive(request: Request):
+        body = await request.body()
+        if not verify_signature(secret, request.headers.get(SIGNATURE_HEADER, ""), body):
+            return JSONResponse({"error": "invalid signature"}, status_code=401)
+        if rng.random() < fail_rate:
+            state["rejected"] += 1
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        state["posts"] += 1
+        for event in json.loads(body)["events"]:
+            # Entrega "at least once": um reenvio nao duplica o evento
+            state["events"].setdefault(event["id"], event)
+        return {"received": True}
+
+    @app.get("/events")
+    def events():
+        return {"posts": state["posts"], "rejected": state["rejected"], "events": list(state["events"].values())}
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.webhook_sink", description="Receptor local de webhooks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    uvicorn.run(create_app(args.secret, args.fail_rate, args.seed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Entrega dos webhooks de resultado gravados no outbox (`webhook_outbox`).
+
+Uso:
+
+    python -m app.webhooks            # roda continuamente
+    python -m app.webhooks --drain    # sai quando nao houver eventos vencidos
+
+Os eventos sao gravados na mesma transacao do fato que descrevem (payout
+pago, falha agendada para retentativa, falha definitiva), entao nenhum
+evento se perde nem e anunciado sem o fato correspondente, e a liquidacao
+nao espera nenhuma chamada HTTP. A cada ciclo o dispatcher reserva ate
+WEBHOOK_CLAIM_CHUNK_SIZE eventos vencidos, agrupa por assinante em POSTs de
+ate WEBHOOK_BATCH_SIZE eventos e os envia com no maximo
+WEBHOOK_MAX_CONCURRENCY requisicoes simultaneas. Um POST recusado (nao 2xx
+ou erro de rede) volta com backoff exponencial e jitter, ate
+WEBHOOK_MAX_ATTEMPTS.
+
+A entrega e "at least once": o receptor deve deduplicar pelo `id` do evento.
+Cada POST e assinado com HMAC-SHA256 do `secret` do assinante:
+
+    X-Webhook-Signature: t=<unix timestamp>,v1=<hex de HMAC(secret, "<t>." + corpo)>
+
+`verify_signature` faz a verificacao do lado do receptor (e usada pelo
+receptor local `python -m app.webhook_sink`).
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .core.logging_config import configure_logging
+from .database import SessionLocal
+from .repository import WebhookOutboxRepository
+from .settlement import backoff_delay
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - extra opcional `webhooks`
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance_seconds: int = 300) -> bool:
+    """Confere a assinatura e recusa timestamps fora da tolerancia (replay de um POST antigo)."""
+    try:
+        fields = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(fields["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance_seconds:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), f"t={timestamp},v1={fields.get('v1', '')}")
+
+
+def event_payload(row: Row) -> dict:
+    return {
+        "id": f"evt_{row.id}",
+        "type": row.event_type,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "data": {
+            "external_id": row.external_id,
+            "batch_id": row.batch_id,
+            "user_id": row.user_id,
+            "amount_cents": row.amount_cents,
+            "provider_reference": row.provider_reference,
+        },
+    }
+
+
+class WebhookDispatcher:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        subscribers: Optional[Dict[str, Dict[str, str]]] = None,
+        client: Optional["httpx.Client"] = None,
+        chunk_size: int = settings.WEBHOOK_CLAIM_CHUNK_SIZE,
+        batch_size: int = settings.WEBHOOK_BATCH_SIZE,
+        max_concurrency: int = settings.WEBHOOK_MAX_CONCURRENCY,
+        lease_seconds: int = settings.WEBHOOK_LEASE_SECONDS,
+        poll_interval: float = settings.WEBHOOK_POLL_INTERVAL_SECONDS,
+    ):
+        if client is None and httpx is None:
+            raise RuntimeError("webhook delivery requires httpx (install the `webhooks` extra)")
+        self.session_factory = session_factory
+        self.subscribers = subscribers if subscribers is not None else settings.WEBHOOK_SUBSCRIBERS
+        self.client = client or httpx.Client(
+            timeout=settings.WEBHOOK_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_concurrency = max(1, max_concurrency)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopped = False
+
+    def run_once(self) -> int:
+        """Entrega um chunk de eventos vencidos e retorna quantos foram reservados."""
+        db = self.session_factory()
+        try:
+            outbox = WebhookOutboxRepository(db)
+            owner = f"{self.worker_id}-{uuid.uuid4().hex[:8]}"
+            claimed = outbox.claim(owner, self.chunk_size, self.lease_seconds)
+            if not claimed:
+                return 0
+
+            batches: List[Tuple[str, List[Row]]] = []
+            by_subscriber = sorted(claimed, key=lambda row: (row.subscriber, row.id))
+            for subscriber, rows in itertools.groupby(by_subscriber, key=lambda row: row.subscriber):
+                rows = list(rows)
+                batches.extend(
+                    (subscriber, rows[start:start + self.batch_size]) for start in range(0, len(rows), self.batch_size)
+                )
+
+            # So os POSTs saem em paralelo; a sessao do banco fica nesta thread
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(batches)), thread_name_prefix="webhook",
+            ) as pool:
+                delivered = list(pool.map(lambda batch: self._deliver(*batch), batches))
+
+            outcomes = {"delivered": 0, "rescheduled": 0, "dead": 0}
+            for (subscriber, rows), ok in zip(batches, delivered):
+                outcomes[self._resolve(outbox, owner, subscriber, rows, ok)] += len(rows)
+            logger.info(
+                "webhooks_dispatched",
+                extra={"claimed": len(claimed), "posts": len(batches), "outcomes": outcomes, "event": "webhooks_dispatched"},
+            )
+            return len(claimed)
+        finally:
+            db.close()
+
+    def _deliver(self, subscriber: str, rows: Sequence[Row]) -> bool:
+        config = self.subscribers.get(subscriber)
+        if config is None:
+            return False
+        body = json.dumps({"subscriber": subscriber, "events": [event_payload(row) for row in rows]}).encode()
+        headers = {"Content-Type": "application/json", SIGNATURE_HEADER: sign(config.get("secret", ""), int(time.time()), body)}
+        try:
+            response = self.client.post(config["url"], content=body, headers=headers)
+        except httpx.HTTPError as exc:
+            reason = type(exc).__name__
+        else:
+            if response.is_success:
+                return True
+            reason = f"HTTP {response.status_code}"
+        logger.warning(
+            "webhook_delivery_failed",
+            extra={"subscriber": subscriber, "events": len(rows), "reason": reason, "event": "webhook_delivery_failed"},
+        )
+        return False
+
+    def _resolve(self, outbox: WebhookOutboxRepository, owner: str, subscriber: str, rows: Sequence[Row], ok: bool) -> str:
+        ids = [row.id for row in rows]
+        if ok:
+            outbox.mark_delivered(owner, ids)
+            return "delivered"
+        attempts = max(row.attempts for row in rows) + 1
+        if subscriber not in self.subscribers or attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            outbox.mark_dead(owner, ids)
+            logger.warning(
+                "webhook_events_dead",
+                extra={"subscriber": subscriber, "events": len(ids), "attempts": attempts, "event": "webhook_events_dead"},
+            )
+            return "dead"
+        delay = backoff_delay(
+            attempts,
+            base_delay=settings.WEBHOOK_RETRY_BASE_DELAY_SECONDS,
+            max_delay=settings.WEBHOOK_RETRY_MAX_DELAY_SECONDS,
+        )
+        outbox.reschedule(owner, ids, datetime.utcnow() + timedelta(seconds=delay))
+        return "rescheduled"
+
+    def run(self, drain: bool = False) -> int:
+        """Loop principal. Com `drain`, sai assim que nao houver eventos vencidos."""
+        processed = 0
+        while not self._stopped:
+            claimed = self.run_once()
+            processed += claimed
+            if claimed == 0:
+                if drain:
+                    break
+                time.sleep(self.poll_interval)
+        return processed
+
+    def stop(self, *_args) -> None:
+        self._stopped = True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Entrega dos webhooks de resultado gravados no outbox")
+    parser.add_argument("--chunk-size", type=int, default=settings.WEBHOOK_CLAIM_CHUNK_SIZE)
+    parser.add_argument("--drain", action="store_true", help="Sai quando nao houver eventos vencidos")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if settings.DB_AUTO_MIGRATE:
+        from .migrations import migrate
+        migrate()
+
+    dispatcher = WebhookDispatcher(chunk_size=args.chunk_size)
+    signal.signal(signal.SIGTERM, dispatcher.stop)
+    signal.signal(signal.SIGINT, dispatcher.stop)
+    processed = dispatcher.run(drain=args.drain)
+    logger.info(
+        "webhook_dispatcher_stopped",
+        extra={"worker_id": dispatcher.worker_id, "processed": processed, "event": "webhook_dispatcher_stop"},
+    )
+
+
+if __name__ == "__main__":
+    main()
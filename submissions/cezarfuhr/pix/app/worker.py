@@ -0,0 +1,152 @@
+"""
+Workers da fila duravel de payouts.
+
+Uso:
+
+    python -m app.worker --workers 4
+    python -m app.worker --workers 4 --drain   # sai quando a fila esvaziar
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .core.logging_config import configure_logging
+from .database import SessionLocal
+from .models import PayoutItem
+from .repository import BatchJobRepository, PayoutQueueRepository
+from .services import PayoutService
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker:
+    """Consome `payout_jobs` em chunks: claim, liquidacao e ack."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        chunk_size: int = settings.QUEUE_CLAIM_CHUNK_SIZE,
+        lease_seconds: int = settings.QUEUE_LEASE_SECONDS,
+        poll_interval: float = settings.QUEUE_POLL_INTERVAL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopped = False
+
+    def run_once(self) -> int:
+        """Processa um chunk da fila e retorna quantos itens foram reservados."""
+        db = self.session_factory()
+        try:
+            queue = PayoutQueueRepository(db)
+            owner = f"{self.worker_id}-{uuid.uuid4().hex[:8]}"
+            claimed = queue.claim(owner, self.chunk_size, self.lease_seconds)
+            if not claimed:
+                return 0
+
+            details = []
+            # Um chunk pode misturar lotes; cada trecho e gravado com o seu batch_id
+            for batch_id, jobs in itertools.groupby(claimed, key=lambda job: job.batch_id):
+                # O lease garante que so este worker liquida estes itens: uma reserva
+                # `pending` do job do lote e de um worker que caiu com o lease anterior
+                service = PayoutService(
+                    db_session=db, reservation_owner=BatchJobRepository.reservation_owner(batch_id)
+                )
+                items = [
+                    PayoutItem(
+                        external_id=job.external_id,
+                        user_id=job.user_id,
+                        amount_cents=job.amount_cents,
+                        pix_key=job.pix_key,
+                    )
+                    for job in jobs
+                ]
+                details.extend(service.process_items(items, batch_id))
+            acked = queue.ack(owner, {job.id: detail.status for job, detail in zip(claimed, details)})
+
+            batch_jobs = BatchJobRepository(db)
+            for batch_id, counts in acked.items():
+                batch_jobs.add_counts(batch_id, counts)
+                batch_jobs.complete_if_done(batch_id, queue.build_report)
+            return len(claimed)
+        finally:
+            db.close()
+
+    def run(self, drain: bool = False) -> int:
+        """Loop principal. Com `drain`, sai assim que a fila estiver vazia."""
+        processed = 0
+        while not self._stopped:
+            claimed = self.run_once()
+            processed += claimed
+            if claimed == 0:
+                if drain:
+                    break
+                time.sleep(self.poll_interval)
+        return processed
+
+    def stop(self, *_args) -> None:
+        self._stopped = True
+
+
+def _worker_main(chunk_size: int, lease_seconds: int, drain: bool) -> None:
+    configure_logging()
+    worker = QueueWorker(chunk_size=chunk_size, lease_seconds=lease_seconds)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    processed = worker.run(drain=drain)
+    logger.info(
+        "queue_worker_stopped",
+        extra={"worker_id": worker.worker_id, "processed": processed, "event": "worker_stop"}
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Workers da fila duravel de payouts")
+    parser.add_argument("--workers", type=int, default=settings.WORKER_PROCESSES)
+    parser.add_argument("--chunk-size", type=int, default=settings.QUEUE_CLAIM_CHUNK_SIZE)
+    parser.add_argument("--lease-seconds", type=int, default=settings.QUEUE_LEASE_SECONDS)
+    parser.add_argument("--drain", action="store_true", help="Sai quando a fila esvaziar")
+    args = parser.parse_args(argv)
+
+    if settings.DB_AUTO_MIGRATE:
+        from .migrations import migrate
+        migrate()
+
+    # "spawn" garante que cada processo abre o seu proprio pool de conexoes
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(args.chunk_size, args.lease_seconds, args.drain),
+            name=f"payout-worker-{i}",
+        )
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def _forward(signum, _frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
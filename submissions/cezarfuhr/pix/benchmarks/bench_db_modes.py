@@ -0,0 +1,109 @@
+"""
+Benchmark de carga do POST /payouts/batch: engine sincrono (threadpool) vs. engine assincrono.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_db_modes --requests 200 --concurrency 50 --items 20
+
+Dispara `--requests` lotes com ate `--concurrency` requisicoes simultaneas contra
+a aplicacao em processo (httpx + ASGITransport, sem rede) e reporta throughput e
+latencia p50/p99 de cada modo. O banco e um SQLite temporario, ou o de
+`--database-url` (as tabelas sao recriadas). Com Postgres, o pool configurado em
+DB_POOL_SIZE/DB_MAX_OVERFLOW limita as sessoes simultaneas de ambos os modos.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+
+def _configure(database_url: str) -> None:
+    # As settings sao lidas no import de app.database, entao o banco e definido antes
+    os.environ["DATABASE_URL"] = database_url
+
+
+async def _run_mode(app, settings, use_async: bool, requests: int, concurrency: int, items: int) -> dict:
+    import httpx
+    from app.async_database import dispose_async_engine
+
+    settings.DB_ASYNC_ENABLED = use_async
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    mode = "async" if use_async else "sync"
+
+    async def submit(client, index):
+        payload = {
+            "batch_id": f"bench-{mode}-{index}",
+            "items": [
+                {"external_id": f"bench-{mode}-{index}-{i}", "user_id": "u1", "amount_cents": 100, "pix_key": "a@b.com"}
+                for i in range(items)
+            ],
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/v1/payouts/batch", json=payload, headers={"X-API-Key": settings.API_KEY})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(submit(client, i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    await dispose_async_engine()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": requests,
+        "concurrency": concurrency,
+        "items_per_request": items,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _configure(args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+        from app.core.config import settings
+        from app.database import Base, engine
+        from app.limiter import limiter
+        from app.main import app
+
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        # O limite de 5/minuto por IP derrubaria o benchmark
+        limiter.enabled = False
+        # Os logs JSON da aplicacao tambem vao para stdout; o resultado precisa ficar sozinho la
+        logging.disable(logging.INFO)
+
+        results = [
+            asyncio.run(_run_mode(app, settings, use_async, args.requests, args.concurrency, args.items))
+            for use_async in (False, True)
+        ]
+        engine.dispose()
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
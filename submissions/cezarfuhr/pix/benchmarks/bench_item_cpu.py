@@ -0,0 +1,133 @@
+"""
+Custo de CPU por item de um lote grande, etapa por etapa, sem banco nem provedor.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_item_cpu
+    python -m benchmarks.bench_item_cpu --items 100000 --repeats 5
+
+Cada repeticao percorre o caminho de uma requisicao sincrona sobre o mesmo
+corpo JSON, mantendo vivos os objetos das etapas anteriores como no
+endpoint: validacao do PayoutBatch (json.loads + validacao, como o FastAPI
+faz, e `model_validate_json` como referencia), montagem dos detalhes,
+relatorio e serializacao (resposta JSON e linhas NDJSON). As variantes
+`legacy` reproduzem o caminho anterior (dois modelos por item pago e
+json.dumps por linha). Tudo roda com o coletor de lixo no padrao do
+interpretador e com o ajuste de `app.core.gc_config` (limiar da geracao 0
+de `--gc-threshold` e gc.freeze), e o resultado e o tempo de CPU mediano em microssegundos por item.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from app.core.config import settings
+from app.core.gc_config import configure_gc, freeze_startup_objects
+from app.models import PayoutBatch, PayoutDetail, PayoutRecord
+from app.services import ReportBuilder, _build_details
+from app.streaming import detail_lines
+
+
+def _legacy_build_details(items, outcomes, batch_id):
+    """Caminho anterior: um PayoutDetail por item e outro PayoutRecord por item pago."""
+    details, paid = [], []
+    for index, item in enumerate(items):
+        outcome = outcomes.get(index)
+        status = "duplicate" if outcome is None else ("paid" if outcome else "failed")
+        details.append(PayoutDetail(external_id=item.external_id, status=status, amount_cents=item.amount_cents))
+        if outcome:
+            paid.append(PayoutRecord(
+                external_id=item.external_id, status=status, amount_cents=item.amount_cents,
+                batch_id=batch_id, user_id=item.user_id,
+            ))
+    return details, paid
+
+
+def _legacy_detail_lines(details):
+    return b"".join(json.dumps({"type": "detail", **detail.model_dump()}).encode() + b"\n" for detail in details)
+
+
+def _body(items: int) -> bytes:
+    return json.dumps({
+        "batch_id": "bench",
+        "items": [
+            {"external_id": f"item-{i}", "user_id": f"user-{i % 997}", "amount_cents": 100 + i % 5000,
+             "pix_key": f"user{i}@example.com"}
+            for i in range(items)
+        ],
+    }).encode()
+
+
+def _cpu(timings: dict, stage: str, fn, *args):
+    start = time.process_time()
+    result = fn(*args)
+    timings.setdefault(stage, []).append(time.process_time() - start)
+    return result
+
+
+def _request(body: bytes, timings: dict) -> None:
+    _cpu(timings, "validation_model_validate_json", PayoutBatch.model_validate_json, body)
+    batch = _cpu(timings, "validation", lambda: PayoutBatch.model_validate(json.loads(body)))
+    # 95% pagos, 5% falhas, como o provedor simulado
+    outcomes = {index: index % 20 != 0 for index in range(len(batch.items))}
+
+    legacy_details, _ = _cpu(timings, "details_legacy", _legacy_build_details, batch.items, outcomes, batch.batch_id)
+    details, paid = _cpu(timings, "details", _build_details, batch.items, outcomes, batch.batch_id)
+
+    def build_report():
+        builder = ReportBuilder(batch.batch_id)
+        builder.add(details)
+        return builder.build()
+
+    report = _cpu(timings, "report", build_report)
+    _cpu(timings, "serialization_json", report.model_dump_json)
+    _cpu(timings, "serialization_ndjson_legacy", _legacy_detail_lines, legacy_details)
+    _cpu(timings, "serialization_ndjson", detail_lines, details)
+
+
+def run(items: int, repeats: int, gc_mode: str, gc_threshold: int) -> dict:
+    body = _body(items)
+    gc.unfreeze()
+    gc.set_threshold(700, 10, 10)
+    if gc_mode == "tuned":
+        configure_gc(gc_threshold)
+        freeze_startup_objects()
+    gc.collect()
+
+    timings: dict = {}
+    for _ in range(repeats):
+        _request(body, timings)
+        gc.collect()
+
+    per_item = {stage: round(statistics.median(values) / items * 1e6, 2) for stage, values in timings.items()}
+    request_stages = ("validation", "details", "report", "serialization_json")
+    return {
+        "gc": gc_mode,
+        "gc_threshold": list(gc.get_threshold()),
+        "items": items,
+        "us_per_item": per_item,
+        "request_us_per_item": round(sum(per_item[stage] for stage in request_stages), 2),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--gc-threshold", type=int, default=10_000, help="Limiar da geracao 0 na variante tuned")
+    args = parser.parse_args(argv)
+
+    # As metricas por etapa ficam fora da medicao
+    settings.METRICS_ENABLED = False
+    results = [run(args.items, args.repeats, gc_mode, args.gc_threshold) for gc_mode in ("default", "tuned")]
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Microbenchmark do custo por registro de log na thread que loga.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_logging --records 50000
+
+Compara o formatter antigo (lista literal de chaves reservadas + json,
+escrita sincrona) com o atual: frozenset de chaves reservadas, json ou orjson,
+e escrita sincrona ou por QueueHandler/QueueListener. A saida dos handlers
+vai para /dev/null; o tempo medido e o que a requisicao paga por `logger.info`.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+from logging.handlers import QueueListener
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from app.core.logging_config import DeferredQueueHandler, JSONFormatter, orjson
+
+
+class LegacyJSONFormatter(logging.Formatter):
+    """Formatter anterior, mantido aqui apenas como linha de base."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+        }
+        for key, value in record.__dict__.items():
+            if key not in ['name', 'msg', 'args', 'created', 'filename', 'funcName',
+                          'levelname', 'levelno', 'lineno', 'module', 'msecs',
+                          'message', 'pathname', 'process', 'processName',
+                          'relativeCreated', 'thread', 'threadName', 'exc_info',
+                          'exc_text', 'stack_info', 'taskName']:
+                log_entry[key] = value
+        return json.dumps(log_entry, ensure_ascii=False)
+
+
+def _encoders():
+    encoders = {"json": lambda entry: json.dumps(entry, ensure_ascii=False, default=str)}
+    if orjson is not None:
+        encoders["orjson"] = lambda entry: orjson.dumps(entry, default=str).decode()
+    return encoders
+
+
+def _measure(name: str, formatter: logging.Formatter, use_queue: bool, records: int, sink) -> dict:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    stream_handler = logging.StreamHandler(sink)
+    stream_handler.setFormatter(formatter)
+
+    listener = None
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, stream_handler)
+        listener.start()
+        logger.addHandler(DeferredQueueHandler(log_queue))
+    else:
+        logger.addHandler(stream_handler)
+
+    extra = {"batch_id": "bench", "item_count": 500, "successful": 490, "failed": 10, "event": "batch_complete"}
+    start = time.perf_counter()
+    for _ in range(records):
+        logger.info("batch_processing_completed", extra=extra)
+    caller_seconds = time.perf_counter() - start
+    if listener is not None:
+        listener.stop()
+    drained_seconds = time.perf_counter() - start
+    logger.handlers.clear()
+
+    return {
+        "variant": name,
+        "records": records,
+        "caller_us_per_record": round(caller_seconds / records * 1e6, 2),
+        "total_us_per_record": round(drained_seconds / records * 1e6, 2),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50_000)
+    args = parser.parse_args(argv)
+
+    results = []
+    with open(os.devnull, "w") as sink:
+        results.append(_measure("legacy-sync", LegacyJSONFormatter(), False, args.records, sink))
+        for encoder_name, encoder in _encoders().items():
+            for use_queue in (False, True):
+                name = f"{encoder_name}-{'queue' if use_queue else 'sync'}"
+                results.append(_measure(name, JSONFormatter(encoder), use_queue, args.records, sink))
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
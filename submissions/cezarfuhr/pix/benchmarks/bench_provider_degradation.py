@@ -0,0 +1,143 @@
+"""
+Throughput da liquidacao com o provedor HTTP saudavel, degradado e fora do ar.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_provider_degradation
+    python -m benchmarks.bench_provider_degradation --items 2000 --in-flight 64 --profiles healthy slow degraded outage
+
+Sobe o provedor local (`python -m app.mock_provider`) em uma porta livre e,
+para cada perfil, liquida `--items` itens pelo SettlementEngine com o
+HTTPProvider (pool keep-alive e limite por host de app.core.config), uma vez
+com o circuit breaker ligado e outra com ele desligado. O perfil e trocado
+com `PUT /profile`, sem reiniciar o servidor. Reporta itens/s, pagos,
+recusados/falhos, chamadas cortadas pelo breaker e a latencia por item.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from app.core.config import settings
+from app.http_provider import HTTP2_AVAILABLE, CircuitBreaker, HTTPProvider
+from app.metrics import PROVIDER_CALLS
+from app.models import PayoutItem
+from app.settlement import SettlementEngine
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(f"{base_url}/profile").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("provedor local nao respondeu a tempo")
+
+
+def _breaker(enabled: bool) -> CircuitBreaker:
+    if enabled:
+        return CircuitBreaker.from_settings()
+    # Desligado: nunca junta chamadas suficientes para abrir
+    return CircuitBreaker(window=1, min_calls=2, error_rate=1.0, open_seconds=0)
+
+
+def run(base_url: str, profile: str, breaker: bool, items: int, in_flight: int) -> dict:
+    httpx.put(f"{base_url}/profile", json={"name": profile}).raise_for_status()
+    name = f"bench-{profile}-{'breaker' if breaker else 'no-breaker'}"
+    provider = HTTPProvider(
+        base_url,
+        name=name,
+        timeout_seconds=settings.PROVIDER_TIMEOUT_SECONDS,
+        connect_timeout_seconds=settings.PROVIDER_CONNECT_TIMEOUT_SECONDS,
+        max_concurrency=settings.PROVIDER_MAX_CONCURRENCY_PER_HOST,
+        keepalive_expiry_seconds=settings.PROVIDER_KEEPALIVE_EXPIRY_SECONDS,
+        http2=settings.PROVIDER_HTTP2,
+        breaker=_breaker(breaker),
+    )
+    engine = SettlementEngine(max_in_flight=in_flight, timeout_seconds=settings.SETTLEMENT_TIMEOUT_SECONDS)
+    batch = [
+        PayoutItem(external_id=f"{name}-{time.time_ns()}-{i}", user_id="u1", amount_cents=100, pix_key="a@b.com")
+        for i in range(items)
+    ]
+    latencies = []
+
+    def settle(item):
+        start = time.perf_counter()
+        try:
+            return provider.pay(item)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    outcomes = engine.settle_all(batch, settle)
+    elapsed = time.perf_counter() - start
+    provider.close()
+
+    latencies.sort()
+    paid = sum(1 for outcome in outcomes if outcome)
+    return {
+        "profile": profile,
+        "breaker": breaker,
+        "items": items,
+        "seconds": round(elapsed, 2),
+        "items_per_second": round(items / elapsed, 1),
+        "paid": paid,
+        "failed": items - paid,
+        "provider_errors": int(PROVIDER_CALLS.value(provider=name, result="error")),
+        "short_circuited": int(PROVIDER_CALLS.value(provider=name, result="short_circuited")),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--in-flight", type=int, default=settings.SETTLEMENT_MAX_IN_FLIGHT)
+    parser.add_argument("--profiles", nargs="+", default=["healthy", "degraded", "outage"])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Contadores por execucao vem do registro de metricas; logs por item ficam de fora
+    settings.METRICS_ENABLED = True
+    settings.LOG_ITEM_SAMPLE_RATE = 0.0
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.mock_provider", "--port", str(port), "--seed", str(args.seed)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        _wait_ready(base_url)
+        results = [
+            run(base_url, profile, breaker, args.items, args.in_flight)
+            for profile in args.profiles
+            for breaker in (True, False)
+        ]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    json.dump({"http2": settings.PROVIDER_HTTP2 and HTTP2_AVAILABLE, "results": results}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark de escala da fila duravel: throughput de `python -m app.worker` por numero de processos.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_queue_workers --items 2000 --workers 1 2 4 --latency 0.005
+
+Cada rodada enfileira `--items` itens em um SQLite temporario (ou no banco de
+`--database-url`, que e recriado) e mede o tempo ate os workers esvaziarem a fila.
+A latencia simulada do provedor faz o papel da chamada de rede de um PSP real.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import PayoutBatch, PayoutItem
+from app.repository import BatchJobRepository, PayoutQueueRepository
+
+
+def _enqueue(database_url: str, items: int, tag: str) -> None:
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    batch = PayoutBatch(
+        batch_id=tag,
+        items=[
+            PayoutItem(external_id=f"{tag}-{i}", user_id=f"u{i}", amount_cents=100, pix_key="bench@pix.com")
+            for i in range(items)
+        ],
+    )
+    BatchJobRepository(db).create(batch, enqueue=PayoutQueueRepository(db).enqueue)
+    db.close()
+    engine.dispose()
+
+
+def run(database_url: str, items: int, workers: list, latency: float, chunk_size: int) -> list:
+    results = []
+    for count in workers:
+        _enqueue(database_url, items, f"bench-w{count}")
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            SIMULATED_PROVIDER_LATENCY_SECONDS=str(latency),
+            SIMULATED_PROVIDER_SUCCESS_RATE="1.0",
+        )
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "app.worker", "--workers", str(count),
+             "--chunk-size", str(chunk_size), "--drain"],
+            env=env, check=True, stdout=subprocess.DEVNULL,
+        )
+        elapsed = time.perf_counter() - start
+        results.append({
+            "workers": count,
+            "items": items,
+            "provider_latency_seconds": latency,
+            "seconds": round(elapsed, 3),
+            "items_per_second": round(items / elapsed, 1),
+        })
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Banco alvo (padrao: SQLite temporario)")
+    parser.add_argument("--items", type=int, default=2_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--latency", type=float, default=0.005, help="Latencia simulada por chamada ao provedor")
+    parser.add_argument("--chunk-size", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        results = run(database_url, args.items, args.workers, args.latency, args.chunk_size)
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
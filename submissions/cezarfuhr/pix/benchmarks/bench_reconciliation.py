@@ -0,0 +1,121 @@
+"""
+Conciliacao de arquivos de liquidacao sinteticos contra a tabela `payouts`.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_reconciliation                          # 1M e 10M linhas
+    python -m benchmarks.bench_reconciliation --rows 100000 1000000
+
+Para cada tamanho, gera em um SQLite temporario `--rows` payouts pagos e um
+CSV do provedor ordenado, com divergencias conhecidas: 1% dos payouts fora do
+arquivo (missing), 1% de linhas sem payout (extra), 0,5% com outro valor
+(amount_mismatch) e 0,1% de linhas repetidas (duplicate). Entao roda o
+comando real (`python -m app.cli reconcile`) em um processo novo e mede o
+tempo e o pico de memoria (RSS maximo) desse processo. Os contadores do
+resumo sao conferidos com os esperados. Com o merge-join em streaming, o pico
+de memoria deve ficar estavel entre 1M e 10M linhas.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from app.migrations import migrate
+
+
+def _generate(directory: str, rows: int) -> tuple:
+    database = os.path.join(directory, "payouts.db")
+    engine = create_engine(f"sqlite:///{database}")
+    migrate(engine)
+    engine.dispose()
+
+    expected = {"matched": 0, "missing": 0, "extra": 0, "amount_mismatch": 0, "duplicates": 0}
+    connection = sqlite3.connect(database)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.executemany(
+        "INSERT INTO payouts (external_id, status, amount_cents, batch_id, user_id, created_at) "
+        "VALUES (?, 'paid', ?, 'bench', 'u1', '2026-10-17 12:00:00')",
+        ((f"rec-{i:010d}", 100 + i % 5000) for i in range(rows)),
+    )
+    connection.commit()
+    connection.close()
+
+    settlement = os.path.join(directory, "settlement.csv")
+    with open(settlement, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(("external_id", "amount_cents", "provider_reference"))
+        for i in range(rows):
+            external_id, amount = f"rec-{i:010d}", 100 + i % 5000
+            if i % 100 == 0:
+                expected["missing"] += 1
+            elif i % 200 == 1:
+                writer.writerow((external_id, amount + 1, f"ref-{i}"))
+                expected["amount_mismatch"] += 1
+            else:
+                writer.writerow((external_id, amount, f"ref-{i}"))
+                expected["matched"] += 1
+                if i % 1000 == 7:
+                    writer.writerow((external_id, amount, f"ref-{i}"))
+                    expected["duplicates"] += 1
+            if i % 100 == 50:
+                # "rec-...-x" ordena logo depois do id i e antes do i + 1
+                writer.writerow((f"{external_id}-x", amount, f"ref-{i}-x"))
+                expected["extra"] += 1
+    return database, settlement, expected
+
+
+def run(rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        database, settlement, expected = _generate(directory, rows)
+        generation_seconds = time.perf_counter() - start
+
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}")
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.cli", "reconcile", settlement, "--output", os.path.join(directory, "out.csv")],
+            env=env, stdout=subprocess.PIPE,
+        )
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        if status != 0:
+            raise RuntimeError(f"reconcile exited with status {status}")
+
+    summary = json.loads(output)
+    counts = {key: summary[key] for key in expected}
+    # ru_maxrss em KiB no Linux
+    peak_rss_mb = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 2 ** 20
+    return {
+        "rows": rows,
+        "generation_seconds": round(generation_seconds, 1),
+        "seconds": round(seconds, 2),
+        "rows_per_second": round((summary["file_rows"] + summary["db_rows"]) / seconds),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "counts": counts,
+        "correct": counts == expected,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    args = parser.parse_args(argv)
+
+    results = [run(rows) for rows in args.rows]
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
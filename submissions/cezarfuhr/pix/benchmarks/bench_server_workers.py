@@ -0,0 +1,145 @@
+"""
+Benchmark do perfil de producao (`python -m app.server`): startup e throughput por numero de workers.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.bench_server_workers --workers 1 2 4 --concurrency 32 --duration 10
+
+Para cada contagem de workers sobe o servidor real (uvicorn, socket TCP local),
+mede o tempo ate o primeiro `GET /health` responder e entao dispara lotes
+pequenos em `POST /payouts/batch` por `--duration` segundos com `--concurrency`
+clientes. Reporta tambem o tempo de import do app em um processo novo.
+
+Com SQLite (padrao) as escritas de todos os workers se serializam no arquivo;
+use `--database-url` com Postgres para medir a escala real do banco.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+API_KEY = "benchmark"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _env(database_url: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "API_KEY": API_KEY,
+        "DATABASE_URL": database_url,
+        "RATE_LIMIT_REQUESTS_PER_MINUTE": str(10 ** 9),
+        "RATE_LIMIT_ITEMS_PER_MINUTE": str(10 ** 9),
+    })
+    return env
+
+
+def _import_seconds(env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import app.main"], env=env, check=True)
+    return time.perf_counter() - start
+
+
+async def _wait_ready(base_url: str, timeout: float = 60.0) -> float:
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() - start < timeout:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.02)
+    raise RuntimeError("servidor nao respondeu a tempo")
+
+
+async def _load(base_url: str, concurrency: int, duration: float, items: int, tag: str) -> dict:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async def client_loop(client, worker):
+        sequence = 0
+        while time.perf_counter() < deadline:
+            payload = {
+                "batch_id": f"{tag}-{worker}-{sequence}",
+                "items": [
+                    {"external_id": f"{tag}-{worker}-{sequence}-{i}", "user_id": "u1",
+                     "amount_cents": 100, "pix_key": "a@b.com"}
+                    for i in range(items)
+                ],
+            }
+            start = time.perf_counter()
+            response = await client.post("/api/v1/payouts/batch", json=payload, headers={"X-API-Key": API_KEY})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+            sequence += 1
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, worker) for worker in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+def run(database_url: str, workers: int, concurrency: int, duration: float, items: int) -> dict:
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        env=_env(database_url), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        startup = asyncio.run(_wait_ready(base_url))
+        load = asyncio.run(_load(base_url, concurrency, duration, items, f"w{workers}"))
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    return {"workers": workers, "startup_seconds": round(startup, 3), "concurrency": concurrency, **load}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Banco alvo (padrao: SQLite temporario)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--items", type=int, default=10, help="Itens por lote")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        report = {
+            "cpu_count": os.cpu_count(),
+            "import_seconds": round(_import_seconds(_env(database_url)), 3),
+            "results": [
+                run(database_url, workers, args.concurrency, args.duration, args.items)
+                for workers in args.workers
+            ],
+        }
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compara duas execucoes de `benchmarks.bench_api_load` cenario a cenario.
+
+Uso (a partir de submissions/cezarfuhr/pix):
+
+    python -m benchmarks.compare base.json novo.json --threshold 0.10
+
+Imprime em JSON a variacao relativa de items/sec, p99 e pico de RSS de cada
+cenario presente nas duas execucoes. Sai com codigo 1 se algum cenario perder
+mais que `--threshold` de throughput, para uso em CI.
+"""
+import argparse
+import json
+import sys
+
+SCENARIO_KEYS = ("dialect", "batch_size", "duplicate_ratio", "concurrency")
+
+
+def _index(report: dict) -> dict:
+    return {tuple(result[key] for key in SCENARIO_KEYS): result for result in report["results"]}
+
+
+def _change(old: float, new: float) -> float:
+    return round((new - old) / old, 4) if old else 0.0
+
+
+def compare(base: dict, new: dict) -> list:
+    base_results = _index(base)
+    rows = []
+    for scenario, result in _index(new).items():
+        old = base_results.get(scenario)
+        if old is None:
+            continue
+        rows.append({
+            **dict(zip(SCENARIO_KEYS, scenario)),
+            "items_per_second_change": _change(old["items_per_second"], result["items_per_second"]),
+            "p99_change": _change(old["p99_ms"], result["p99_ms"]),
+            "peak_rss_change": _change(old["peak_rss_mb"], result["peak_rss_mb"]),
+        })
+    return rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Queda de throughput tolerada (fracao)")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as fh:
+        base = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+
+    rows = compare(base, new)
+    json.dump({"base": base.get("commit"), "new": new.get("commit"), "scenarios": rows}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if any(row["items_per_second_change"] < -args.threshold for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Gerador de lotes sinteticos no formato de `seed_examples/payouts_batch_example.json`.
+
+Os valores e chaves PIX seguem a mistura do exemplo (e-mail e telefone) e sao
+reproduziveis por `seed`. Uma fracao `duplicate_ratio` dos itens reaproveita
+ids de `processed_ids`, simulando reenvios de pagamentos ja liquidados.
+"""
+import random
+from typing import Dict, List, Sequence
+
+
+def synthetic_items(count: int, prefix: str, seed: int = 0) -> List[Dict[str, object]]:
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        user = f"u{rng.randrange(1, 100_000)}"
+        if i % 2:
+            pix_key = f"+55 11 9{rng.randrange(1000, 9999)}-{rng.randrange(1000, 9999)}"
+        else:
+            pix_key = f"{user}@email.com"
+        items.append({
+            "external_id": f"{prefix}-{i:07d}",
+            "user_id": user,
+            "amount_cents": rng.randrange(1_000, 200_000),
+            "pix_key": pix_key,
+        })
+    return items
+
+
+def synthetic_batch(
+    batch_id: str,
+    size: int,
+    duplicate_ratio: float = 0.0,
+    processed_ids: Sequence[str] = (),
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Monta um lote com `size` itens, dos quais ~`duplicate_ratio` reusam `processed_ids`."""
+    items = synthetic_items(size, prefix=batch_id, seed=seed)
+    duplicates = min(len(processed_ids), int(size * duplicate_ratio))
+    if duplicates:
+        rng = random.Random(seed)
+        for index, external_id in zip(rng.sample(range(size), duplicates), processed_ids):
+            items[index]["external_id"] = external_id
+    return {"batch_id": batch_id, "items": items}
@@ -1,12 +1,16 @@
 import pytest
 from app.main import app
+from app.migrations import migrate
+
+# O TestClient sem `with` nao executa o lifespan, entao o schema e criado aqui
+migrate()
 
 
 @pytest.fixture(autouse=True)
 def reset_rate_limiter():
     """Reset rate limiter before each test to avoid conflicts."""
     if hasattr(app.state, 'limiter'):
-        app.state.limiter._storage.reset()
+        app.state.limiter.reset()
     yield
     if hasattr(app.state, 'limiter'):
-        app.state.limiter._storage.reset()
+        app.state.limiter.reset()
@@ -0,0 +1,107 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import asyncio
+import uuid
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import async_database
+from app.async_database import async_database_url, dispose_async_engine
+from app.core.config import settings
+from app.database import Base, pool_options
+from app.main import app
+from app.models import PayoutBatch, PayoutItem
+from app.services import AsyncPayoutService
+from app.settlement import SettlementEngine, SimulatedProvider
+
+client = TestClient(app)
+
+
+def _item(external_id, amount_cents=1000):
+    return PayoutItem(external_id=external_id, user_id="u1", amount_cents=amount_cents, pix_key="a@b.com")
+
+
+@pytest.fixture
+def sqlite_file(tmp_path):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return url
+
+
+def test_async_database_url_swaps_driver():
+    """Garante a troca do driver sincrono pelo assincrono equivalente."""
+    assert async_database_url("postgresql://u:p@db:5432/pix") == "postgresql+asyncpg://u:p@db:5432/pix"
+    assert async_database_url("postgresql+psycopg2://u:p@db/pix") == "postgresql+asyncpg://u:p@db/pix"
+    assert async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+
+
+def test_pool_options_follow_settings_outside_sqlite():
+    """Garante que o pool do Postgres usa as configuracoes e o SQLite apenas connect_args."""
+    assert pool_options("sqlite:///./test.db") == {"connect_args": {"check_same_thread": False}}
+
+    options = pool_options("postgresql://u:p@db/pix")
+    assert options["pool_size"] == settings.DB_POOL_SIZE
+    assert options["max_overflow"] == settings.DB_MAX_OVERFLOW
+    assert options["pool_timeout"] == settings.DB_POOL_TIMEOUT_SECONDS
+    assert options["pool_recycle"] == settings.DB_POOL_RECYCLE_SECONDS
+    assert options["pool_pre_ping"] is settings.DB_POOL_PRE_PING
+
+
+def test_async_service_settles_and_detects_duplicates(sqlite_file):
+    """O servico assincrono liquida, grava e reconhece reenvios como duplicatas."""
+    batch = PayoutBatch(batch_id="async-1", items=[_item("a-1"), _item("a-2"), _item("a-1")])
+
+    async def run():
+        engine = create_async_engine(async_database_url(sqlite_file))
+        factory = async_sessionmaker(engine, expire_on_commit=False)
+        try:
+            async with factory() as db:
+                service = AsyncPayoutService(
+                    db_session=db,
+                    provider=SimulatedProvider(success_rate=1.0),
+                    engine=SettlementEngine(max_in_flight=4, timeout_seconds=1.0),
+                )
+                first = await service.process_batch(batch)
+                second = await service.process_batch(batch)
+        finally:
+            await engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [d.status for d in first.details] == ["paid", "paid", "duplicate"]
+    assert first.successful == 2
+    assert second.duplicates == 3
+    assert second.processed == 0
+
+
+def test_batch_endpoint_uses_async_engine_when_enabled(sqlite_file):
+    """Com DB_ASYNC_ENABLED o endpoint liquida pelo engine assincrono."""
+    external_id = f"async-api-{uuid.uuid4().hex[:8]}"
+    payload = {
+        "batch_id": "async-api",
+        "items": [{"external_id": external_id, "user_id": "u1", "amount_cents": 500, "pix_key": "a@b.com"}],
+    }
+
+    with patch.object(settings, "DB_ASYNC_ENABLED", True), \
+            patch.object(settings, "ASYNC_DATABASE_URL", async_database_url(sqlite_file)), \
+            patch.object(AsyncPayoutService, "_simulate_payment", return_value=True):
+        try:
+            response = client.post("/api/v1/payouts/batch", json=payload, headers={"X-API-Key": settings.API_KEY})
+        finally:
+            asyncio.run(dispose_async_engine())
+
+    assert response.status_code == 200
+    assert response.json()["successful"] == 1
+    # O payout foi gravado no banco do engine assincrono
+    engine = create_engine(sqlite_file)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT external_id FROM payouts").scalars().all() == [external_id]
+    engine.dispose()
+    assert async_database._async_engine is None
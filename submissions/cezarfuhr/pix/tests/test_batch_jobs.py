@@ -0,0 +1,163 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import time
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from app.main import app
+from app.core.config import settings
+from app.database import Base
+from app.jobs import BatchJobRunner, job_runner
+from app.models import BatchJobDB, PayoutBatch
+from app.repository import BatchJobRepository
+from app.services import PayoutService
+
+client = TestClient(app)
+headers = {"X-API-Key": settings.API_KEY}
+
+
+def _payload(batch_id, count=3):
+    return {
+        "batch_id": batch_id,
+        "items": [
+            {"external_id": f"{batch_id}-{i}", "user_id": f"u{i}", "amount_cents": 100 * (i + 1), "pix_key": "a@a.com"}
+            for i in range(count)
+        ]
+    }
+
+
+def _wait_for_completion(batch_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/v1/payouts/batch/{batch_id}", headers=headers).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {batch_id} nao terminou em {timeout}s")
+
+
+def test_async_submission_returns_202_and_report_later():
+    """Garante que o modo assincrono responde 202 e o relatorio fica disponivel depois."""
+    batch_id = f"job-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        response = client.post("/api/v1/payouts/batch?mode=async", json=_payload(batch_id), headers=headers)
+        assert response.status_code == 202
+        accepted = response.json()
+        assert accepted["batch_id"] == batch_id
+        assert accepted["status"] == "queued"
+        assert accepted["total_items"] == 3
+
+        job = _wait_for_completion(batch_id)
+
+    assert job["status"] == "completed"
+    assert job["processed_items"] == 3
+    assert job["successful"] == 3
+    assert job["report"]["successful"] == 3
+    assert [d["status"] for d in job["report"]["details"]] == ["paid", "paid", "paid"]
+
+
+def test_async_resubmission_returns_existing_job():
+    """Garante que reenviar o mesmo batch_id nao reenfileira o lote."""
+    batch_id = f"job-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        first = client.post("/api/v1/payouts/batch?mode=async", json=_payload(batch_id), headers=headers)
+        _wait_for_completion(batch_id)
+
+        with patch('app.jobs.job_runner.submit') as submit:
+            second = client.post("/api/v1/payouts/batch?mode=async", json=_payload(batch_id), headers=headers)
+
+    assert first.status_code == 202
+    assert second.status_code == 202
+    submit.assert_not_called()
+    assert second.json()["status"] == "completed"
+    assert second.json()["duplicates"] == 0  # O relatorio e o da execucao original
+
+
+def test_get_unknown_batch_job_returns_404():
+    """Garante 404 para um batch_id nunca submetido."""
+    response = client.get(f"/api/v1/payouts/batch/missing-{uuid.uuid4().hex[:8]}", headers=headers)
+    assert response.status_code == 404
+
+
+def test_get_batch_job_requires_api_key():
+    """Garante que o status do job exige autenticacao."""
+    response = client.get("/api/v1/payouts/batch/any")
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _orphan(session_factory, batch_id, status, age_seconds):
+    """Grava um job como se o processo que o rodava tivesse caido ha `age_seconds`."""
+    db = session_factory()
+    try:
+        BatchJobRepository(db).create(PayoutBatch.model_validate(_payload(batch_id)))
+        db.execute(
+            update(BatchJobDB)
+            .where(BatchJobDB.batch_id == batch_id)
+            .values(status=status, processed_items=1, updated_at=datetime.utcnow() - timedelta(seconds=age_seconds))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_recover_resumes_orphaned_jobs_once(session_factory):
+    """Garante que jobs `queued`/`running` sem progresso sao retomados uma unica vez, e os recentes nao."""
+    _orphan(session_factory, "orphan-running", "running", age_seconds=3600)
+    _orphan(session_factory, "orphan-queued", "queued", age_seconds=3600)
+    _orphan(session_factory, "recent", "running", age_seconds=0)
+    runner = BatchJobRunner(max_workers=2, session_factory=session_factory)
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        assert sorted(runner.recover()) == ["orphan-queued", "orphan-running"]
+        assert runner.recover() == []
+        runner.shutdown()
+
+    db = session_factory()
+    jobs = BatchJobRepository(db)
+    for batch_id in ("orphan-running", "orphan-queued"):
+        job = jobs.get(batch_id)
+        assert (job.status, job.processed_items, job.successful) == ("completed", 3, 3)
+    assert jobs.get("recent").status == "running"
+    db.close()
+
+
+def test_run_skips_a_job_already_started(session_factory):
+    """Garante que o mesmo job submetido duas vezes so e processado pela primeira execucao."""
+    db = session_factory()
+    BatchJobRepository(db).create(PayoutBatch.model_validate(_payload("started")))
+    db.close()
+    runner = BatchJobRunner(max_workers=1, session_factory=session_factory)
+
+    with patch.object(PayoutService, 'process_batch') as process_batch:
+        db = session_factory()
+        BatchJobRepository(db).start("started")
+        db.close()
+        runner.run("started")
+
+    process_batch.assert_not_called()
+
+
+def test_lifespan_starts_recovery_and_shuts_the_runner_down():
+    """Garante que o startup retoma orfaos e o shutdown da API encerra o pool de jobs."""
+    with patch.object(job_runner, 'start_recovery') as start_recovery, \
+         patch.object(job_runner, 'shutdown') as shutdown:
+        with TestClient(app):
+            start_recovery.assert_called_once()
+            shutdown.assert_not_called()
+
+    shutdown.assert_called_once()
@@ -0,0 +1,121 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import uuid
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app import database
+from app.main import app
+from app.core.config import settings
+from app.services import PayoutService
+
+client = TestClient(app)
+headers = {"X-API-Key": settings.API_KEY}
+
+
+def _payload(batch_id, count=4):
+    return {
+        "batch_id": batch_id,
+        "items": [
+            {"external_id": f"{batch_id}-{i}", "user_id": f"u{i}", "amount_cents": 100 * (i + 1), "pix_key": "a@a.com"}
+            for i in range(count)
+        ]
+    }
+
+
+def _pay_even_items(item):
+    return int(item.external_id.rsplit("-", 1)[1]) % 2 == 0
+
+
+def test_batch_report_returns_counts_and_totals_per_status():
+    """Garante que o relatorio do lote traz contadores e totais por status mantidos a cada chunk."""
+    batch_id = f"report-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', side_effect=_pay_even_items):
+        assert client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers).status_code == 200
+
+    report = client.get(f"/api/v1/payouts/batches/{batch_id}/report", headers=headers).json()
+    assert report["processed"] == 4
+    assert (report["successful"], report["failed"], report["duplicates"]) == (2, 2, 0)
+    assert report["paid_amount_cents"] == 100 + 300
+    assert report["failed_amount_cents"] == 200 + 400
+    assert report["created_at"] is not None
+
+
+def test_batch_report_accumulates_resubmissions_as_duplicates():
+    """Garante que reenviar um lote soma apenas duplicatas e reprocessamentos dos que falharam."""
+    batch_id = f"report-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', side_effect=_pay_even_items):
+        client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers)
+        client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers)
+
+    report = client.get(f"/api/v1/payouts/batches/{batch_id}/report", headers=headers).json()
+    assert report["processed"] == 6
+    assert (report["successful"], report["failed"], report["duplicates"]) == (2, 4, 2)
+    assert report["duplicate_amount_cents"] == 100 + 300
+
+
+def test_batch_report_processed_matches_the_sum_of_payout_reports():
+    """Garante que `processed` do agregado segue a definicao do PayoutReport, mesmo com reenvios."""
+    batch_id = f"report-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        reports = [
+            client.post("/api/v1/payouts/batch", json=_payload(batch_id, count=2), headers=headers).json()
+            for _ in range(3)
+        ]
+
+    summary = client.get(f"/api/v1/payouts/batches/{batch_id}/report", headers=headers).json()
+    assert [report["processed"] for report in reports] == [2, 0, 0]
+    assert summary["processed"] == sum(report["processed"] for report in reports) == 2
+    assert summary["processed"] == summary["successful"] + summary["failed"]
+    assert summary["duplicates"] == 4
+
+
+def test_batch_report_does_not_scan_payouts():
+    """Garante que o relatorio e lido so de batch_summary, sem consultar a tabela payouts."""
+    batch_id = f"report-{uuid.uuid4().hex[:8]}"
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers)
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(database.engine, "before_cursor_execute", listener)
+    try:
+        response = client.get(f"/api/v1/payouts/batches/{batch_id}/report", headers=headers)
+    finally:
+        event.remove(database.engine, "before_cursor_execute", listener)
+
+    assert response.status_code == 200
+    assert statements and all("FROM payouts" not in statement for statement in statements)
+
+
+def test_batch_report_unknown_batch_returns_404():
+    """Garante 404 para um lote sem agregado."""
+    response = client.get("/api/v1/payouts/batches/nao-existe/report", headers=headers)
+    assert response.status_code == 404
+
+
+def test_batch_report_list_paginates_by_cursor():
+    """Garante que a listagem pagina por cursor sem repetir nem pular lotes."""
+    prefix = f"page-{uuid.uuid4().hex[:8]}-"
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        for index in range(3):
+            client.post("/api/v1/payouts/batch", json=_payload(f"{prefix}{index}", count=1), headers=headers)
+
+    first = client.get("/api/v1/payouts/batches", params={"limit": 2, "after": prefix}, headers=headers).json()
+    assert [item["batch_id"] for item in first["items"]] == [f"{prefix}0", f"{prefix}1"]
+    assert first["next_cursor"] == f"{prefix}1"
+
+    second = client.get(
+        "/api/v1/payouts/batches", params={"limit": 2, "after": first["next_cursor"]}, headers=headers
+    ).json()
+    assert second["items"][0]["batch_id"] == f"{prefix}2"
+    assert second["items"][0]["successful"] == 1
+
+
+def test_batch_report_requires_api_key():
+    """Garante que as consultas de relatorio exigem X-API-Key."""
+    assert client.get("/api/v1/payouts/batches").status_code == 401
@@ -0,0 +1,114 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import io
+import json
+import uuid
+import pytest
+from sqlalchemy import select
+from app.batch_runner import Checkpoint, ShardedBatchRun, shard_of
+from app.database import SessionLocal
+from app.ingestion import BatchFileError, JSONBatchFileReader
+from app.models import PayoutDB
+
+
+@pytest.fixture(autouse=True)
+def always_pay(monkeypatch):
+    """Os shards sao processos novos: o provedor simulado e configurado pelo ambiente."""
+    monkeypatch.setenv("SIMULATED_PROVIDER_SUCCESS_RATE", "1.0")
+
+
+def _write_batch(path, batch_id, ids):
+    items = [{"external_id": i, "user_id": "u1", "amount_cents": 100, "pix_key": "a@a.com"} for i in ids]
+    path.write_text(json.dumps({"batch_id": batch_id, "items": items}, indent=2))
+    return path
+
+
+def _saved(ids):
+    db = SessionLocal()
+    try:
+        return set(db.execute(select(PayoutDB.external_id).where(PayoutDB.external_id.in_(ids))).scalars())
+    finally:
+        db.close()
+
+
+def test_reader_streams_items_with_offsets_and_resumes():
+    """Garante leitura em blocos pequenos, chaves dentro de strings e retomada pelo offset."""
+    raw = (
+        b'{"batch_id": "file-1", "items": [\n'
+        b'  {"external_id": "a}{", "user_id": "u1", "amount_cents": 1, "pix_key": "k\\"}"},\n'
+        b'  {"external_id": "b", "user_id": "u1", "amount_cents": 2, "pix_key": "k"}\n'
+        b']}'
+    )
+    reader = JSONBatchFileReader(io.BytesIO(raw), read_size=7)
+    items = list(reader)
+
+    assert reader.batch_id == "file-1"
+    assert [item.external_id for _, item in items] == ["a}{", "b"]
+    assert raw[items[1][0]:].startswith(b'{"external_id": "b"')
+
+    resumed = JSONBatchFileReader(io.BytesIO(raw), batch_id="file-1", offset=items[1][0], read_size=5)
+    assert [item.external_id for _, item in resumed] == ["b"]
+
+
+@pytest.mark.parametrize("raw", [
+    b'{"items": [{"external_id": "a", "user_id": "u1", "amount_cents": 1, "pix_key": "k"}], "batch_id": "late"}',
+    b'{"batch_id": "cut", "items": [{"external_id": "a", "user_id": "u1", "amount_cents": 1, "pix_key": "k"}',
+    b'{"batch_id": "bad", "items": [{"external_id": "a", "user_id": "u1", "amount_cents": 0, "pix_key": "k"}]}',
+])
+def test_reader_rejects_invalid_files(raw):
+    """Garante erro para batch_id depois de items, arquivo truncado e item invalido."""
+    with pytest.raises(BatchFileError):
+        list(JSONBatchFileReader(io.BytesIO(raw)))
+
+
+def test_run_shards_items_and_merges_totals(tmp_path):
+    """Garante os totais do PayoutReport somados entre shards, com repeticoes colapsadas."""
+    prefix = f"run-{uuid.uuid4().hex[:8]}"
+    ids = [f"{prefix}-{i % 40}" for i in range(50)]
+    path = _write_batch(tmp_path / "batch.json", prefix, ids)
+
+    summary = ShardedBatchRun(str(path), processes=2, chunk_size=7).run()
+
+    assert summary == {"batch_id": prefix, "processed": 40, "successful": 40, "failed": 0, "duplicates": 10, "pending": 0}
+    assert len(_saved(ids)) == 40
+    assert not os.path.exists(f"{path}.checkpoint")
+
+
+def test_run_resumes_from_checkpoint_without_reprocessing_committed_items(tmp_path):
+    """Garante que a retomada parte do offset salvo e pula os itens ja persistidos de cada shard."""
+    prefix = f"resume-{uuid.uuid4().hex[:8]}"
+    ids = [f"{prefix}-{i}" for i in range(12)]
+    path = _write_batch(tmp_path / "batch.json", prefix, ids)
+    offsets = [offset for offset, _ in JSONBatchFileReader(io.BytesIO(path.read_bytes()))]
+
+    # Shard 0 persistiu os itens ate a posicao 8, shard 1 so ate a 3
+    shards = [shard_of(i, 2) for i in ids]
+    committed = [
+        max([seq for seq in range(9) if shards[seq] == 0], default=-1),
+        max([seq for seq in range(4) if shards[seq] == 1], default=-1),
+    ]
+    skipped = [i for seq, i in enumerate(ids) if seq <= committed[shards[seq]]]
+    watermark = min(seq for seq in range(len(ids)) if seq > committed[shards[seq]])
+    Checkpoint(
+        path=str(path), size=path.stat().st_size, batch_id=prefix, shards=2,
+        offset=offsets[watermark], seq=watermark, committed=committed, counts={"paid": len(skipped)},
+    ).save(f"{path}.checkpoint")
+
+    summary = ShardedBatchRun(str(path), processes=2, chunk_size=3).run()
+
+    assert summary["successful"] == 12 and summary["duplicates"] == 0
+    # Os itens "ja persistidos" nao voltaram ao banco nem ao provedor
+    assert _saved(ids) == set(ids) - set(skipped)
+
+
+def test_run_rejects_checkpoint_from_another_shard_count(tmp_path):
+    """Garante que um checkpoint de outra configuracao nao e aplicado."""
+    path = _write_batch(tmp_path / "batch.json", "other", ["x-1"])
+    Checkpoint(
+        path=str(path), size=path.stat().st_size, batch_id="other", shards=4,
+        offset=0, seq=0, committed=[-1] * 4,
+    ).save(f"{path}.checkpoint")
+
+    with pytest.raises(BatchFileError):
+        ShardedBatchRun(str(path), processes=2).run()
@@ -0,0 +1,35 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import gc
+
+import pytest
+from app.core.config import settings
+from app.core.gc_config import configure_gc
+
+
+@pytest.fixture
+def restore_threshold():
+    original = gc.get_threshold()
+    yield
+    gc.set_threshold(*original)
+
+
+def test_gc_threshold_is_opt_in(restore_threshold, monkeypatch):
+    """Garante que sem GC_GEN0_THRESHOLD o limiar do interpretador fica intacto."""
+    monkeypatch.setattr(settings, "GC_GEN0_THRESHOLD", None)
+    before = gc.get_threshold()
+
+    configure_gc()
+
+    assert gc.get_threshold() == before
+
+
+def test_configured_gc_threshold_only_changes_generation_zero(restore_threshold, monkeypatch):
+    """Garante que o limiar configurado vale so para a geracao 0."""
+    monkeypatch.setattr(settings, "GC_GEN0_THRESHOLD", 5_000)
+    _, gen1, gen2 = gc.get_threshold()
+
+    configure_gc()
+
+    assert gc.get_threshold() == (5_000, gen1, gen2)
@@ -0,0 +1,157 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import threading
+import time
+import uuid
+import httpx
+from fastapi.testclient import TestClient
+from app.database import SessionLocal
+from app.http_provider import CircuitBreaker, HTTPProvider
+from app.mock_provider import PROFILES, create_app
+from app.models import PayoutBatch, PayoutDB, PayoutItem
+from app.services import PayoutService
+from app.settlement import is_unknown
+
+
+def _item(external_id="http-1"):
+    return PayoutItem(external_id=external_id, user_id="u1", amount_cents=100, pix_key="a@a.com")
+
+
+def _provider(handler, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(window=10, min_calls=4, error_rate=0.5, open_seconds=60))
+    return HTTPProvider("http://provider.test", transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_breaker_opens_on_error_rate_and_probes_after_cooldown():
+    """Garante abertura pela taxa de erro, uma unica chamada de teste e fechamento apos sucesso."""
+    now = [0.0]
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, open_seconds=10, clock=lambda: now[0])
+
+    for success in (True, False, True):
+        breaker.record(success)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] = 10
+    assert breaker.allow() and not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_paid_rejected_and_errors():
+    """Garante referencia no pagamento, recusa 4xx sem afetar o breaker e 5xx/429 como erro."""
+    responses = iter([
+        httpx.Response(200, json={"status": "paid", "reference": "ref-1"}),
+        httpx.Response(422, json={"status": "rejected"}),
+        httpx.Response(429),
+        httpx.Response(503),
+    ])
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return next(responses)
+
+    provider = _provider(handler, api_key="secret")
+    results = [provider.pay(_item()) for _ in range(4)]
+
+    assert [(r.ok, r.reference) for r in results] == [(True, "ref-1"), (False, None), (False, None), (False, None)]
+    assert requests[0].headers["Idempotency-Key"] == "http-1"
+    assert requests[0].headers["Authorization"] == "Bearer secret"
+    assert b'"pix_key":"a@a.com"' in requests[0].content.replace(b" ", b"")
+    assert provider.breaker.state == "open"
+
+
+def test_open_breaker_fails_fast_without_network():
+    """Garante que, com o provedor fora do ar, o breaker corta as chamadas seguintes."""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    provider = _provider(handler)
+    results = [provider.pay(_item(f"down-{i}")) for i in range(20)]
+
+    assert not any(results)
+    assert len(calls) == 4
+
+
+def test_read_timeout_is_unknown_and_connect_error_is_a_failure():
+    """Garante que um timeout depois do envio vira UNKNOWN, e um erro de conexao continua falha definitiva."""
+    errors = iter([
+        httpx.ReadTimeout("read timed out"),
+        httpx.WriteTimeout("write timed out"),
+        httpx.ConnectTimeout("connect timed out"),
+        httpx.ConnectError("connection refused"),
+    ])
+
+    def handler(request):
+        raise next(errors)
+
+    provider = _provider(handler)
+    results = [provider.pay(_item(f"timeout-{i}")) for i in range(4)]
+
+    assert [is_unknown(result) for result in results] == [True, True, False, False]
+    assert not any(results)
+
+
+def test_concurrency_cap_per_host():
+    """Garante que nunca ha mais chamadas simultaneas no host do que PROVIDER_MAX_CONCURRENCY_PER_HOST."""
+    lock = threading.Lock()
+    current, peak = [0], [0]
+
+    def handler(request):
+        with lock:
+            current[0] += 1
+            peak[0] = max(peak[0], current[0])
+        time.sleep(0.02)
+        with lock:
+            current[0] -= 1
+        return httpx.Response(200, json={"status": "paid", "reference": "r"})
+
+    provider = _provider(handler, max_concurrency=3)
+    threads = [threading.Thread(target=provider.pay, args=(_item(f"cap-{i}"),)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 3
+
+
+def test_mock_provider_profiles_and_idempotency():
+    """Garante que o provedor local respeita o Idempotency-Key e troca de perfil em execucao."""
+    client = TestClient(create_app(PROFILES["healthy"].model_copy(update={"latency_ms": 0, "jitter_ms": 0, "reject_rate": 0})))
+    payment = {"external_id": "mock-1", "user_id": "u1", "amount_cents": 100, "pix_key": "a@a.com"}
+
+    first = client.post("/payments", json=payment, headers={"Idempotency-Key": "mock-1"}).json()
+    again = client.post("/payments", json=payment, headers={"Idempotency-Key": "mock-1"}).json()
+    assert first["status"] == "paid" and again == first
+
+    assert client.put("/profile", json={"name": "outage"}).json()["error_rate"] == 1.0
+    assert client.post("/payments", json={**payment, "external_id": "mock-2"}).status_code == 503
+
+
+def test_service_saves_provider_reference():
+    """Garante que a referencia devolvida pelo provedor HTTP e gravada no payout."""
+    batch_id = f"http-{uuid.uuid4().hex[:8]}"
+    provider = _provider(lambda request: httpx.Response(200, json={"status": "paid", "reference": f"ref-{batch_id}"}))
+    db = SessionLocal()
+    try:
+        report = PayoutService(db_session=db, provider=provider).process_batch(
+            PayoutBatch(batch_id=batch_id, items=[_item(f"{batch_id}-0")])
+        )
+        saved = db.query(PayoutDB).filter(PayoutDB.external_id == f"{batch_id}-0").one()
+    finally:
+        db.close()
+
+    assert report.successful == 1
+    assert saved.provider_reference == f"ref-{batch_id}"
@@ -0,0 +1,73 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.idempotency_cache import LRU_ENTRY_BYTES, IdempotencyCache
+from app.models import PayoutItem, PayoutRecord
+from app.repository import PayoutRepository
+
+
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _statements(session):
+    statements = []
+
+    @event.listens_for(session.get_bind(), "before_cursor_execute")
+    def _collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    return statements
+
+
+def _item(external_id):
+    return PayoutItem(external_id=external_id, user_id="u1", amount_cents=100, pix_key="a@b.com")
+
+
+def test_lru_respects_capacity():
+    """Garante que o LRU descarta os ids mais antigos ao exceder o orcamento."""
+    cache = IdempotencyCache(memory_bytes=4 * LRU_ENTRY_BYTES)
+    cache.add([f"id-{i}" for i in range(10)])
+
+    assert cache.stats()["lru_size"] == 4
+    known, unknown = cache.partition(["id-9", "id-0"])
+    assert known == {"id-9"}
+    assert unknown == ["id-0"]
+
+
+def test_cache_learns_paid_ids_and_reserve_skips_them(db_session):
+    """Garante que ids recem-pagos passam a responder do LRU, sem nenhum statement na reserva seguinte."""
+    cache = IdempotencyCache(memory_bytes=64 * 1024)
+    repository = PayoutRepository(db_session, cache=cache)
+    repository.reserve([_item("fresh-1"), _item("fresh-2")], batch_id="b1")
+    repository.complete_reservations(
+        [PayoutRecord(external_id="fresh-1", status="paid", amount_cents=100, batch_id="b1")], ["fresh-2"],
+    )
+    statements = _statements(db_session)
+
+    assert repository.reserve([_item("fresh-1")], batch_id="b2") == set()
+    assert statements == []
+    # Uma falha nunca entra no LRU: o id volta a disputa pela reserva
+    assert repository.reserve([_item("fresh-2")], batch_id="b2") == {"fresh-2"}
+
+
+def test_reserve_skips_known_paid_ids_and_counts_misses(db_session):
+    """Garante que a reserva pula os ids do LRU e conta como miss os que vao ao banco."""
+    cache = IdempotencyCache(memory_bytes=64 * 1024)
+    cache.add(["paid-1"])
+    repository = PayoutRepository(db_session, cache=cache)
+    items = [_item("paid-1"), _item("new-1")]
+
+    assert repository.reserve(items, batch_id="b1") == {"new-1"}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
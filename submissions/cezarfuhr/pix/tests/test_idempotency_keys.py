@@ -0,0 +1,145 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import threading
+import time
+import uuid
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app import database
+from app.main import app
+from app.core.config import settings
+from app.repository import BatchResponseRepository
+from app.services import PayoutService
+
+client = TestClient(app)
+headers = {"X-API-Key": settings.API_KEY}
+
+
+def _payload(batch_id, count=3):
+    return {
+        "batch_id": batch_id,
+        "items": [
+            {"external_id": f"{batch_id}-{i}", "user_id": "u1", "amount_cents": 100 + i, "pix_key": "a@a.com"}
+            for i in range(count)
+        ]
+    }
+
+
+def _with_key(key):
+    return {**headers, "Idempotency-Key": key}
+
+
+def test_replay_returns_first_report_byte_for_byte_with_one_lookup():
+    """Garante que o replay devolve o relatorio original (paid) com uma unica leitura, sem payouts nem provedor."""
+    batch_id = f"idem-{uuid.uuid4().hex[:8]}"
+    key = uuid.uuid4().hex
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        first = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key))
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(database.engine, "before_cursor_execute", listener)
+    try:
+        with patch.object(PayoutService, '_simulate_payment') as provider:
+            replay = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key))
+    finally:
+        event.remove(database.engine, "before_cursor_execute", listener)
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.content == first.content
+    assert replay.json()["successful"] == 3 and replay.json()["duplicates"] == 0
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    provider.assert_not_called()
+    assert len(statements) == 1 and "batch_responses" in statements[0]
+
+
+def test_key_reused_with_different_body_is_rejected():
+    """Garante 422 quando a mesma chave chega com outro corpo."""
+    batch_id = f"idem-{uuid.uuid4().hex[:8]}"
+    key = uuid.uuid4().hex
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key))
+        response = client.post("/api/v1/payouts/batch", json=_payload(batch_id, count=2), headers=_with_key(key))
+
+    assert response.status_code == 422
+
+
+def test_concurrent_replay_waits_for_first_execution():
+    """Garante que um replay em voo espera a primeira execucao e o provedor e chamado uma vez por item."""
+    batch_id = f"idem-{uuid.uuid4().hex[:8]}"
+    key = uuid.uuid4().hex
+    calls = []
+
+    def slow_payment(item):
+        calls.append(item.external_id)
+        time.sleep(0.1)
+        return True
+
+    responses = [None, None]
+
+    def post(index):
+        responses[index] = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key))
+
+    with patch.object(PayoutService, '_simulate_payment', side_effect=slow_payment):
+        threads = [threading.Thread(target=post, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+    assert sorted(calls) == [f"{batch_id}-{i}" for i in range(3)]
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].content == responses[1].content
+    assert responses[1].headers.get("Idempotent-Replayed") == "true"
+
+
+def test_failed_execution_releases_key():
+    """Garante que um erro na primeira execucao libera a chave para uma nova tentativa."""
+    batch_id = f"idem-{uuid.uuid4().hex[:8]}"
+    key = uuid.uuid4().hex
+    failing_client = TestClient(app, raise_server_exceptions=False)
+
+    with patch.object(PayoutService, 'process_batch', side_effect=RuntimeError("db down")):
+        assert failing_client.post(
+            "/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key)
+        ).status_code == 500
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        response = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=_with_key(key))
+    assert response.status_code == 200
+    assert response.json()["successful"] == 3
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_batch_id_keying_replays_without_header(monkeypatch):
+    """Garante que, com IDEMPOTENCY_KEY_FROM_BATCH_ID, o reenvio do lote devolve o relatorio original."""
+    monkeypatch.setattr(settings, "IDEMPOTENCY_KEY_FROM_BATCH_ID", True)
+    batch_id = f"idem-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        first = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers)
+        replay = client.post("/api/v1/payouts/batch", json=_payload(batch_id), headers=headers)
+
+    assert replay.content == first.content
+    assert replay.json()["duplicates"] == 0
+
+
+def test_expired_lease_can_be_taken_over():
+    """Garante que uma execucao abandonada (lease vencido) pode ser assumida por outra requisicao."""
+    key = uuid.uuid4().hex
+    db = database.SessionLocal()
+    try:
+        responses = BatchResponseRepository(db)
+        assert responses.claim(key, "b", "hash", "dead-worker", lease_seconds=-1)
+        assert not responses.claim(key, "b", "other-hash", "worker", lease_seconds=60)
+        assert responses.claim(key, "b", "hash", "worker", lease_seconds=60)
+
+        responses.complete(key, "worker", b'{"ok": true}')
+        assert BatchResponseRepository.decode(responses.get(key)) == b'{"ok": true}'
+    finally:
+        db.close()
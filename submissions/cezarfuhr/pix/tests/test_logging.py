@@ -0,0 +1,68 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import io
+import json
+import logging
+import sys
+from unittest.mock import patch
+
+from app.core import logging_config
+from app.core.config import settings
+from app.core.logging_config import JSONFormatter, configure_logging
+from app.models import PayoutItem
+from app.settlement import SettlementEngine
+
+
+def _record(**extra):
+    record = logging.LogRecord("app.test", logging.INFO, __file__, 10, "hello %s", ("world",), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_formatter_keeps_extras_and_drops_reserved_attributes():
+    """Garante que apenas os campos de `extra` entram no JSON, alem dos campos base."""
+    entry = json.loads(JSONFormatter().format(_record(batch_id="b-1", event="batch_start")))
+
+    assert entry["message"] == "hello world"
+    assert entry["batch_id"] == "b-1"
+    assert entry["event"] == "batch_start"
+    for reserved in ("msg", "args", "pathname", "thread", "processName"):
+        assert reserved not in entry
+
+
+def test_queue_mode_writes_from_listener_thread():
+    """No modo assincrono o registro chega ao stdout pela thread do listener."""
+    stdout = io.StringIO()
+    try:
+        with patch.object(sys, "stdout", stdout), patch.object(settings, "LOG_ASYNC", True):
+            configure_logging()
+            assert isinstance(logging.getLogger().handlers[0], logging_config.DeferredQueueHandler)
+            logging.getLogger("app.test").info("queued %d", 1, extra={"event": "queued"})
+            # Parar o listener esvazia a fila
+            logging_config._stop_listener()
+    finally:
+        configure_logging()
+
+    entry = json.loads(stdout.getvalue().strip())
+    assert entry["message"] == "queued 1"
+    assert entry["event"] == "queued"
+
+
+def test_item_events_are_sampled(caplog):
+    """Com LOG_ITEM_SAMPLE_RATE=0 os erros por item nao sao logados (mas continuam como falha)."""
+    items = [PayoutItem(external_id=f"s-{i}", user_id="u1", amount_cents=100, pix_key="a@b.com") for i in range(5)]
+
+    def boom(item):
+        raise RuntimeError("provider down")
+
+    engine = SettlementEngine(max_in_flight=2, timeout_seconds=1.0)
+    with patch.object(settings, "LOG_ITEM_SAMPLE_RATE", 0.0), caplog.at_level(logging.WARNING):
+        assert engine.settle_all(items, boom) == [False] * 5
+    assert not [r for r in caplog.records if getattr(r, "event", None) == "settlement_error"]
+
+    with caplog.at_level(logging.WARNING):
+        engine.settle_all(items[:1], boom)
+    errors = [r for r in caplog.records if getattr(r, "event", None) == "settlement_error"]
+    assert len(errors) == 1
+    assert errors[0].sample_rate == 1.0
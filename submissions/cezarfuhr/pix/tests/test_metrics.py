@@ -0,0 +1,87 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import uuid
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.config import settings
+from app.metrics import ITEMS_TOTAL, RATE_LIMIT_REJECTIONS, STAGE_DURATION, MetricsRegistry
+from app.services import PayoutService
+
+client = TestClient(app)
+
+
+def test_histogram_exposes_cumulative_buckets():
+    """Garante o formato de exposicao do Prometheus para histogramas."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("op_seconds", "Duracao", labelnames=("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(2.0, stage="a")
+
+    text = registry.expose()
+    assert "# TYPE op_seconds histogram" in text
+    assert 'op_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'op_seconds_bucket{stage="a",le="1.0"} 2' in text
+    assert 'op_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'op_seconds_count{stage="a"} 3' in text
+    assert 'op_seconds_sum{stage="a"} 2.55' in text
+
+
+def test_batch_records_stage_timings_and_outcomes():
+    """Um lote alimenta os histogramas de cada etapa e os contadores por status."""
+    stages = ("reservation", "settlement", "persistence", "serialization")
+    before = {stage: STAGE_DURATION.count(stage=stage) for stage in stages}
+    paid_before = ITEMS_TOTAL.value(status="paid")
+
+    external_id = f"metrics-{uuid.uuid4().hex[:8]}"
+    payload = {
+        "batch_id": "metrics-1",
+        "items": [{"external_id": external_id, "user_id": "u1", "amount_cents": 100, "pix_key": "a@b.com"}],
+    }
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        response = client.post("/api/v1/payouts/batch", json=payload, headers={"X-API-Key": settings.API_KEY})
+
+    assert response.status_code == 200
+    assert response.json()["successful"] == 1
+    for stage in stages:
+        assert STAGE_DURATION.count(stage=stage) == before[stage] + 1
+    assert ITEMS_TOTAL.value(status="paid") == paid_before + 1
+
+
+def test_metrics_endpoint_exposes_registry():
+    """Garante que /metrics responde no formato texto com as metricas principais."""
+    response = client.get("/metrics", headers={"X-API-Key": settings.API_KEY})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    for name in ("payout_stage_duration_seconds", "payout_items_total", "payout_batches_in_flight",
+                 "rate_limit_rejections_total", "db_pool_checked_out"):
+        assert f"# TYPE {name}" in response.text
+
+
+def test_metrics_endpoint_requires_a_key(monkeypatch):
+    """Garante que /metrics recusa requisicoes sem chave e aceita a chave propria do scraper via Bearer."""
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"X-API-Key": "wrong"}).status_code == 401
+
+    monkeypatch.setattr(settings, "METRICS_API_KEY", "scraper-key")
+    assert client.get("/metrics", headers={"Authorization": "Bearer scraper-key"}).status_code == 200
+    assert client.get("/metrics", headers={"X-API-Key": settings.API_KEY}).status_code == 401
+
+
+def test_rate_limit_rejections_are_counted():
+    """Cada 429 do rate limiter incrementa o contador de rejeicoes."""
+    before = RATE_LIMIT_REJECTIONS.value()
+    payload = {
+        "batch_id": "metrics-rl",
+        "items": [{"external_id": "metrics-rl-1", "user_id": "u1", "amount_cents": 100, "pix_key": "a@b.com"}],
+    }
+    for _ in range(6):
+        response = client.post("/api/v1/payouts/batch", json=payload, headers={"X-API-Key": settings.API_KEY})
+
+    assert response.status_code == 429
+    assert RATE_LIMIT_REJECTIONS.value() == before + 1
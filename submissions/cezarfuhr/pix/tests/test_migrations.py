@@ -0,0 +1,37 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+from sqlalchemy import create_engine, inspect
+
+from app.migrations import migrate
+
+
+def test_migrate_creates_schema_and_is_idempotent(tmp_path):
+    """Um banco vazio recebe todas as tabelas; rodar de novo nao altera nada."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+
+    assert migrate(engine) == []
+    assert {"payouts", "batch_jobs", "payout_jobs", "rate_limit_buckets"} <= set(inspect(engine).get_table_names())
+    assert migrate(engine) == []
+    engine.dispose()
+
+
+def test_migrate_adds_new_columns_and_indexes_to_existing_tables(tmp_path):
+    """Tabelas criadas por versoes antigas ganham as colunas anulaveis e os indices novos."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE batch_jobs (id INTEGER PRIMARY KEY, batch_id VARCHAR NOT NULL UNIQUE, "
+            "status VARCHAR NOT NULL, total_items INTEGER NOT NULL, processed_items INTEGER NOT NULL, "
+            "successful INTEGER NOT NULL, failed INTEGER NOT NULL, duplicates INTEGER NOT NULL, "
+            "report TEXT, created_at DATETIME, updated_at DATETIME)"
+        )
+
+    changes = migrate(engine)
+
+    assert "add column batch_jobs.payload" in changes
+    assert "create index ix_batch_jobs_batch_id" in changes
+    columns = {column["name"] for column in inspect(engine).get_columns("batch_jobs")}
+    assert "payload" in columns
+    assert migrate(engine) == []
+    engine.dispose()
@@ -0,0 +1,168 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import io
+import json
+import uuid
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.cli import ingest_ndjson
+from app.ingestion import NDJSONBatchParser, NDJSONIngestionError, NDJSONLineTooLong
+from app.services import PayoutService
+
+client = TestClient(app)
+headers = {"X-API-Key": settings.API_KEY, "Content-Type": "application/x-ndjson"}
+
+
+def _ndjson(batch_id, count, prefix=None):
+    prefix = prefix or batch_id
+    lines = [json.dumps({"batch_id": batch_id})]
+    lines += [
+        json.dumps({"external_id": f"{prefix}-{i}", "user_id": "u1", "amount_cents": 100 + i, "pix_key": "a@a.com"})
+        for i in range(count)
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_parser_yields_fixed_size_chunks_across_arbitrary_splits():
+    """Garante chunks de tamanho fixo mesmo com linhas quebradas entre leituras."""
+    body = _ndjson("split", 7)
+    parser = NDJSONBatchParser(chunk_size=3)
+
+    chunks = []
+    for i in range(0, len(body), 5):
+        chunks.extend(parser.feed(body[i:i + 5]))
+    chunks.extend(parser.close())
+
+    assert parser.batch_id == "split"
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [item.external_id for chunk in chunks for item in chunk] == [f"split-{i}" for i in range(7)]
+
+
+def test_parser_dispatches_chunk_before_end_of_input():
+    """Garante que o primeiro chunk sai assim que completo, antes do fim do upload."""
+    body = _ndjson("early", 1000)
+    parser = NDJSONBatchParser(chunk_size=10)
+
+    first_ready = parser.feed(body[:2000])
+
+    assert len(first_ready) >= 1
+    assert len(first_ready[0]) == 10
+
+
+def test_parser_reports_invalid_line_number():
+    """Garante que uma linha invalida e reportada com o numero da linha."""
+    body = _ndjson("bad", 2) + b'{"external_id": "x", "user_id": "u1", "amount_cents": -1, "pix_key": "k"}\n'
+    parser = NDJSONBatchParser(chunk_size=10)
+
+    with pytest.raises(NDJSONIngestionError) as exc_info:
+        parser.feed(body)
+
+    assert exc_info.value.line_number == 4
+    assert "amount_cents" in exc_info.value.message
+
+
+def test_parser_rejects_repeated_id_with_different_amount():
+    """Garante que um id repetido com outro valor no mesmo chunk e rejeitado na linha da repeticao."""
+    body = _ndjson("conflict", 2) + b'{"external_id": "conflict-0", "user_id": "u1", "amount_cents": 999, "pix_key": "k"}\n'
+    parser = NDJSONBatchParser(chunk_size=10)
+
+    with pytest.raises(NDJSONIngestionError) as exc_info:
+        parser.feed(body)
+
+    assert exc_info.value.line_number == 4
+    assert "conflict-0" in exc_info.value.message
+
+
+def test_parser_requires_header_and_items():
+    """Garante que um corpo sem itens e rejeitado."""
+    parser = NDJSONBatchParser(chunk_size=10)
+    parser.feed(b'{"batch_id": "empty"}\n')
+
+    with pytest.raises(NDJSONIngestionError, match="at least 1 item"):
+        parser.close()
+
+
+def test_ndjson_endpoint_processes_batch():
+    """Testa a ingestao NDJSON ponta a ponta."""
+    batch_id = f"nd-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        response = client.post("/api/v1/payouts/batch/ndjson", content=_ndjson(batch_id, 5), headers=headers)
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["batch_id"] == batch_id
+    assert report["successful"] == 5
+    assert [d["external_id"] for d in report["details"]] == [f"{batch_id}-{i}" for i in range(5)]
+
+
+def test_ndjson_endpoint_rejects_other_content_types():
+    """Garante 415 quando o corpo nao e NDJSON."""
+    response = client.post(
+        "/api/v1/payouts/batch/ndjson",
+        json={"batch_id": "x"},
+        headers={"X-API-Key": settings.API_KEY},
+    )
+    assert response.status_code == 415
+
+
+def test_ndjson_endpoint_returns_422_with_line_on_invalid_item():
+    """Garante 422 indicando a linha invalida."""
+    body = b'{"batch_id": "bad"}\n{"external_id": "", "user_id": "u1", "amount_cents": 1, "pix_key": "k"}\n'
+    response = client.post("/api/v1/payouts/batch/ndjson", content=body, headers=headers)
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["line"] == 2
+
+
+def test_parser_rejects_line_without_newline_beyond_limit():
+    """Garante que uma linha sem quebra nao cresce o buffer alem de max_line_bytes."""
+    parser = NDJSONBatchParser(chunk_size=10, max_line_bytes=100)
+    parser.feed(b'{"batch_id": "long"}\n')
+
+    with pytest.raises(NDJSONLineTooLong) as exc_info:
+        for _ in range(10):
+            parser.feed(b"x" * 30)
+
+    assert exc_info.value.line_number == 2
+    assert len(parser._buffer) <= 130
+
+
+def test_ndjson_endpoint_returns_413_on_oversized_line():
+    """Garante 413 para uma linha maior que o limite do parser."""
+    body = b'{"batch_id": "huge"}\n' + b"x" * (64 * 1024 + 1)
+    response = client.post("/api/v1/payouts/batch/ndjson", content=body, headers=headers)
+
+    assert response.status_code == 413
+    assert response.json()["detail"]["line"] == 2
+
+
+def test_ndjson_report_caps_details_but_keeps_counters():
+    """Garante no maximo NDJSON_REPORT_MAX_DETAILS detalhes, com os contadores completos."""
+    batch_id = f"cap-{uuid.uuid4().hex[:8]}"
+    with patch.object(settings, "NDJSON_REPORT_MAX_DETAILS", 3), \
+            patch.object(settings, "NDJSON_CHUNK_SIZE", 2), \
+            patch.object(PayoutService, "_simulate_payment", return_value=True):
+        response = client.post("/api/v1/payouts/batch/ndjson", content=_ndjson(batch_id, 5), headers=headers)
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["successful"] == 5
+    assert [d["external_id"] for d in report["details"]] == [f"{batch_id}-{i}" for i in range(3)]
+    assert response.headers["X-Report-Details-Truncated"] == "true"
+
+
+def test_cli_ingest_returns_totals():
+    """Testa o comando de ingestao NDJSON da linha de comando."""
+    batch_id = f"cli-{uuid.uuid4().hex[:8]}"
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        summary = ingest_ndjson(io.BytesIO(_ndjson(batch_id, 12)), chunk_size=5)
+
+    assert summary == {
+        "batch_id": batch_id, "processed": 12, "successful": 12, "failed": 0, "duplicates": 0, "pending": 0,
+    }
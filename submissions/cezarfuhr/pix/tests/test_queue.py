@@ -0,0 +1,175 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, SessionLocal
+from app.main import app
+from app.core.config import settings
+from app.models import PayoutBatch, PayoutDB, PayoutItem, PayoutJobDB
+from app.repository import BatchJobRepository, PayoutQueueRepository, PayoutRepository
+from app.services import PayoutService
+from app.worker import QueueWorker
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Banco SQLite em arquivo, compartilhado entre as sessoes do teste."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _batch(batch_id, count):
+    return PayoutBatch(
+        batch_id=batch_id,
+        items=[
+            PayoutItem(external_id=f"{batch_id}-{i}", user_id="u1", amount_cents=100 + i, pix_key="a@a.com")
+            for i in range(count)
+        ],
+    )
+
+
+def _submit(session_factory, batch):
+    db = session_factory()
+    BatchJobRepository(db).create(batch, enqueue=PayoutQueueRepository(db).enqueue)
+    db.close()
+
+
+def test_claims_are_disjoint_and_in_order(session_factory):
+    """Garante que claims consecutivos pegam itens diferentes, na ordem de insercao."""
+    _submit(session_factory, _batch("claim", 5))
+    db = session_factory()
+    queue = PayoutQueueRepository(db)
+
+    first = queue.claim("worker-a", limit=3, lease_seconds=60)
+    second = queue.claim("worker-b", limit=3, lease_seconds=60)
+    third = queue.claim("worker-c", limit=3, lease_seconds=60)
+
+    assert [job.position for job in first] == [0, 1, 2]
+    assert [job.position for job in second] == [3, 4]
+    assert third == []
+    db.close()
+
+
+def test_expired_lease_is_reclaimed_and_stale_ack_ignored(session_factory):
+    """Garante que um lease abandonado volta para a fila e o ack do dono antigo e ignorado."""
+    _submit(session_factory, _batch("lease", 2))
+    db = session_factory()
+    queue = PayoutQueueRepository(db)
+
+    abandoned = queue.claim("dead-worker", limit=2, lease_seconds=60)
+    assert queue.claim("live-worker", limit=2, lease_seconds=60) == []
+
+    # Simula o vencimento do lease do worker que morreu
+    db.execute(update(PayoutJobDB).values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.commit()
+
+    reclaimed = queue.claim("live-worker", limit=2, lease_seconds=60)
+    assert [job.id for job in reclaimed] == [job.id for job in abandoned]
+    assert all(job.attempts == 2 for job in reclaimed)
+
+    assert queue.ack("dead-worker", {job.id: "paid" for job in abandoned}) == {}
+    acked = queue.ack("live-worker", {job.id: "paid" for job in reclaimed})
+    assert acked == {"lease": {"paid": 2}}
+    db.close()
+
+
+def test_worker_drains_queue_and_completes_batch_job(session_factory):
+    """Garante que o worker liquida todos os itens e finaliza o job com o relatorio."""
+    _submit(session_factory, _batch("drain", 7))
+    worker = QueueWorker(session_factory=session_factory, chunk_size=3, lease_seconds=60)
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        processed = worker.run(drain=True)
+
+    db = session_factory()
+    job = BatchJobRepository(db).get("drain")
+    assert processed == 7
+    assert job.status == "completed"
+    assert job.processed_items == 7
+    assert job.successful == 7
+    statuses = db.execute(select(PayoutJobDB.status)).scalars().all()
+    assert set(statuses) == {"done"}
+    db.close()
+
+
+def test_worker_resumes_reservations_left_by_a_crashed_worker(session_factory):
+    """
+    Garante que, depois que um worker cai entre a reserva e o pagamento, o
+    worker que retoma o lease liquida os itens em vez de reporta-los como
+    `duplicate`, mesmo com a reserva ainda longe de vencer.
+    """
+    batch = _batch("crash", 3)
+    _submit(session_factory, batch)
+    db = session_factory()
+    PayoutQueueRepository(db).claim("dead-worker", limit=3, lease_seconds=60)
+    PayoutRepository(db, cache=None).reserve(
+        batch.items, batch.batch_id, owner=BatchJobRepository.reservation_owner(batch.batch_id)
+    )
+    db.execute(update(PayoutJobDB).values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.commit()
+    db.close()
+
+    worker = QueueWorker(session_factory=session_factory, chunk_size=3, lease_seconds=60)
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        assert worker.run(drain=True) == 3
+
+    db = session_factory()
+    job = BatchJobRepository(db).get("crash")
+    assert (job.status, job.successful, job.duplicates) == ("completed", 3, 0)
+    assert set(db.execute(select(PayoutDB.status)).scalars()) == {"paid"}
+    db.close()
+
+
+def test_enqueue_resolves_repeated_ids_as_duplicates(session_factory):
+    """Garante um unico job por external_id do lote: as repeticoes ja entram `duplicate` e contadas no job."""
+    batch = _batch("repeat", 2)
+    batch.items.extend(item.model_copy() for item in list(batch.items))
+    _submit(session_factory, batch)
+
+    worker = QueueWorker(session_factory=session_factory, chunk_size=1, lease_seconds=60)
+    with patch.object(PayoutService, '_simulate_payment', return_value=True) as pay:
+        assert worker.run(drain=True) == 2
+
+    assert pay.call_count == 2
+    db = session_factory()
+    job = BatchJobRepository(db).get("repeat")
+    assert (job.status, job.processed_items, job.successful, job.duplicates) == ("completed", 4, 2, 2)
+    report = PayoutQueueRepository(db).build_report("repeat")
+    assert [detail.status for detail in report.details] == ["paid", "paid", "duplicate", "duplicate"]
+    db.close()
+
+
+def test_api_enqueues_batch_when_backend_is_queue():
+    """Garante que, com o backend de fila, a API apenas grava os itens em payout_jobs."""
+    client = TestClient(app)
+    headers = {"X-API-Key": settings.API_KEY}
+    batch_id = f"queue-{uuid.uuid4().hex[:8]}"
+    payload = {
+        "batch_id": batch_id,
+        "items": [
+            {"external_id": f"{batch_id}-{i}", "user_id": "u1", "amount_cents": 100, "pix_key": "a@a.com"}
+            for i in range(3)
+        ],
+    }
+
+    with patch('app.jobs.settings.BATCH_EXECUTION_BACKEND', "queue"), \
+         patch('app.jobs.job_runner.submit') as submit:
+        response = client.post("/api/v1/payouts/batch?mode=async", json=payload, headers=headers)
+
+    assert response.status_code == 202
+    submit.assert_not_called()
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        QueueWorker(session_factory=SessionLocal).run(drain=True)
+
+    job = client.get(f"/api/v1/payouts/batch/{batch_id}", headers=headers).json()
+    assert job["status"] == "completed"
+    assert [d["status"] for d in job["report"]["details"]] == ["paid", "paid", "paid"]
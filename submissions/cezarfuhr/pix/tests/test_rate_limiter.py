@@ -1,9 +1,21 @@
 import os
 os.environ['API_KEY'] = 'test-key'
 
+import time
+from unittest.mock import patch
+
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
 from app.main import app
 from app.core.config import settings
+from app.database import Base
+from app.limiter import (
+    DatabaseBucketStore, MemoryBucketStore, RateLimiter, RateLimitExceeded, RedisBucketStore, take_tokens
+)
+from app.services import PayoutService
 
 # E preciso instanciar o cliente com um IP base para o teste
 client = TestClient(app, base_url="http://testserver.local")
@@ -28,3 +40,155 @@ def test_rate_limit_is_enforced():
     response = client.post("/api/v1/payouts/batch", json=payload, headers=headers)
     assert response.status_code == 429
     assert "Rate limit exceeded" in response.json()["detail"]
+
+
+def _request(api_key=None):
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    return Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 1234)})
+
+
+def _batch(prefix, size):
+    return {
+        "batch_id": prefix,
+        "items": [
+            {"external_id": f"{prefix}-{i}", "user_id": "u1", "amount_cents": 100, "pix_key": "a@b.com"}
+            for i in range(size)
+        ]
+    }
+
+
+def test_limits_are_keyed_by_api_key():
+    """Chaves diferentes atras do mesmo IP tem quotas independentes."""
+    limiter = RateLimiter(MemoryBucketStore)
+    with patch.object(settings, "RATE_LIMIT_REQUESTS_PER_MINUTE", 2):
+        for _ in range(2):
+            limiter.hit(_request("key-a"))
+        with pytest.raises(RateLimitExceeded):
+            limiter.hit(_request("key-a"))
+        limiter.hit(_request("key-b"))
+
+
+def test_per_key_overrides():
+    """RATE_LIMIT_OVERRIDES da a uma chave uma quota propria."""
+    limiter = RateLimiter(MemoryBucketStore)
+    with patch.object(settings, "RATE_LIMIT_REQUESTS_PER_MINUTE", 1), \
+            patch.object(settings, "RATE_LIMIT_OVERRIDES", {"premium": {"requests_per_minute": 3}}):
+        for _ in range(3):
+            limiter.hit(_request("premium"))
+        with pytest.raises(RateLimitExceeded):
+            limiter.hit(_request("premium"))
+
+
+def test_item_weighted_quota_on_batch_endpoint():
+    """Um lote consome tantos tokens quanto itens; um lote maior que a quota nunca passa."""
+    headers = {"X-API-Key": settings.API_KEY}
+    with patch.object(settings, "RATE_LIMIT_ITEMS_PER_MINUTE", 10), \
+            patch.object(PayoutService, "_simulate_payment", return_value=True):
+        assert client.post("/api/v1/payouts/batch", json=_batch("w-1", 8), headers=headers).status_code == 200
+
+        response = client.post("/api/v1/payouts/batch", json=_batch("w-2", 3), headers=headers)
+        assert response.status_code == 429
+        assert "items" in response.json()["detail"]
+        assert int(response.headers["Retry-After"]) >= 1
+
+        response = client.post("/api/v1/payouts/batch", json=_batch("w-3", 11), headers=headers)
+        assert response.status_code == 429
+        assert "Retry-After" not in response.headers
+
+
+def test_database_store_is_shared_between_limiters(tmp_path):
+    """Dois limiters (processos) sobre a mesma tabela dividem a mesma quota."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'limits.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    first = RateLimiter(lambda: DatabaseBucketStore(factory))
+    second = RateLimiter(lambda: DatabaseBucketStore(factory))
+
+    with patch.object(settings, "RATE_LIMIT_REQUESTS_PER_MINUTE", 3):
+        first.hit(_request("shared"))
+        second.hit(_request("shared"))
+        first.hit(_request("shared"))
+        with pytest.raises(RateLimitExceeded) as exc:
+            second.hit(_request("shared"))
+    assert exc.value.retry_after > 0
+    engine.dispose()
+
+
+class RedisStandIn:
+    """Substituto local do Redis: executa o algoritmo do script Lua sobre um dicionario."""
+
+    def __init__(self):
+        self.data = {}
+
+    def register_script(self, script):
+        if "EXPIRE" not in script:
+            return self._refund
+
+        assert "HMGET" in script
+
+        def run(keys, args):
+            capacity, rate, cost = (float(arg) for arg in args)
+            now = time.time()
+            tokens, ts = self.data.get(keys[0], (capacity, now))
+            allowed, tokens, retry_after = take_tokens(tokens, ts, now, capacity, rate, cost)
+            self.data[keys[0]] = (tokens, now)
+            return [int(allowed), str(retry_after)]
+
+        return run
+
+    def _refund(self, keys, args):
+        capacity, cost = (float(arg) for arg in args)
+        if keys[0] in self.data:
+            tokens, ts = self.data[keys[0]]
+            self.data[keys[0]] = (min(capacity, tokens + cost), ts)
+        return 1
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if key.startswith(pattern.rstrip("*"))]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_redis_store_with_local_stand_in():
+    """O backend Redis usa chaves com prefixo proprio e interpreta a resposta do script."""
+    redis = RedisStandIn()
+    limiter = RateLimiter(lambda: RedisBucketStore(redis))
+    with patch.object(settings, "RATE_LIMIT_REQUESTS_PER_MINUTE", 1):
+        limiter.hit(_request("r"))
+        with pytest.raises(RateLimitExceeded):
+            limiter.hit(_request("r"))
+
+    assert all(key.startswith("ratelimit:requests:key:") for key in redis.data)
+    limiter.reset()
+    assert redis.data == {}
+
+
+@pytest.mark.parametrize("store", ["memory", "database", "redis"])
+def test_items_rejection_does_not_spend_a_request_token(store, tmp_path):
+    """Garante que um lote recusado pela quota de itens devolve o token de requisicao."""
+    if store == "database":
+        engine = create_engine(f"sqlite:///{tmp_path / 'limits.db'}")
+        Base.metadata.create_all(bind=engine)
+        limiter = RateLimiter(lambda: DatabaseBucketStore(sessionmaker(bind=engine)))
+    elif store == "redis":
+        redis = RedisStandIn()
+        limiter = RateLimiter(lambda: RedisBucketStore(redis))
+    else:
+        limiter = RateLimiter(MemoryBucketStore)
+
+    with patch.object(settings, "RATE_LIMIT_REQUESTS_PER_MINUTE", 2), \
+            patch.object(settings, "RATE_LIMIT_ITEMS_PER_MINUTE", 10):
+        limiter.hit(_request("items"), items=8)
+        for _ in range(3):
+            with pytest.raises(RateLimitExceeded) as exc:
+                limiter.hit(_request("items"), items=5)
+            assert exc.value.quota.name == "items"
+        with pytest.raises(RateLimitExceeded) as exc:
+            limiter.hit(_request("items"), items=11)
+        assert exc.value.quota.name == "items"
+
+        limiter.hit(_request("items"))
+        with pytest.raises(RateLimitExceeded) as exc:
+            limiter.hit(_request("items"))
+        assert exc.value.quota.name == "requests"
@@ -0,0 +1,100 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import csv
+import io
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import PayoutDB, ReconciliationDB
+from app.reconciliation import ReconciliationError, ReconciliationSummary, merge, read_settlement_file, reconcile
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reconciliation.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _payouts(session_factory, rows, created_at=datetime(2026, 10, 17, 12)):
+    db = session_factory()
+    try:
+        db.execute(insert(PayoutDB), [
+            {"external_id": external_id, "status": "paid", "amount_cents": amount, "created_at": created_at}
+            for external_id, amount in rows
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def _settlement(path, rows):
+    with open(path, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(("external_id", "provider_reference", "amount_cents"))
+        writer.writerows((external_id, f"ref-{external_id}", amount) for external_id, amount in rows)
+    return str(path)
+
+
+def test_merge_classifies_every_discrepancy():
+    """Garante missing, extra, amount_mismatch e duplicate, inclusive nas pontas dos dois fluxos."""
+    file_rows = [("a", 1), ("b", 2), ("b", 2), ("d", 5), ("e", 6), ("z", 9)]
+    db_rows = [("0", 7), ("b", 2), ("c", 3), ("d", 4), ("e", 6), ("y", 8)]
+    summary = ReconciliationSummary(source="test")
+    reported = []
+
+    merge(file_rows, db_rows, summary, reported.append)
+
+    assert reported == [
+        ("missing", "0", None, 7),
+        ("extra", "a", 1, None),
+        ("duplicate", "b", 2, None),
+        ("missing", "c", None, 3),
+        ("amount_mismatch", "d", 5, 4),
+        ("missing", "y", None, 8),
+        ("extra", "z", 9, None),
+    ]
+    assert (summary.matched, summary.missing, summary.extra, summary.amount_mismatch, summary.duplicates) == (2, 3, 2, 1, 1)
+    assert (summary.file_rows, summary.db_rows) == (6, 6)
+    assert (summary.file_amount_cents, summary.db_amount_cents) == (23, 30)
+
+
+@pytest.mark.parametrize("content", [
+    "id,amount\na,1\n",
+    "external_id,amount_cents\na,not-a-number\n",
+    "external_id,amount_cents\nb,1\na,1\n",
+])
+def test_reader_rejects_invalid_files(content):
+    """Garante erro para cabecalho sem as colunas, valor invalido e arquivo fora de ordem."""
+    with pytest.raises(ReconciliationError):
+        list(read_settlement_file(io.StringIO(content)))
+
+
+def test_reconcile_writes_discrepancies_and_persists_summary(session_factory, tmp_path):
+    """Garante o CSV de divergencias, a janela de created_at e o resumo gravado em reconciliations."""
+    _payouts(session_factory, [("p-1", 100), ("p-2", 200), ("p-3", 300)])
+    _payouts(session_factory, [("p-0", 50)], created_at=datetime(2026, 10, 16, 12))
+    path = _settlement(tmp_path / "settlement.csv", [("p-1", 100), ("p-2", 250), ("p-4", 400)])
+
+    summary = reconcile(
+        path, since=datetime(2026, 10, 17), until=datetime(2026, 10, 18), session_factory=session_factory, batch_size=2,
+    )
+
+    with open(summary["discrepancies_path"], newline="") as handle:
+        assert list(csv.reader(handle)) == [
+            ["kind", "external_id", "file_amount_cents", "db_amount_cents"],
+            ["amount_mismatch", "p-2", "250", "200"],
+            ["missing", "p-3", "", "300"],
+            ["extra", "p-4", "400", ""],
+        ]
+    db = session_factory()
+    try:
+        saved = db.execute(select(ReconciliationDB).where(ReconciliationDB.id == summary["id"])).scalar_one()
+    finally:
+        db.close()
+    assert (saved.matched, saved.missing, saved.extra, saved.amount_mismatch) == (1, 1, 1, 1)
+    assert (saved.file_amount_cents, saved.db_amount_cents) == (750, 600)
@@ -0,0 +1,105 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import PayoutDB, PayoutItem, PayoutRecord
+from app.repository import PayoutRepository
+
+
+@pytest.fixture
+def db_session():
+    """Sessao isolada em um SQLite em memoria para cada teste."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _count_selects(session):
+    statements = []
+
+    @event.listens_for(session.get_bind(), "before_cursor_execute")
+    def _collect(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    return statements
+
+
+def _item(external_id, amount_cents=100):
+    return PayoutItem(external_id=external_id, user_id="user-3", amount_cents=amount_cents, pix_key="a@b.com")
+
+
+def test_find_in_flight_returns_only_pending_ids(db_session):
+    """Garante que apenas os ids com reserva `pending` sao retornados."""
+    db_session.add_all([
+        PayoutDB(external_id="paid-1", status="paid", amount_cents=100),
+        PayoutDB(external_id="pending-1", status="pending", amount_cents=200),
+    ])
+    db_session.commit()
+
+    repository = PayoutRepository(db_session)
+    found = repository.find_in_flight(["paid-1", "new-1", "pending-1"])
+
+    assert found == {"pending-1"}
+
+
+def test_find_in_flight_uses_one_query_per_chunk(db_session):
+    """Garante O(n / chunk) round trips em vez de um SELECT por item."""
+    db_session.add_all([
+        PayoutDB(external_id=f"id-{i}", status="pending", amount_cents=100)
+        for i in range(0, 1000, 2)
+    ])
+    db_session.commit()
+
+    repository = PayoutRepository(db_session)
+    statements = _count_selects(db_session)
+    found = repository.find_in_flight([f"id-{i}" for i in range(1000)], chunk_size=300)
+
+    assert len(found) == 500
+    assert len(statements) == 4  # ceil(1000 / 300)
+
+
+def test_complete_reservations_records_batch_and_user_dimensions(db_session):
+    """Garante que cada linha gravada carrega batch_id, user_id e created_at."""
+    repository = PayoutRepository(db_session)
+    repository.reserve([_item("dim-1")], batch_id="batch-9")
+    repository.complete_reservations(
+        [PayoutRecord(external_id="dim-1", status="paid", amount_cents=100, batch_id="batch-9", user_id="user-3")], [],
+    )
+
+    row = db_session.query(PayoutDB).filter_by(external_id="dim-1").one()
+    assert (row.status, row.batch_id, row.user_id, row.provider_reference) == ("paid", "batch-9", "user-3", None)
+    assert row.created_at is not None
+
+
+def test_duplicate_lookup_and_batch_queries_use_indexes(db_session):
+    """Garante que a busca por external_id e as consultas por lote/usuario usam indices, nunca um scan."""
+    plans = {
+        "ix_payouts_external_id": "SELECT external_id FROM payouts WHERE external_id IN ('a', 'b')",
+        "ix_payouts_batch_status": "SELECT count(*) FROM payouts WHERE batch_id = 'b1' AND status = 'paid'",
+        "ix_payouts_user_created": "SELECT * FROM payouts WHERE user_id = 'u1' ORDER BY created_at DESC LIMIT 10",
+    }
+    for index, query in plans.items():
+        plan = " ".join(row[3] for row in db_session.execute(text(f"EXPLAIN QUERY PLAN {query}")))
+        assert "SEARCH payouts USING" in plan and index in plan, plan
+
+
+def test_partitioned_insert_reserves_keys_before_writing_payouts():
+    """Garante que, com particionamento, o INSERT em payouts so recebe ids reservados em payout_keys."""
+    from sqlalchemy.dialects import postgresql
+
+    from app.repository import _insert_partitioned, _reservation_rows
+
+    rows = _reservation_rows([_item("p-1")], batch_id="b")
+    sql = str(_insert_partitioned(rows).compile(dialect=postgresql.dialect()))
+
+    assert sql.startswith("WITH new_keys AS")
+    assert "INSERT INTO payout_keys" in sql and "ON CONFLICT (external_id) DO NOTHING" in sql
+    assert "JOIN new_keys ON new_keys.external_id = incoming.external_id" in sql
+    assert "DISTINCT ON (incoming.external_id)" in sql
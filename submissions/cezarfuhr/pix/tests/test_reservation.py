@@ -0,0 +1,218 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+from pydantic import ValidationError
+from app.core.config import Settings
+from app.database import Base
+from app.models import PayoutBatch, PayoutDB, PayoutItem, PayoutRecord
+from app.repository import PayoutRepository
+from app.services import PayoutService
+from app.settlement import SettlementEngine
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """SQLite em arquivo: cada thread usa a sua conexao, como requisicoes concorrentes."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'reservation.db'}", connect_args={"timeout": 30})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _item(external_id, amount_cents=100):
+    return PayoutItem(external_id=external_id, user_id="u1", amount_cents=amount_cents, pix_key="a@b.com")
+
+
+def _statuses(session_factory):
+    db = session_factory()
+    try:
+        return dict(db.execute(select(PayoutDB.external_id, PayoutDB.status)).all())
+    finally:
+        db.close()
+
+
+class RacingProvider:
+    """Provedor lento que conta pagamentos por id e acusa chamadas simultaneas para o mesmo id."""
+    name = "simulated"
+
+    def __init__(self, fail_first=()):
+        self.fail_first = set(fail_first)
+        self.calls = Counter()
+        self.paid = Counter()
+        self.overlaps = []
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def pay(self, item):
+        with self._lock:
+            if item.external_id in self._in_flight:
+                self.overlaps.append(item.external_id)
+            self._in_flight.add(item.external_id)
+            self.calls[item.external_id] += 1
+            ok = not (item.external_id in self.fail_first and self.calls[item.external_id] == 1)
+        # Alarga a janela entre a decisao de pagar e a gravacao do resultado
+        time.sleep(0.002)
+        with self._lock:
+            self._in_flight.discard(item.external_id)
+            if ok:
+                self.paid[item.external_id] += 1
+        return ok
+
+
+def test_reserve_claims_new_failed_and_stale_ids_only(session_factory):
+    """Garante que so ids novos, com falha ou com reserva vencida sao reservados, uma unica vez."""
+    stale = datetime.utcnow() - timedelta(hours=1)
+    db = session_factory()
+    db.add_all([
+        PayoutDB(external_id="paid", status="paid", amount_cents=100),
+        PayoutDB(external_id="failed", status="failed", amount_cents=100),
+        PayoutDB(external_id="in-flight", status="pending", amount_cents=100, reserved_at=datetime.utcnow()),
+        PayoutDB(external_id="stale", status="pending", amount_cents=100, reserved_at=stale),
+    ])
+    db.commit()
+    repository = PayoutRepository(db, cache=None)
+    items = [_item(external_id) for external_id in ("paid", "failed", "in-flight", "stale", "new")]
+
+    assert repository.reserve(items, batch_id="b1") == {"failed", "stale", "new"}
+    assert repository.reserve(items, batch_id="b2") == set()
+    db.close()
+    assert _statuses(session_factory) == {
+        "paid": "paid", "failed": "pending", "in-flight": "pending", "stale": "pending", "new": "pending",
+    }
+
+
+def test_owner_retakes_only_its_own_pending_reservations(session_factory):
+    """Garante que um `owner` retoma a reserva `pending` que gravou, mas nunca a de outro dono do mesmo lote."""
+    now = datetime.utcnow()
+    db = session_factory()
+    db.add_all([
+        PayoutDB(external_id="mine", status="pending", amount_cents=100, batch_id="b1",
+                 reserved_at=now, reservation_owner="job-1"),
+        PayoutDB(external_id="theirs", status="pending", amount_cents=100, batch_id="b1",
+                 reserved_at=now, reservation_owner="job-2"),
+        PayoutDB(external_id="ownerless", status="pending", amount_cents=100, batch_id="b1", reserved_at=now),
+    ])
+    db.commit()
+    repository = PayoutRepository(db, cache=None)
+    items = [_item("mine"), _item("theirs"), _item("ownerless")]
+
+    assert repository.reserve(items, batch_id="b1") == set()
+    assert repository.find_in_flight(["mine", "theirs", "ownerless"]) == {"mine", "theirs", "ownerless"}
+    assert repository.reserve(items, batch_id="b1", owner="job-1") == {"mine"}
+    db.close()
+
+
+def test_concurrent_owned_reservations_claim_each_id_once(session_factory):
+    """
+    Garante que reservas simultaneas do mesmo lote com donos diferentes (um
+    worker e a retentativa, ou dois workers) nunca reservam o mesmo id duas
+    vezes, inclusive depois que uma delas ja gravou a reserva `pending`.
+    """
+    ids = [f"own-{i}" for i in range(50)]
+    owners = [f"job-{i}" for i in range(8)]
+
+    def reserve(owner):
+        db = session_factory()
+        try:
+            repository = PayoutRepository(db, cache=None)
+            return [repository.reserve([_item(i)], batch_id="B1", owner=owner) for i in ids]
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=len(owners)) as pool:
+        results = list(pool.map(reserve, owners))
+
+    claims = Counter(external_id for result in results for claimed in result for external_id in claimed)
+    assert set(claims) == set(ids)
+    assert set(claims.values()) == {1}
+
+
+@pytest.mark.parametrize("overrides", [
+    {"SETTLEMENT_TIMEOUT_SECONDS": 300},
+    {"QUEUE_LEASE_SECONDS": 301},
+    {"RETRY_LEASE_SECONDS": 301},
+])
+def test_settings_reject_reservation_timeout_shorter_than_a_lease(overrides):
+    """Garante que o startup falha se uma reserva viva puder vencer antes da chamada ou do lease."""
+    with pytest.raises(ValidationError):
+        Settings(API_KEY="test-key", PAYOUT_RESERVATION_TIMEOUT_SECONDS=300, **overrides)
+
+
+def test_reserve_uses_one_statement_per_chunk(session_factory):
+    """Garante um unico INSERT ... RETURNING por chunk, sem SELECT previo de duplicatas."""
+    db = session_factory()
+    statements = []
+    event.listen(
+        db.get_bind(), "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement.lstrip().split()[0].upper()),
+    )
+
+    claimed = PayoutRepository(db, cache=None).reserve([_item(f"r-{i}") for i in range(25)], chunk_size=10)
+    db.close()
+
+    assert len(claimed) == 25
+    assert statements == ["INSERT", "INSERT", "INSERT"]
+
+
+def test_complete_reservations_flips_to_paid_and_failed(session_factory):
+    """Garante `paid` com provider_reference e `failed` de volta a disputa por uma nova reserva."""
+    db = session_factory()
+    repository = PayoutRepository(db, cache=None)
+    repository.reserve([_item("ok"), _item("ko")], batch_id="b1")
+
+    repository.complete_reservations(
+        [PayoutRecord(external_id="ok", status="paid", amount_cents=100, batch_id="b1", provider_reference="ref-1")],
+        ["ko"],
+    )
+
+    row = db.execute(select(PayoutDB).where(PayoutDB.external_id == "ok")).scalar_one()
+    assert (row.status, row.provider_reference, row.batch_id, row.user_id) == ("paid", "ref-1", "b1", "u1")
+    assert repository.reserve([_item("ok"), _item("ko")]) == {"ko"}
+    db.close()
+
+
+def test_concurrent_submissions_pay_each_id_exactly_once(session_factory):
+    """
+    Garante que varias requisicoes simultaneas com os mesmos ids pagam cada
+    id uma unica vez, inclusive os que falham na primeira tentativa e sao
+    retomados por um reenvio.
+    """
+    ids = [f"race-{i}" for i in range(200)]
+    provider = RacingProvider(fail_first=ids[::10])
+    rounds = 12
+
+    def submit(seed):
+        shuffled = ids[:]
+        random.Random(seed).shuffle(shuffled)
+        db = session_factory()
+        try:
+            service = PayoutService(
+                db_session=db, provider=provider, engine=SettlementEngine(max_in_flight=8, timeout_seconds=5),
+            )
+            service.repository.cache = None
+            return service.process_batch(PayoutBatch(batch_id=f"race-{seed}", items=[_item(i) for i in shuffled]))
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=rounds) as pool:
+        reports = list(pool.map(submit, range(rounds)))
+    # Um reenvio depois da disputa retoma as falhas que nenhuma rodada pegou
+    reports.append(submit(rounds))
+
+    assert provider.overlaps == []
+    assert set(provider.paid) == set(ids)
+    assert set(provider.paid.values()) == {1}
+    assert sum(report.successful for report in reports) == len(ids)
+    assert all(
+        report.successful + report.failed + report.duplicates + report.pending == len(ids) for report in reports
+    )
+    assert set(_statuses(session_factory).values()) == {"paid"}
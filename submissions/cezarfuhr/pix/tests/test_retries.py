@@ -0,0 +1,211 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import random
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from app.core.config import settings
+from app.database import Base
+from app.models import BatchSummaryDB, PayoutBatch, PayoutDB, PayoutItem, PayoutRetryDB
+from app.retries import RetryScheduler
+from app.services import PayoutService
+from app.settlement import UNKNOWN, SettlementEngine, SimulatedProvider, backoff_delay
+
+
+class ScriptedProvider:
+    """Provedor que responde conforme `results` e registra a concorrencia maxima."""
+
+    def __init__(self, name="simulated", results=None, latency=0.0):
+        self.name = name
+        self.results = results or {}
+        self.latency = latency
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def pay(self, item):
+        with self._lock:
+            self.calls.append(item.external_id)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        return self.results.get(item.external_id, True)
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """Banco SQLite em arquivo, com retentativas vencendo imediatamente."""
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY_SECONDS", 0.0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'retries.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _batch(batch_id, count):
+    return PayoutBatch(
+        batch_id=batch_id,
+        items=[
+            PayoutItem(external_id=f"{batch_id}-{i}", user_id="u1", amount_cents=100, pix_key="a@a.com")
+            for i in range(count)
+        ],
+    )
+
+
+def _process(session_factory, batch, provider):
+    db = session_factory()
+    try:
+        service = PayoutService(
+            db_session=db, provider=provider, engine=SettlementEngine(max_in_flight=4, timeout_seconds=1)
+        )
+        return service.process_batch(batch)
+    finally:
+        db.close()
+
+
+def _retries(session_factory):
+    db = session_factory()
+    try:
+        return {row.external_id: row for row in db.execute(select(PayoutRetryDB)).scalars()}
+    finally:
+        db.close()
+
+
+def test_backoff_is_exponential_with_jitter_and_capped(monkeypatch):
+    """Garante atraso entre metade e o total do degrau exponencial, limitado ao teto."""
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY_SECONDS", 10.0)
+    monkeypatch.setattr(settings, "RETRY_MAX_DELAY_SECONDS", 60.0)
+    rng = random.Random(7)
+
+    for attempts, step in [(1, 10.0), (2, 20.0), (3, 40.0), (4, 60.0), (10, 60.0)]:
+        delays = [backoff_delay(attempts, rng) for _ in range(50)]
+        assert all(step / 2 <= delay <= step for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_failed_items_are_persisted_for_retry(session_factory):
+    """Garante que so os itens que falharam ficam agendados, com a tentativa original contada."""
+    provider = ScriptedProvider(results={"keep-1": False, "keep-3": False})
+    report = _process(session_factory, _batch("keep", 4), provider)
+
+    assert report.failed == 2
+    retries = _retries(session_factory)
+    assert set(retries) == {"keep-1", "keep-3"}
+    assert all(row.status == "pending" and row.attempts == 1 for row in retries.values())
+    assert retries["keep-1"].batch_id == "keep" and retries["keep-1"].provider == "simulated"
+
+
+def test_scheduler_retries_only_failed_items_and_updates_summary(session_factory):
+    """Garante que a retentativa chama o provedor so para os itens que falharam e corrige o agregado."""
+    _process(session_factory, _batch("retry", 10), ScriptedProvider(results={"retry-2": False, "retry-7": False}))
+
+    provider = ScriptedProvider()
+    scheduler = RetryScheduler(session_factory, providers={"simulated": provider})
+    assert scheduler.run(drain=True) == 2
+
+    assert sorted(provider.calls) == ["retry-2", "retry-7"]
+    assert {row.status for row in _retries(session_factory).values()} == {"paid"}
+    db = session_factory()
+    assert db.query(PayoutDB).count() == 10
+    summary = db.get(BatchSummaryDB, "retry")
+    assert (summary.successful, summary.failed, summary.paid_amount_cents) == (10, 0, 1000)
+    db.close()
+
+
+def test_scheduler_marks_item_failed_permanently_after_max_attempts(session_factory, monkeypatch):
+    """Garante o status terminal `failed_permanently` ao esgotar RETRY_MAX_ATTEMPTS."""
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 3)
+    _process(session_factory, _batch("exhaust", 1), ScriptedProvider(results={"exhaust-0": False}))
+
+    provider = ScriptedProvider(results={"exhaust-0": False})
+    scheduler = RetryScheduler(session_factory, providers={"simulated": provider})
+    scheduler.run(drain=True)
+
+    row = _retries(session_factory)["exhaust-0"]
+    assert (row.status, row.attempts) == ("failed_permanently", 3)
+    assert len(provider.calls) == 2
+    assert scheduler.run_once() == 0
+
+
+def test_scheduler_reschedules_unknown_outcome_without_failing_the_reservation(session_factory, monkeypatch):
+    """Garante que uma retentativa sem resposta no prazo e reagendada e a reserva continua `pending`."""
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 2)
+    _process(session_factory, _batch("unknown", 1), ScriptedProvider(results={"unknown-0": False}))
+
+    provider = ScriptedProvider(results={"unknown-0": UNKNOWN})
+    assert RetryScheduler(session_factory, providers={"simulated": provider}).run_once() == 1
+
+    row = _retries(session_factory)["unknown-0"]
+    assert (row.status, row.attempts) == ("pending", 2)
+    db = session_factory()
+    assert db.execute(select(PayoutDB.status)).scalar_one() == "pending"
+    db.close()
+
+
+def test_timed_out_item_is_retried_and_counted_once_settled(session_factory):
+    """
+    Garante que uma chamada sem resposta no prazo agenda a retentativa, que
+    assume a reserva `pending` na hora, paga o item e so entao o conta no
+    agregado do lote.
+    """
+    report = _process(session_factory, _batch("late", 2), ScriptedProvider(results={"late-0": UNKNOWN}))
+    assert (report.successful, report.pending) == (1, 1)
+
+    row = _retries(session_factory)["late-0"]
+    assert (row.status, row.original_status) == ("pending", "pending")
+    db = session_factory()
+    payout = db.execute(select(PayoutDB).where(PayoutDB.external_id == "late-0")).scalar_one()
+    assert (payout.status, payout.reservation_owner) == ("pending", "retry")
+    assert db.get(BatchSummaryDB, "late").processed == 1
+    db.close()
+
+    provider = ScriptedProvider()
+    assert RetryScheduler(session_factory, providers={"simulated": provider}).run_once() == 1
+
+    assert provider.calls == ["late-0"]
+    assert _retries(session_factory)["late-0"].status == "paid"
+    db = session_factory()
+    summary = db.get(BatchSummaryDB, "late")
+    assert (summary.processed, summary.successful, summary.failed) == (2, 2, 0)
+    db.close()
+
+
+def test_scheduler_waits_for_next_attempt(session_factory, monkeypatch):
+    """Garante que itens com backoff ainda nao vencido nao sao reservados."""
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY_SECONDS", 3600.0)
+    _process(session_factory, _batch("later", 3), SimulatedProvider(success_rate=0.0))
+
+    provider = ScriptedProvider()
+    assert RetryScheduler(session_factory, providers={"simulated": provider}).run_once() == 0
+    assert provider.calls == []
+
+
+def test_scheduler_skips_items_paid_by_resubmission(session_factory):
+    """Garante que um item ja pago por reenvio do lote e resolvido sem chamar o provedor."""
+    _process(session_factory, _batch("resent", 2), ScriptedProvider(results={"resent-1": False}))
+    _process(session_factory, _batch("resent", 2), ScriptedProvider())
+
+    provider = ScriptedProvider()
+    RetryScheduler(session_factory, providers={"simulated": provider}).run(drain=True)
+
+    assert provider.calls == []
+    assert _retries(session_factory)["resent-1"].status == "duplicate"
+
+
+def test_scheduler_respects_per_provider_concurrency(session_factory, monkeypatch):
+    """Garante que cada provedor recebe no maximo o seu limite de chamadas simultaneas."""
+    monkeypatch.setattr(settings, "RETRY_PROVIDER_CONCURRENCY", {"slow": 2})
+    slow = ScriptedProvider(name="slow", results={f"conc-{i}": False for i in range(8)})
+    _process(session_factory, _batch("conc", 8), slow)
+
+    retry_provider = ScriptedProvider(name="slow", latency=0.02)
+    RetryScheduler(session_factory, providers={"slow": retry_provider}).run(drain=True)
+
+    assert len(retry_provider.calls) == 8
+    assert retry_provider.max_in_flight == 2
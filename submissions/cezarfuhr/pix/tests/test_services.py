@@ -2,16 +2,28 @@ import os
 os.environ['API_KEY'] = 'test-key'
 
 from unittest.mock import Mock, patch
-from app.services import PayoutService
+from app.services import PayoutService, ReportBuilder
 from app.models import PayoutBatch, PayoutItem
 
+def _reserve_all(items, batch_id=None, owner=None):
+    """Simula uma reserva em que todos os ids sao novos."""
+    return {item.external_id for item in items}
+
+def _reserve_except(*taken):
+    """Simula uma reserva em que `taken` ja foram pagos por outra requisicao."""
+    return lambda items, batch_id=None, owner=None: _reserve_all(items) - set(taken)
+
+def _saved_ids(mock_repo):
+    return [p.external_id for call in mock_repo.complete_reservations.call_args_list for p in call.args[0]]
+
 def test_process_batch_with_duplicates():
     """Testa processamento de lote com duplicatas"""
     # Arrange
     mock_db_session = Mock()
     # Mock do repositorio que usa a sessao
     mock_repo = Mock()
-    mock_repo.was_processed.side_effect = [True, False]
+    mock_repo.reserve.side_effect = _reserve_except("dup-1")
+    mock_repo.find_in_flight.return_value = set()
 
     # Injeta o mock do repositorio no servico
     with patch('app.services.PayoutRepository', return_value=mock_repo):
@@ -31,14 +43,14 @@ def test_process_batch_with_duplicates():
     # Assert
     assert report.duplicates == 1
     assert report.successful == 1
-    mock_repo.save_payout.assert_called_once()
+    assert _saved_ids(mock_repo) == ["new-1"]
 
 def test_process_batch_with_failures():
     """Testa processamento de lote com falhas"""
     # Arrange
     mock_db_session = Mock()
     mock_repo = Mock()
-    mock_repo.was_processed.return_value = False
+    mock_repo.reserve.side_effect = _reserve_all
 
     with patch('app.services.PayoutRepository', return_value=mock_repo):
         service = PayoutService(db_session=mock_db_session)
@@ -58,14 +70,15 @@ def test_process_batch_with_failures():
     assert report.failed == 1
     assert report.successful == 1
     assert report.duplicates == 0
-    assert mock_repo.save_payout.call_count == 1  # Apenas o sucesso foi salvo
+    assert _saved_ids(mock_repo) == ["success-1"]
+    assert mock_repo.complete_reservations.call_args.args[1] == ["fail-1"]
 
 def test_process_batch_all_successful():
     """Testa processamento de lote com todos sucessos"""
     # Arrange
     mock_db_session = Mock()
     mock_repo = Mock()
-    mock_repo.was_processed.return_value = False
+    mock_repo.reserve.side_effect = _reserve_all
 
     with patch('app.services.PayoutRepository', return_value=mock_repo):
         service = PayoutService(db_session=mock_db_session)
@@ -88,4 +101,168 @@ def test_process_batch_all_successful():
     assert report.duplicates == 0
     assert report.processed == 3
     assert len(report.details) == 3
-    assert mock_repo.save_payout.call_count == 3
+    mock_repo.complete_reservations.assert_called_once()  # Um unico commit para o chunk
+    assert _saved_ids(mock_repo) == ["item-1", "item-2", "item-3"]
+
+def test_process_batch_resolves_duplicates_in_bulk():
+    """Garante que a reserva dos ids usa uma unica chamada em lote"""
+    mock_db_session = Mock()
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = _reserve_all
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(db_session=mock_db_session)
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[
+                PayoutItem(external_id=f"bulk-{i}", user_id="u1", amount_cents=100, pix_key="a")
+                for i in range(50)
+            ]
+        )
+
+        with patch.object(service, '_simulate_payment', return_value=True):
+            report = service.process_batch(batch)
+
+    assert report.successful == 50
+    mock_repo.reserve.assert_called_once()
+
+def test_process_batch_repeated_id_in_same_batch_is_duplicate():
+    """Garante que um id repetido no mesmo lote nao e pago duas vezes"""
+    mock_db_session = Mock()
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = _reserve_all
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(db_session=mock_db_session)
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[
+                PayoutItem(external_id="same-1", user_id="u1", amount_cents=100, pix_key="a"),
+                PayoutItem(external_id="same-1", user_id="u1", amount_cents=100, pix_key="a"),
+            ]
+        )
+
+        with patch.object(service, '_simulate_payment', return_value=True):
+            report = service.process_batch(batch)
+
+    assert report.successful == 1
+    assert report.duplicates == 1
+    assert _saved_ids(mock_repo) == ["same-1"]
+
+def test_process_batch_settles_only_reserved_ids():
+    """Garante que um id reservado por outra requisicao vira duplicata sem chamar o provedor"""
+    mock_db_session = Mock()
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = _reserve_except("raced-1")
+    mock_repo.find_in_flight.return_value = set()
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(db_session=mock_db_session)
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[
+                PayoutItem(external_id="new-1", user_id="u1", amount_cents=100, pix_key="a"),
+                PayoutItem(external_id="raced-1", user_id="u2", amount_cents=200, pix_key="b"),
+            ]
+        )
+
+        with patch.object(service, '_simulate_payment', return_value=True) as pay:
+            report = service.process_batch(batch)
+
+    assert report.successful == 1
+    assert report.duplicates == 1
+    assert [d.status for d in report.details] == ["paid", "duplicate"]
+    assert [call.args[0].external_id for call in pay.call_args_list] == ["new-1"]
+
+def test_in_flight_reservation_is_reported_as_pending():
+    """Garante que um id ainda em liquidacao por outra requisicao vira `pending`, e nao `duplicate`"""
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = _reserve_except("raced-1")
+    mock_repo.find_in_flight.return_value = {"raced-1"}
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(db_session=Mock())
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[
+                PayoutItem(external_id="new-1", user_id="u1", amount_cents=100, pix_key="a"),
+                PayoutItem(external_id="raced-1", user_id="u2", amount_cents=200, pix_key="b"),
+            ]
+        )
+        with patch.object(service, '_simulate_payment', return_value=True):
+            report = service.process_batch(batch)
+
+    mock_repo.find_in_flight.assert_called_once_with(["raced-1"])
+    assert [d.status for d in report.details] == ["paid", "pending"]
+    assert (report.processed, report.duplicates, report.pending) == (1, 0, 1)
+
+def test_process_batch_commits_once_per_chunk():
+    """Garante uma reserva e um fechamento (um commit) por chunk de PAYOUT_WRITE_CHUNK_SIZE itens"""
+    mock_db_session = Mock()
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = _reserve_all
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo), \
+         patch('app.services.settings.PAYOUT_WRITE_CHUNK_SIZE', 4):
+        service = PayoutService(db_session=mock_db_session)
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[
+                PayoutItem(external_id=f"chunk-{i}", user_id="u1", amount_cents=100, pix_key="a")
+                for i in range(10)
+            ]
+        )
+
+        with patch.object(service, '_simulate_payment', return_value=True):
+            report = service.process_batch(batch)
+
+    assert report.successful == 10
+    assert mock_repo.complete_reservations.call_count == 3  # 4 + 4 + 2
+    assert mock_repo.reserve.call_count == 3
+
+def test_repeats_across_chunks_skip_lookup_and_provider():
+    """Garante que ids repetidos em chunks diferentes do lote nao vao ao banco nem ao provedor"""
+    looked_up = []
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = lambda items, batch_id, owner: looked_up.append([i.external_id for i in items]) or _reserve_all(items)
+    ids = ["a", "b", "a", "c", "b"]
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo), \
+         patch('app.services.settings.PAYOUT_WRITE_CHUNK_SIZE', 2):
+        service = PayoutService(db_session=Mock())
+        batch = PayoutBatch(
+            batch_id="test-batch",
+            items=[PayoutItem(external_id=i, user_id="u1", amount_cents=100, pix_key="a") for i in ids]
+        )
+        with patch.object(service, '_simulate_payment', return_value=True) as pay:
+            report = service.process_batch(batch)
+
+    assert looked_up == [["a", "b"], ["c"], []]
+    assert pay.call_count == 3
+    assert [d.status for d in report.details] == ["paid", "paid", "duplicate", "paid", "duplicate"]
+
+def test_million_item_batch_with_high_duplicate_ratio():
+    """Garante que, em 1M itens com 99% de repeticoes, banco e provedor so veem os ids unicos"""
+    unique = [
+        PayoutItem(external_id=f"big-{i}", user_id="u1", amount_cents=100, pix_key="a")
+        for i in range(10_000)
+    ]
+    # Repeticoes espalhadas pelo lote inteiro, nao apenas dentro de um chunk
+    items = [unique[(i * 7919) % len(unique)] for i in range(1_000_000)]
+    looked_up = []
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = lambda items, batch_id, owner: looked_up.extend(i.external_id for i in items) or _reserve_all(items)
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo), \
+         patch('app.services.settings.PAYOUT_WRITE_CHUNK_SIZE', 50_000):
+        service = PayoutService(db_session=Mock())
+        builder = ReportBuilder("big-batch", keep_details=False)
+        with patch.object(service, '_simulate_payment', return_value=True) as pay:
+            for details in service.iter_chunks(items):
+                builder.add(details)
+
+    report = builder.build()
+    assert (report.successful, report.duplicates, report.failed) == (10_000, 990_000, 0)
+    assert len(looked_up) == 10_000
+    assert pay.call_count == 10_000
+    assert len(_saved_ids(mock_repo)) == 10_000
@@ -0,0 +1,199 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import threading
+import time
+from unittest.mock import Mock, patch
+from app.models import PayoutBatch, PayoutItem
+from app.services import PayoutService
+from app.settlement import UNKNOWN, SettlementEngine, SimulatedProvider, default_provider
+
+
+def _items(count):
+    return [
+        PayoutItem(external_id=f"settle-{i}", user_id="u1", amount_cents=100 + i, pix_key="a")
+        for i in range(count)
+    ]
+
+
+def test_engine_preserves_item_order():
+    """Garante que os resultados voltam na ordem dos itens, mesmo fora de ordem na execucao."""
+    items = _items(20)
+
+    def settle(item):
+        # Itens pares demoram mais, entao terminam depois dos impares
+        time.sleep(0.02 if item.amount_cents % 2 == 0 else 0)
+        return item.amount_cents % 2 == 0
+
+    outcomes = SettlementEngine(max_in_flight=8, timeout_seconds=1).settle_all(items, settle)
+
+    assert outcomes == [item.amount_cents % 2 == 0 for item in items]
+
+
+def test_engine_respects_max_in_flight():
+    """Garante que nunca ha mais chamadas simultaneas do que o limite configurado."""
+    lock = threading.Lock()
+    current = 0
+    peak = 0
+
+    def settle(item):
+        nonlocal current, peak
+        with lock:
+            current += 1
+            peak = max(peak, current)
+        time.sleep(0.01)
+        with lock:
+            current -= 1
+        return True
+
+    SettlementEngine(max_in_flight=3, timeout_seconds=1).settle_all(_items(15), settle)
+
+    assert peak == 3
+
+
+def test_engine_marks_timeouts_unknown_and_errors_as_failed():
+    """Garante que excecao do provedor vira falha e timeout vira resultado desconhecido, sem travar o lote."""
+    def settle(item):
+        if item.external_id == "settle-0":
+            time.sleep(1)
+        if item.external_id == "settle-1":
+            raise ConnectionError("provider down")
+        return True
+
+    start = time.perf_counter()
+    outcomes = SettlementEngine(max_in_flight=4, timeout_seconds=0.05).settle_all(_items(3), settle)
+
+    assert outcomes == [UNKNOWN, False, True]
+    assert time.perf_counter() - start < 0.5
+
+
+def test_engine_deadline_starts_when_the_call_starts():
+    """
+    Garante que chamadas presas nao consomem o prazo das que esperam slot:
+    com um slot preso, os itens seguintes rodam no slot livre e terminam.
+    """
+    release = threading.Event()
+
+    def settle(item):
+        if item.external_id == "settle-0":
+            release.wait(2)
+        else:
+            time.sleep(0.03)
+        return True
+
+    outcomes = SettlementEngine(max_in_flight=2, timeout_seconds=0.1).settle_all(_items(6), settle)
+    release.set()
+
+    # 5 chamadas de 0.03s em sequencia passam do prazo de 0.1s se ele contasse desde a submissao
+    assert outcomes == [UNKNOWN, True, True, True, True, True]
+
+
+def test_engine_gives_up_unsent_items_when_every_slot_hangs():
+    """Garante que, com todos os slots presos, os itens nunca enviados voltam como falha comum."""
+    release = threading.Event()
+    called = []
+
+    def settle(item):
+        called.append(item.external_id)
+        release.wait(2)
+        return True
+
+    start = time.perf_counter()
+    outcomes = SettlementEngine(max_in_flight=2, timeout_seconds=0.05).settle_all(_items(5), settle)
+    release.set()
+
+    assert outcomes == [UNKNOWN, UNKNOWN, False, False, False]
+    assert sorted(called) == ["settle-0", "settle-1"]
+    assert time.perf_counter() - start < 0.5
+
+
+def test_service_keeps_timed_out_reservation_pending_and_schedules_retry():
+    """Garante que um timeout nao marca a reserva como falha: o item fica `pending` e vai para a retentativa."""
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = lambda items, batch_id, owner: {item.external_id for item in items}
+    release = threading.Event()
+
+    def pay(item):
+        if item.external_id == "settle-0":
+            release.wait(2)
+        return True
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(db_session=Mock(), engine=SettlementEngine(max_in_flight=2, timeout_seconds=0.05))
+        with patch.object(service, '_simulate_payment', side_effect=pay):
+            report = service.process_batch(PayoutBatch(batch_id="hang-batch", items=_items(3)))
+    release.set()
+
+    assert [d.status for d in report.details] == ["pending", "paid", "paid"]
+    assert (report.processed, report.pending) == (2, 1)
+    paid, failed_ids = mock_repo.complete_reservations.call_args.args
+    assert [p.external_id for p in paid] == ["settle-1", "settle-2"]
+    assert failed_ids == []
+    failed, batch_id, _ = mock_repo.schedule_retries.call_args.args
+    assert (failed, batch_id) == ([], "hang-batch")
+    assert [item.external_id for item in mock_repo.schedule_retries.call_args.kwargs["unknown"]] == ["settle-0"]
+
+
+def test_concurrent_settlement_speedup_with_simulated_latency():
+    """Mede o ganho do paralelismo com um provedor de 20ms de latencia."""
+    items = _items(20)
+    provider = SimulatedProvider(success_rate=1.0, latency_seconds=0.02)
+
+    start = time.perf_counter()
+    SettlementEngine(max_in_flight=1, timeout_seconds=1).settle_all(items, provider.pay)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outcomes = SettlementEngine(max_in_flight=10, timeout_seconds=1).settle_all(items, provider.pay)
+    concurrent = time.perf_counter() - start
+
+    assert all(outcomes)
+    assert concurrent < sequential / 3
+
+
+def test_simulated_provider_failure_model_is_reproducible():
+    """Garante que o seed torna o modelo de falhas deterministico."""
+    items = _items(200)
+    first_provider = SimulatedProvider(success_rate=0.5, seed=42)
+    second_provider = SimulatedProvider(success_rate=0.5, seed=42)
+    first = [first_provider.pay(item) for item in items]
+    second = [second_provider.pay(item) for item in items]
+
+    assert first == second
+    assert 60 < sum(first) < 140
+
+
+def test_simulated_provider_pays_each_external_id_once():
+    """Garante que o simulado, como o provedor real com Idempotency-Key, nao paga duas vezes o mesmo id."""
+    provider = SimulatedProvider(success_rate=0.5, seed=7, idempotency_capacity=100)
+    items = _items(50)
+    first = [provider.pay(item) for item in items]
+    provider.success_rate = 0.0
+    second = [provider.pay(item) for item in items]
+
+    # Os pagos continuam pagos sem nova tentativa; as falhas sao tentadas de novo
+    assert second == first
+    assert 0 < sum(first) < 50
+
+
+def test_default_provider_is_shared_by_the_process():
+    """Garante que servicos e retentativas usam a mesma instancia do provedor simulado."""
+    assert default_provider() is default_provider()
+
+
+def test_service_uses_injected_provider():
+    """Garante que o servico liquida via provedor injetado."""
+    mock_repo = Mock()
+    mock_repo.reserve.side_effect = lambda items, batch_id, owner: {item.external_id for item in items}
+
+    with patch('app.services.PayoutRepository', return_value=mock_repo):
+        service = PayoutService(
+            db_session=Mock(),
+            provider=SimulatedProvider(success_rate=0.0),
+            engine=SettlementEngine(max_in_flight=4, timeout_seconds=1),
+        )
+        report = service.process_batch(PayoutBatch(batch_id="provider-batch", items=_items(5)))
+
+    assert report.failed == 5
+    paid, failed_ids = mock_repo.complete_reservations.call_args.args
+    assert paid == [] and len(failed_ids) == 5
@@ -0,0 +1,111 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import json
+import uuid
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.services import PayoutService
+
+client = TestClient(app)
+headers = {"X-API-Key": settings.API_KEY}
+
+
+def _items(prefix, count):
+    return [
+        {"external_id": f"{prefix}-{i}", "user_id": "u1", "amount_cents": 100 + i, "pix_key": "a@a.com"}
+        for i in range(count)
+    ]
+
+
+def _records(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_query_returns_detail_lines_and_summary_trailer():
+    """Garante uma linha por item e o registro summary no fim."""
+    batch_id = f"st-{uuid.uuid4().hex[:8]}"
+    payload = {"batch_id": batch_id, "items": _items(batch_id, 5)}
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True), \
+         patch('app.services.settings.PAYOUT_WRITE_CHUNK_SIZE', 2):
+        response = client.post("/api/v1/payouts/batch?stream=true", json=payload, headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = _records(response)
+    assert [r["type"] for r in records] == ["detail"] * 5 + ["summary"]
+    assert [r["external_id"] for r in records[:5]] == [f"{batch_id}-{i}" for i in range(5)]
+    assert records[-1] == {
+        "type": "summary", "batch_id": batch_id,
+        "processed": 5, "successful": 5, "failed": 0, "duplicates": 0, "pending": 0,
+    }
+
+
+def test_paid_details_expose_only_report_fields():
+    """Garante que o registro gravado de um item pago nao vaza batch_id/user_id no relatorio."""
+    batch_id = f"st-{uuid.uuid4().hex[:8]}"
+    payload = {"batch_id": batch_id, "items": _items(batch_id, 1)}
+    expected = {"external_id": f"{batch_id}-0", "status": "paid", "amount_cents": 100}
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        streamed = client.post("/api/v1/payouts/batch?stream=true", json=payload, headers=headers)
+        payload["batch_id"] = f"{batch_id}-sync"
+        payload["items"][0]["external_id"] = f"{batch_id}-sync"
+        report = client.post("/api/v1/payouts/batch", json=payload, headers=headers).json()
+
+    assert _records(streamed)[0] == {"type": "detail", **expected}
+    assert report["details"] == [{**expected, "external_id": f"{batch_id}-sync"}]
+
+
+def test_accept_header_enables_streaming():
+    """Garante que Accept: application/x-ndjson ativa o modo streaming."""
+    batch_id = f"st-{uuid.uuid4().hex[:8]}"
+    payload = {"batch_id": batch_id, "items": _items(batch_id, 2)}
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=False):
+        response = client.post(
+            "/api/v1/payouts/batch",
+            json=payload,
+            headers={**headers, "Accept": "application/x-ndjson"},
+        )
+
+    records = _records(response)
+    assert [r["status"] for r in records[:2]] == ["failed", "failed"]
+    assert records[-1]["failed"] == 2
+
+
+def test_ndjson_ingestion_with_streaming_output():
+    """Garante ingestao e relatorio em streaming no mesmo request."""
+    batch_id = f"st-{uuid.uuid4().hex[:8]}"
+    body = "\n".join([json.dumps({"batch_id": batch_id})] + [json.dumps(i) for i in _items(batch_id, 4)])
+
+    with patch.object(PayoutService, '_simulate_payment', return_value=True):
+        response = client.post(
+            "/api/v1/payouts/batch/ndjson?stream=true",
+            content=body.encode(),
+            headers={**headers, "Content-Type": "application/x-ndjson"},
+        )
+
+    records = _records(response)
+    assert [r["type"] for r in records] == ["detail"] * 4 + ["summary"]
+    assert records[-1]["batch_id"] == batch_id
+    assert records[-1]["successful"] == 4
+
+
+def test_ndjson_streaming_reports_invalid_line_as_error_record():
+    """Garante que, com a resposta ja iniciada, uma linha invalida vira registro de erro."""
+    body = b'{"batch_id": "bad"}\n{"external_id": "", "user_id": "u1", "amount_cents": 1, "pix_key": "k"}\n'
+
+    response = client.post(
+        "/api/v1/payouts/batch/ndjson?stream=true",
+        content=body,
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+
+    records = _records(response)
+    assert records[-1]["type"] == "error"
+    assert records[-1]["line"] == 2
+    assert records[-1]["processed_before_error"] == 0
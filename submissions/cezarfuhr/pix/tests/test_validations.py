@@ -74,3 +74,14 @@ def test_payout_item_accepts_valid_data():
     )
     assert item.external_id == "valid-id"
     assert item.amount_cents == 50000
+
+
+def test_payout_batch_rejects_repeated_id_with_different_amount():
+    """Garante que um id repetido com outro valor invalida o lote, e com o mesmo valor e aceito."""
+    item = dict(external_id="same-id", user_id="u1", pix_key="a@a.com")
+    with pytest.raises(ValidationError) as exc_info:
+        PayoutBatch(batch_id="batch-1", items=[{**item, "amount_cents": 100}, {**item, "amount_cents": 200}])
+    assert "same-id" in str(exc_info.value)
+
+    batch = PayoutBatch(batch_id="batch-1", items=[{**item, "amount_cents": 100}, {**item, "amount_cents": 100}])
+    assert len(batch.items) == 2
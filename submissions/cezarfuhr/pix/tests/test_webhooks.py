@@ -0,0 +1,148 @@
+import os
+os.environ['API_KEY'] = 'test-key'
+
+import json
+import time
+from datetime import datetime
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from app.core.config import settings
+from app.database import Base
+from app.models import PayoutBatch, PayoutItem, WebhookOutboxDB
+from app.retries import RetryScheduler
+from app.services import PayoutService
+from app.settlement import SettlementEngine
+from app.webhook_sink import create_app
+from app.webhooks import WebhookDispatcher, sign, verify_signature
+
+SUBSCRIBERS = {"erp": {"url": "http://sink/webhooks", "secret": "s3cr3t"}}
+
+
+class ScriptedProvider:
+    name = "simulated"
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+
+    def pay(self, item):
+        return item.external_id not in self.failing
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """Banco SQLite em arquivo, com um assinante configurado e retentativas vencendo imediatamente."""
+    monkeypatch.setattr(settings, "WEBHOOK_SUBSCRIBERS", SUBSCRIBERS)
+    monkeypatch.setattr(settings, "WEBHOOK_RETRY_BASE_DELAY_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY_SECONDS", 0.0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'webhooks.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _settle(session_factory, batch_id, count, failing=()):
+    db = session_factory()
+    try:
+        service = PayoutService(
+            db_session=db,
+            provider=ScriptedProvider(failing),
+            engine=SettlementEngine(max_in_flight=4, timeout_seconds=1),
+        )
+        return service.process_batch(PayoutBatch(
+            batch_id=batch_id,
+            items=[
+                PayoutItem(external_id=f"{batch_id}-{i}", user_id="u1", amount_cents=100 + i, pix_key="a@a.com")
+                for i in range(count)
+            ],
+        ))
+    finally:
+        db.close()
+
+
+def _outbox(session_factory):
+    db = session_factory()
+    try:
+        return db.execute(select(WebhookOutboxDB).order_by(WebhookOutboxDB.id)).scalars().all()
+    finally:
+        db.close()
+
+
+def _dispatcher(session_factory, sink, **kwargs):
+    return WebhookDispatcher(session_factory=session_factory, subscribers=SUBSCRIBERS, client=TestClient(sink), **kwargs)
+
+
+def test_settlement_writes_one_event_per_outcome(session_factory):
+    """Garante eventos paid/failed no outbox e nenhum evento novo para duplicatas."""
+    _settle(session_factory, "wh", 3, failing={"wh-1"})
+    _settle(session_factory, "wh", 3, failing={"wh-1"})
+
+    events = [(e.event_type, e.external_id, e.subscriber, e.status) for e in _outbox(session_factory)]
+    assert sorted(events) == [
+        ("payout.failed", "wh-1", "erp", "pending"),
+        ("payout.failed", "wh-1", "erp", "pending"),
+        ("payout.paid", "wh-0", "erp", "pending"),
+        ("payout.paid", "wh-2", "erp", "pending"),
+    ]
+
+
+def test_no_subscribers_writes_nothing(session_factory, monkeypatch):
+    """Garante que, sem assinantes, a liquidacao nao grava nada no outbox."""
+    monkeypatch.setattr(settings, "WEBHOOK_SUBSCRIBERS", {})
+    _settle(session_factory, "quiet", 3, failing={"quiet-1"})
+
+    assert _outbox(session_factory) == []
+
+
+def test_dispatcher_coalesces_signed_batches(session_factory):
+    """Garante POSTs assinados com ate WEBHOOK_BATCH_SIZE eventos e os eventos marcados como entregues."""
+    _settle(session_factory, "batch", 5)
+    sink = create_app("s3cr3t")
+
+    assert _dispatcher(session_factory, sink, batch_size=2).run(drain=True) == 5
+
+    received = TestClient(sink).get("/events").json()
+    assert received["posts"] == 3
+    assert sorted(event["data"]["external_id"] for event in received["events"]) == [f"batch-{i}" for i in range(5)]
+    assert {event["type"] for event in received["events"]} == {"payout.paid"}
+    assert {event.status for event in _outbox(session_factory)} == {"delivered"}
+
+
+def test_rejected_delivery_is_retried_then_dead(session_factory, monkeypatch):
+    """Garante reagendamento com backoff a cada recusa e `dead` ao atingir WEBHOOK_MAX_ATTEMPTS."""
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_ATTEMPTS", 3)
+    _settle(session_factory, "down", 1)
+    dispatcher = _dispatcher(session_factory, create_app("s3cr3t", fail_rate=1.0))
+
+    assert dispatcher.run_once() == 1
+    event = _outbox(session_factory)[0]
+    assert (event.status, event.attempts) == ("pending", 1)
+    assert event.next_attempt_at <= datetime.utcnow()
+
+    dispatcher.run(drain=True)
+    event = _outbox(session_factory)[0]
+    assert (event.status, event.attempts) == ("dead", 3)
+
+
+def test_exhausted_retry_emits_failed_permanently(session_factory, monkeypatch):
+    """Garante o evento `payout.failed_permanently` quando a retentativa esgota as tentativas."""
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 2)
+    _settle(session_factory, "exhaust", 1, failing={"exhaust-0"})
+
+    scheduler = RetryScheduler(session_factory=session_factory, providers={"simulated": ScriptedProvider({"exhaust-0"})})
+    scheduler.run(drain=True)
+
+    assert [e.event_type for e in _outbox(session_factory)] == ["payout.failed", "payout.failed_permanently"]
+
+
+def test_signature_verification():
+    """Garante que o receptor recusa corpo alterado, segredo errado e timestamp antigo."""
+    body = json.dumps({"events": []}).encode()
+    now = int(time.time())
+
+    assert verify_signature("k", sign("k", now, body), body)
+    assert not verify_signature("k", sign("k", now, body), body + b" ")
+    assert not verify_signature("other", sign("k", now, body), body)
+    assert not verify_signature("k", sign("k", now - 3600, body), body)
+    assert not verify_signature("k", "garbage", body)